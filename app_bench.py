@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+アプリ本体（保存・栄養計算・画面描画）のベンチマーク
+- 合成データ（利用者数・年数・1区分あたりの品目数・古い形式の割合・ミッション達成率・フィードバックの長さ）を作り、
+  利用者ごとのディレクトリ（storage.find_user_dirs と同じ形）に書き出して測る
+- 測るもの:
+    storage.load_app / storage.save_app   利用者ごとの app_data.json の読み書き
+    nutrition.calc_nutrition              1日分の栄養計算（全日分を呼ぶ）
+    meal.normalize                        古い形式の記録を含む全日分の正規化（app_store が共有の内容を読み込んだときに1回）
+    render.<画面>                         AppTest（Streamlit のヘッドレス実行）で file.py を描画し直す時間
+- 結果は JSON で保存し（--out）、--baseline の結果と p50 を比べて、閾値を超えて遅くなった項目を回帰として表示する
+  （回帰があれば終了コード 1）
+
+使い方:
+    python app_bench.py --users 3 --years 2
+    python app_bench.py --years 3 --out bench_results/base.json
+    python app_bench.py --years 3 --baseline bench_results/base.json --threshold 1.25
+    python app_bench.py --skip-render --json
+"""
+
+import argparse, copy, datetime, json, os, platform, random, sys, tempfile, time
+
+import llm
+import nutrition
+import storage
+from llm_ledger import percentile
+
+FOODS = ["ごはん", "パン", "パスタ", "魚", "肉", "鶏肉", "卵", "サラダ", "ヨーグルト", "味噌汁",
+         "プロテイン", "サンドイッチ", "ハンバーグ", "揚げ物", "お菓子", "バナナ", "うどん", "そば"]
+INTAKES = ["少なめ", "普通", "多め"]
+SLOTS = ["朝食", "昼食", "夕食", "間食"]
+PAGES = ["meal", "feedback", "today_mission_display", "mission_history", "feedback_history"]
+FEEDBACK_PHRASES = ["主食と主菜がそろっていて良いバランスです。", "野菜を意識して取り入れられている点が素晴らしいです。",
+                    "間食は量を決めて楽しむと続けやすくなります。", "たんぱく質がやや少なめなので、卵や魚を足してみましょう。"]
+
+
+# -------------------------
+# 合成データ
+# -------------------------
+def synth_user(rng, i):
+    return {"birth": f"{rng.randint(1960, 2005)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+            "gender": rng.choice(["男性", "女性", "その他"]), "region": "東京都",
+            "age": rng.randint(18, 65), "self_esteem_level": rng.choice(["高", "低"]), "user_id": f"bench{i}"}
+
+
+def synth_app(rng, years=1, items_per_slot=3, legacy_ratio=0.1, mission_done_rate=0.6,
+              feedback_chars=200, feedback_rate=0.8, end=None):
+    """years 年分の毎日の記録。legacy_ratio の割合の品目は古い形式（文字列だけ）で入れる"""
+    end = end or datetime.date.today()
+    app = storage.empty_app()
+    for n in range(int(years * 365)):
+        day = (end - datetime.timedelta(days=n)).isoformat()
+        meals = {}
+        for slot in SLOTS:
+            items = []
+            for _ in range(rng.randint(0, items_per_slot)):
+                food = rng.choice(FOODS)
+                items.append(food if rng.random() < legacy_ratio else {"item": food, "intake": rng.choice(INTAKES)})
+            meals[slot] = items
+        app["meal_data"][day] = meals
+        auto = rng.sample(llm.MISSION_FALLBACK, len(llm.MISSION_FALLBACK))
+        app["missions"][day] = {"auto": auto, "custom": [], "selected": auto[0],
+                                "status": {auto[0]: rng.random() < mission_done_rate}}
+        if rng.random() < feedback_rate:
+            text = ""
+            while len(text) < feedback_chars:
+                text += rng.choice(FEEDBACK_PHRASES)
+            app["feedback"][day] = {"text": text[:feedback_chars], "meta": {
+                "age": 30, "gender": "女性", "self_esteem": "高", "selected_mission": auto[0],
+                "nutrient_totals": {"タンパク質": 50.0, "脂質": 40.0, "炭水化物": 200.0, "cal": 1600.0, "塩分": 6.0},
+                "tendencies": []}}
+    return app
+
+
+def write_dataset(root, users=1, seed=0, **kw):
+    """root/user000/ ... に user_data.json / app_data.json を書く。Returns 利用者ディレクトリのリスト"""
+    rng = random.Random(seed)
+    dirs = []
+    for i in range(users):
+        d = os.path.join(root, f"user{i:03d}")
+        os.makedirs(d, exist_ok=True)
+        storage.save_user(synth_user(rng, i), os.path.join(d, storage.USER_FILE))
+        storage.save_app(synth_app(rng, **kw), os.path.join(d, storage.APP_FILE))
+        dirs.append(d)
+    return dirs
+
+
+# -------------------------
+# 計測
+# -------------------------
+def _timeit(fn, repeat):
+    xs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        xs.append(time.perf_counter() - t0)
+    return xs
+
+
+def summarize(xs):
+    return {
+        "n": len(xs),
+        "p50_ms": round(percentile(xs, 50) * 1000, 3),
+        "p95_ms": round(percentile(xs, 95) * 1000, 3),
+        "mean_ms": round(sum(xs) / len(xs) * 1000, 3) if xs else 0.0,
+    }
+
+
+def bench_storage(dirs, repeat):
+    loads, saves = [], []
+    for d in dirs:
+        path = os.path.join(d, storage.APP_FILE)
+        loads += _timeit(lambda: storage.load_app(path), repeat)
+        data = storage.load_app(path)
+        saves += _timeit(lambda: storage.save_app(data, path), repeat)
+    return {"storage.load_app": loads, "storage.save_app": saves}
+
+
+def bench_nutrition(dirs):
+    xs = []
+    for d in dirs:
+        app = storage.normalize_meal_data(storage.load_app(os.path.join(d, storage.APP_FILE))["meal_data"])
+        for meals in app.values():
+            t0 = time.perf_counter()
+            nutrition.calc_nutrition(meals)
+            xs.append(time.perf_counter() - t0)
+    return {"nutrition.calc_nutrition": xs}
+
+
+def bench_normalize(dirs, repeat):
+    xs = []
+    for d in dirs:
+        md = storage.load_app(os.path.join(d, storage.APP_FILE))["meal_data"]
+        for _ in range(repeat):
+            work = copy.deepcopy(md)
+            t0 = time.perf_counter()
+            storage.normalize_meal_data(work)
+            xs.append(time.perf_counter() - t0)
+    return {"meal.normalize": xs}
+
+
+def bench_render(user_dir, repeat, pages=PAGES, timeout=120):
+    """user_dir をカレントディレクトリにして file.py を AppTest で描画する（画面ごとに1回空回ししてから repeat 回）"""
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "file.py")
+    cwd = os.getcwd()
+    os.chdir(user_dir)
+    try:
+        at = AppTest.from_file(app_path, default_timeout=timeout)
+        at.run()
+        out = {}
+        for page in pages:
+            at.session_state["model"].nav.page = page
+            at.run()
+            if at.exception:
+                raise RuntimeError(f"{page}: {at.exception[0].message}")
+            out[f"render.{page}"] = _timeit(at.run, repeat)
+    finally:
+        os.chdir(cwd)
+    return out
+
+
+def run_bench(root, users=1, repeat=5, render=True, render_repeat=5, seed=0, **kw):
+    dirs = write_dataset(root, users=users, seed=seed, **kw)
+    raw = {}
+    raw.update(bench_storage(dirs, repeat))
+    raw.update(bench_nutrition(dirs))
+    raw.update(bench_normalize(dirs, repeat))
+    if render:
+        raw.update(bench_render(dirs[0], render_repeat))
+    size = os.path.getsize(os.path.join(dirs[0], storage.APP_FILE))
+    return {
+        "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "dataset": {"users": users, "seed": seed, "app_json_bytes": size, **kw},
+        "results": {k: summarize(v) for k, v in raw.items()},
+    }
+
+
+# -------------------------
+# ベースラインとの比較
+# -------------------------
+def compare(result, baseline, threshold=1.25, min_delta_ms=0.5):
+    """p50 が baseline の threshold 倍を超え、かつ min_delta_ms 以上遅くなった項目を回帰とする"""
+    rows = []
+    base = baseline.get("results", {})
+    for name, r in result["results"].items():
+        b = base.get(name)
+        if not b:
+            rows.append({"name": name, "p50_ms": r["p50_ms"], "base_ms": None, "ratio": None, "regression": False})
+            continue
+        ratio = r["p50_ms"] / b["p50_ms"] if b["p50_ms"] else None
+        regression = ratio is not None and ratio > threshold and r["p50_ms"] - b["p50_ms"] >= min_delta_ms
+        rows.append({"name": name, "p50_ms": r["p50_ms"], "base_ms": b["p50_ms"],
+                     "ratio": round(ratio, 3) if ratio is not None else None, "regression": regression})
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="保存・栄養計算・画面描画のベンチマーク（合成データ）")
+    ap.add_argument("--users", type=int, default=1, help="利用者数（既定: 1）")
+    ap.add_argument("--years", type=float, default=1, help="毎日の記録の年数（既定: 1）")
+    ap.add_argument("--items-per-slot", type=int, default=3, help="1区分あたりの品目数の上限（既定: 3）")
+    ap.add_argument("--legacy-ratio", type=float, default=0.1, help="古い形式（文字列だけ）の品目の割合（既定: 0.1）")
+    ap.add_argument("--mission-done-rate", type=float, default=0.6, help="ミッション達成の割合（既定: 0.6）")
+    ap.add_argument("--feedback-chars", type=int, default=200, help="フィードバック本文の文字数（既定: 200）")
+    ap.add_argument("--feedback-rate", type=float, default=0.8, help="フィードバックがある日の割合（既定: 0.8）")
+    ap.add_argument("--repeat", type=int, default=5, help="保存・正規化の繰り返し回数（既定: 5）")
+    ap.add_argument("--render-repeat", type=int, default=5, help="画面ごとの描画回数（既定: 5）")
+    ap.add_argument("--skip-render", action="store_true", help="AppTest での描画を測らない")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="結果の JSON の保存先")
+    ap.add_argument("--baseline", help="比べる結果の JSON")
+    ap.add_argument("--threshold", type=float, default=1.25, help="回帰とみなす p50 の倍率（既定: 1.25）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = ap.parse_args(argv)
+
+    # 描画中の LLM 台帳・計測ファイルは書かない
+    os.environ["LLM_LEDGER_PATH"] = ""
+    os.environ.pop("TRACE_PATH", None)
+    with tempfile.TemporaryDirectory() as root:
+        result = run_bench(root, users=args.users, repeat=args.repeat, render=not args.skip_render,
+                           render_repeat=args.render_repeat, seed=args.seed,
+                           years=args.years, items_per_slot=args.items_per_slot, legacy_ratio=args.legacy_ratio,
+                           mission_done_rate=args.mission_done_rate, feedback_chars=args.feedback_chars,
+                           feedback_rate=args.feedback_rate)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    rows = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            rows = compare(result, json.load(f), threshold=args.threshold)
+        result["comparison"] = rows
+    regressions = [r for r in rows or [] if r["regression"]]
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 1 if regressions else 0
+    ds = result["dataset"]
+    print(f"利用者 {ds['users']} 人 × {ds['years']} 年（app_data.json {ds['app_json_bytes'] / 1024:.0f} KiB / 人）")
+    print(f"{'項目':28} {'回数':>6} {'p50(ms)':>10} {'p95(ms)':>10}" + (f" {'基準(ms)':>10} {'比':>7}" if rows else ""))
+    cmp_by = {r["name"]: r for r in rows or []}
+    for name, r in result["results"].items():
+        line = f"{name:28} {r['n']:>6} {r['p50_ms']:>10.3f} {r['p95_ms']:>10.3f}"
+        c = cmp_by.get(name)
+        if c and c["base_ms"] is not None:
+            line += f" {c['base_ms']:>10.3f} {c['ratio'] or 0:>6.2f}x" + ("  ← 回帰" if c["regression"] else "")
+        print(line)
+    if args.baseline:
+        print(f"回帰 {len(regressions)} 件（p50 が基準の {args.threshold} 倍超）")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+アプリの初期化をプロセスで1回だけ行う
+- Streamlit は操作のたびに file.py を頭から実行し直すので、.env / secrets の読み込み・OpenAI クライアント作成・
+  CSS の読み込み（build_assets.py で圧縮済みのもの）・静的データの用意はここで1度だけ行い、file.py は get() で結果を受け取るだけにする
+- このモジュールは import キャッシュされるので、プロセス内の全セッションで同じ初期化結果を共有する
+- 初期化の手順ごとの所要時間と、再実行（rerun）1回ごとの所要時間（全体 / st.fragment 単位）を記録して report() で返す
+
+使い方（起動コストと再実行コストの計測）:
+    python app_bootstrap.py                 # AppTest で画面を --reruns 回描画して集計
+    python app_bootstrap.py --reruns 50 --json
+"""
+
+import argparse, collections, json, os, sys, threading, time
+
+from llm_ledger import percentile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PREFECTURES = (
+ "北海道","青森県","岩手県","宮城県","秋田県","山形県","福島県",
+ "茨城県","栃木県","群馬県","埼玉県","千葉県","東京都","神奈川県",
+ "新潟県","富山県","石川県","福井県","山梨県","長野県",
+ "岐阜県","静岡県","愛知県","三重県",
+ "滋賀県","京都府","大阪府","兵庫県","奈良県","和歌山県",
+ "鳥取県","島根県","岡山県","広島県","山口県",
+ "徳島県","香川県","愛媛県","高知県",
+ "福岡県","佐賀県","長崎県","熊本県","大分県","宮崎県","鹿児島県","沖縄県"
+)
+
+
+class Bootstrap:
+    """初期化結果。属性は読み取り専用として扱う"""
+    __slots__ = ("api_key_present", "base_url", "client", "openai_client_inited", "css", "debug", "timings_ms")
+
+
+def _read_secrets():
+    """Streamlit の secrets（無ければ空）。secrets.toml が無いと例外になるので握りつぶす"""
+    try:
+        import streamlit as st
+        return {k: st.secrets.get(k) for k in ("OPENAI_KEY", "OPENAI_BASE_URL", "APP_DEBUG")}
+    except Exception:
+        return {}
+
+
+def _load_css():
+    """build_assets.py で作った static/app.min.css（フォント込み）。無い・古いときは app.css をその場で圧縮する"""
+    import build_assets
+    if os.path.exists(build_assets.CSS_OUT) and os.path.getmtime(build_assets.CSS_OUT) >= os.path.getmtime(build_assets.CSS_SRC):
+        with open(build_assets.CSS_OUT, "r", encoding="utf-8") as f:
+            css = f.read()
+    else:
+        css = build_assets.build_css()
+    return f"<style>{css}</style>"
+
+
+def _build():
+    import llm
+    from dotenv import load_dotenv
+    import nutrition
+
+    b = Bootstrap()
+    timings = {}
+
+    def step(name, fn):
+        t0 = time.perf_counter()
+        out = fn()
+        timings[name] = round((time.perf_counter() - t0) * 1000, 2)
+        return out
+
+    step("dotenv", load_dotenv)
+    secrets = step("secrets", _read_secrets)
+    api_key = secrets.get("OPENAI_KEY")
+    b.api_key_present = bool(api_key)
+    b.base_url = secrets.get("OPENAI_BASE_URL")
+    b.client, b.openai_client_inited = step("openai_client", lambda: llm.make_client(api_key, b.base_url))
+    b.css = step("css", _load_css)
+    step("nutrition_index", nutrition.build_index)
+    b.debug = str(secrets.get("APP_DEBUG") or os.getenv("APP_DEBUG", "")).lower() in ("1", "true", "yes")
+    b.timings_ms = timings
+    return b
+
+
+_lock = threading.Lock()
+_boot = None
+_boot_ms = None
+
+
+def get():
+    """初期化済みの Bootstrap を返す（初回の呼び出しだけ初期化する）"""
+    global _boot, _boot_ms
+    if _boot is not None:
+        return _boot
+    with _lock:
+        if _boot is None:
+            t0 = time.perf_counter()
+            _boot = _build()
+            _boot_ms = round((time.perf_counter() - t0) * 1000, 2)
+    return _boot
+
+
+def reset():
+    """secrets / .env を読み直したいとき用（次の get() で初期化し直す）"""
+    global _boot, _boot_ms
+    with _lock:
+        _boot = None
+        _boot_ms = None
+
+
+# -------------------------
+# 再実行（rerun）ごとの所要時間
+# -------------------------
+# scope: "app" はスクリプト全体の再実行、それ以外（"meal:朝食" など）は st.fragment 単位の再実行
+_reruns = {}
+_reruns_lock = threading.Lock()
+
+
+def record_rerun(seconds, scope="app"):
+    with _reruns_lock:
+        q = _reruns.get(scope)
+        if q is None:
+            q = _reruns[scope] = collections.deque(maxlen=1000)
+        q.append(seconds)
+
+
+_navigations = collections.deque(maxlen=1000)
+
+
+def record_navigation(runs):
+    """ページ遷移1回にかかったスクリプト実行回数"""
+    with _reruns_lock:
+        _navigations.append(runs)
+
+
+def _summary_ms(xs):
+    return {
+        "p50": round(percentile(xs, 50) * 1000, 2),
+        "p95": round(percentile(xs, 95) * 1000, 2),
+        "max": round(max(xs) * 1000, 2) if xs else 0.0,
+    }
+
+
+def report():
+    with _reruns_lock:
+        by_scope = {k: list(q) for k, q in _reruns.items()}
+        navs = list(_navigations)
+    xs = by_scope.pop("app", [])
+    return {
+        "bootstrap_ms": _boot_ms,
+        "bootstrap_steps_ms": dict(_boot.timings_ms) if _boot is not None else {},
+        "reruns": len(xs),
+        "rerun_ms": _summary_ms(xs),
+        "fragments": {k: {"reruns": len(v), "rerun_ms": _summary_ms(v)} for k, v in sorted(by_scope.items())},
+        "navigations": len(navs),
+        "runs_per_navigation": round(sum(navs) / len(navs), 2) if navs else 0.0,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="起動時の初期化コストと再実行ごとのコストを計測する")
+    ap.add_argument("--reruns", type=int, default=20, help="AppTest で描画し直す回数（既定: 20）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = ap.parse_args(argv)
+
+    # AppTest から実行される file.py が使う方のモジュールで集計する
+    import tempfile
+    import app_bootstrap
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(tempfile.mkdtemp())
+    t0 = time.perf_counter()
+    at = AppTest.from_file(os.path.join(APP_DIR, "file.py"), default_timeout=60)
+    at.run()
+    first_ms = round((time.perf_counter() - t0) * 1000, 2)
+    for _ in range(args.reruns):
+        at.run()
+    result = {"first_run_ms": first_ms, **app_bootstrap.report()}
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    print(f"初回描画 {result['first_run_ms']}ms（うち初期化 {result['bootstrap_ms']}ms）")
+    for name, ms in result["bootstrap_steps_ms"].items():
+        print(f"  {name:16} {ms:>8.2f}ms")
+    r = result["rerun_ms"]
+    print(f"再実行 {result['reruns']} 回  p50 {r['p50']}ms  p95 {r['p95']}ms  max {r['max']}ms")
+    if result["navigations"]:
+        print(f"ページ遷移 {result['navigations']} 回  1回あたりのスクリプト実行 {result['runs_per_navigation']} 回")
+    for scope, f in result["fragments"].items():
+        r = f["rerun_ms"]
+        print(f"  [{scope}] {f['reruns']} 回  p50 {r['p50']}ms  p95 {r['p95']}ms  max {r['max']}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+app_data のセッション間共有（コピーオンライト）とメモリの計上・上限
+- これまでは各セッションが app_data.json 全体（フィードバック本文を含む全履歴）を自分用に読み込んでいたので、
+  サーバのメモリが セッション数 × 履歴の大きさ で増えていた
+- ここでは読み込んだ内容をプロセスで1つだけ持ち（ファイルごと・更新時刻が変わったら読み直す）、各セッションの
+  app_data は missions / meal_data / feedback の各区分を CowSection で包んだものにする
+    section.get(day) / items() / values()   共有の内容をそのまま返す（読み取り専用として扱う）
+    section[day] / setdefault(day, ...)      その日の分だけ自分用にコピーしてから返す（書き換えはこちら）
+- save() は共有の内容と自分の書き換えを合わせて保存し、それを新しい共有の内容にする。他のセッションは
+  次の再実行の touch() で新しい内容に乗り換える（自分の未保存の書き換えは残す）
+- 履歴画面の月別索引（date_index.DateIndex）は共有の内容の版ごとに1回だけ作って持ち、セッションの書き換えた日は
+  その上で足し引きする。save() は新しい共有の内容の索引を、前の索引と書き換えた日から作る（全日をたどり直さない）
+- 古い形式の食事記録の正規化は、共有の内容を読み込んだときに1回だけ行う。共有の meal_data の各日は
+  meal_pack.PackedDay（品目名を番号にして1日分を1つの配列に詰めたもの）で持ち、自分用にコピーするときに dict に戻す
+- メモリの計上：共有分とセッションごとの自分用コピーの大きさ（deep_sizeof）、共有で節約できた分。
+  APP_TRACEMALLOC=1 なら tracemalloc も使い、再実行ごとの確保量を記録する
+- 上限：APP_SESSION_IDLE_SECONDS（既定 300 秒）使われていないセッションと、自分用コピーの合計が
+  APP_SESSION_PRIVATE_CAP_KB（既定 8192）を超えたときは古いセッションから、保存済みで共有と同じになった
+  自分用コピーを捨てる（未保存の書き換えは捨てない）
+"""
+
+import contextlib, copy, os, threading, time, tracemalloc, weakref
+from collections.abc import MutableMapping
+
+import daily_metrics
+import meal_pack
+import storage
+from date_index import DateIndex
+from session_model import deep_sizeof
+
+SECTIONS = ("missions", "meal_data", "feedback")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+IDLE_SECONDS = _env_int("APP_SESSION_IDLE_SECONDS", 300)
+PRIVATE_CAP_BYTES = _env_int("APP_SESSION_PRIVATE_CAP_KB", 8192) * 1024
+# 上限の確認はこの間隔より頻繁には行わない（自分用コピーの大きさを数えるのにも時間がかかるので）
+ENFORCE_INTERVAL = 5.0
+# 合計の上限を超えていても、最後に使われてからこれより短いセッションの分は捨てない
+MIN_IDLE_SECONDS = 10.0
+
+
+class CowSection(MutableMapping):
+    """日付キーの区分。共有の dict（_base）の上に、このセッションが書き換えた日だけを持つ（_own）"""
+    __slots__ = ("_base", "_own", "_deleted")
+
+    def __init__(self, base):
+        self._base = base
+        self._own = {}
+        self._deleted = set()
+
+    def __getitem__(self, day):
+        v = self._own.get(day)
+        if v is not None or day in self._own:
+            return v
+        if day in self._deleted:
+            raise KeyError(day)
+        v = self._own[day] = copy.deepcopy(self._base[day])
+        return v
+
+    def get(self, day, default=None):
+        """読み取り用（共有の内容をコピーせずに返す。書き換えないこと）"""
+        if day in self._own:
+            return self._own[day]
+        if day in self._deleted:
+            return default
+        return self._base.get(day, default)
+
+    def __setitem__(self, day, value):
+        self._own[day] = value
+        self._deleted.discard(day)
+
+    def __delitem__(self, day):
+        if day not in self:
+            raise KeyError(day)
+        self._own.pop(day, None)
+        if day in self._base:
+            self._deleted.add(day)
+
+    def __contains__(self, day):
+        return day in self._own or (day in self._base and day not in self._deleted)
+
+    def __iter__(self):
+        yield from self._own
+        for day in self._base:
+            if day not in self._own and day not in self._deleted:
+                yield day
+
+    def __len__(self):
+        return len(self._own) + sum(1 for d in self._base if d not in self._own and d not in self._deleted)
+
+    def items(self):
+        return [(day, self.get(day)) for day in self]
+
+    def values(self):
+        return [self.get(day) for day in self]
+
+    def changed_days(self, keep=None):
+        """共有の内容から見た (足す日, 除く日)。keep(値) が偽の日は除く側"""
+        add, remove = [], list(self._deleted)
+        for day, v in self._own.items():
+            (add if keep is None or keep(v) else remove).append(day)
+        return add, remove
+
+    def merged(self):
+        """保存用の dict（共有の内容 + 自分の書き換え）"""
+        out = {d: v for d, v in self._base.items() if d not in self._deleted and d not in self._own}
+        out.update(self._own)
+        return out
+
+    def rebase(self, base):
+        """共有の内容を新しいものに替える。古い共有と同じままの自分用コピーは捨てる（未保存の書き換えは残す）"""
+        self.drop_clean()
+        self._base = base
+
+    def drop_clean(self):
+        """共有と同じ内容の自分用コピーを捨てる。Returns 捨てた分のおおよそのバイト数"""
+        freed = 0
+        for day in [d for d, v in self._own.items() if d in self._base and self._base[d] == v]:
+            freed += deep_sizeof(self._own.pop(day))
+        return freed
+
+    def private_bytes(self):
+        return deep_sizeof(self._own) + deep_sizeof(self._deleted)
+
+    def __sizeof__(self):
+        # session_model.memory_report などで共有分を数えないように、自分用の分だけを返す
+        return object.__sizeof__(self) + self.private_bytes()
+
+    def __repr__(self):
+        return f"CowSection(own={len(self._own)}, shared={len(self._base)})"
+
+
+class SessionAppData(dict):
+    """1セッションの app_data。各区分は CowSection。info は AppStore が使う（読み込み元・最終利用時刻など）"""
+    __slots__ = ("info", "__weakref__")
+
+    def private_bytes(self):
+        return sum(v.private_bytes() for v in self.values() if isinstance(v, CowSection))
+
+    def to_plain(self):
+        out = {k: v.merged() if isinstance(v, CowSection) else v for k, v in self.items()}
+        if "meal_data" in out:
+            out["meal_data"] = {d: meal_pack.plain(v) for d, v in out["meal_data"].items()}
+        return out
+
+
+class _Shared:
+    __slots__ = ("version", "mtime", "data", "bytes", "indexes")
+
+    def __init__(self, version, mtime, data, indexes=None):
+        self.version = version
+        self.mtime = mtime
+        self.data = data
+        self.bytes = deep_sizeof(data)
+        # (区分, keep) → この版の内容の DateIndex
+        self.indexes = indexes if indexes is not None else {}
+
+
+class AppStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shared = {}
+        self._version = 0
+        # セッションの app_data（セッションが終わって捨てられたら自動で外れる）
+        self._sessions = weakref.WeakValueDictionary()
+        self._last_enforce = 0.0
+        self._evictions = 0
+        self._evicted_bytes = 0
+        if os.getenv("APP_TRACEMALLOC", "") in ("1", "true", "yes") and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # -------------------------
+    # 共有の内容
+    # -------------------------
+    def _load_shared(self, path):
+        """path の共有の内容（ファイルが更新されていれば読み直す）"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        with self._lock:
+            sh = self._shared.get(path)
+            if sh is not None and sh.mtime == mtime:
+                return sh
+        data = storage.load_app(path)
+        for name in SECTIONS:
+            data.setdefault(name, {})
+        storage.normalize_meal_data(data["meal_data"])
+        data["meal_data"] = meal_pack.pack_meal_data(data["meal_data"])
+        with self._lock:
+            sh = self._shared.get(path)
+            if sh is None or sh.mtime != mtime:
+                self._version += 1
+                sh = self._shared[path] = _Shared(self._version, mtime, data)
+            return sh
+
+    def _attach(self, app, path, sh):
+        for name in SECTIONS:
+            sec = app.get(name)
+            if isinstance(sec, CowSection):
+                sec.rebase(sh.data[name])
+            else:
+                app[name] = CowSection(sh.data[name])
+        for k, v in sh.data.items():
+            if k not in SECTIONS and k not in app:
+                app[k] = copy.deepcopy(v)
+        if not hasattr(app, "info"):
+            app.info = {"path": path, "version": 0, "last_used": 0.0, "alloc": None}
+            self._sessions[id(app)] = app
+        app.info["version"] = sh.version
+        app.info["last_used"] = time.time()
+
+    def open(self, path=storage.APP_FILE):
+        """セッション用の app_data（共有の内容を参照するだけで、全体はコピーしない）"""
+        path = os.path.abspath(path)
+        app = SessionAppData()
+        self._attach(app, path, self._load_shared(path))
+        return app
+
+    def touch(self, app):
+        """再実行の始め：共有の内容が新しくなっていれば乗り換え、ときどき上限を確認する"""
+        info = getattr(app, "info", None)
+        if info is None:
+            return
+        sh = self._load_shared(info["path"])
+        if sh.version != info["version"]:
+            self._attach(app, info["path"], sh)
+        info["last_used"] = time.time()
+        now = time.monotonic()
+        if now - self._last_enforce >= ENFORCE_INTERVAL:
+            self._last_enforce = now
+            self.enforce(current=app)
+
+    def save(self, app, path=None):
+        """
+        保存して、保存した内容を新しい共有の内容にする（自分用コピーは共有とは別のままにする）。
+        同じファイルへの保存は storage.path_lock で順番にし、その中で最新の共有の内容（他のセッション・
+        バッチ処理が保存した分）に乗り換えてから、このセッションの書き換えた日だけを重ねて書く
+        """
+        info = getattr(app, "info", None)
+        path = os.path.abspath(path or (info["path"] if info else storage.APP_FILE))
+        with storage.path_lock(path):
+            self._save_locked(app, path, info)
+
+    def _save_locked(self, app, path, info):
+        prev_stamp = daily_metrics.source_stamp(path)
+        if not isinstance(app, SessionAppData):
+            storage.save_app(app, path)
+            self._sync_metrics(path, app, None, prev_stamp)
+            return
+        # on_click のコールバックは再実行の touch() より先に動くので、ここで最新に乗り換える
+        sh = self._load_shared(path)
+        if info is None or info["path"] != path or sh.version != info["version"]:
+            self._attach(app, path, sh)
+        plain = app.to_plain()
+        storage.save_app(plain, path)
+        changed = set()
+        for name in SECTIONS:
+            changed.update(app[name]._own)
+            changed.update(app[name]._deleted)
+        self._sync_metrics(path, plain, changed, prev_stamp)
+        # 共有側には書き換えた日のコピーを入れる（このセッションが後で自分用を書き換えても共有に響かないように）。
+        # 食事は詰めた形にする
+        shared = {k: v for k, v in plain.items() if k not in SECTIONS}
+        for name in SECTIONS:
+            sec = app[name]
+            shared[name] = sec.merged()
+            for day, v in sec._own.items():
+                packed = meal_pack.PackedDay.pack(v) if name == "meal_data" else None
+                shared[name][day] = packed if packed is not None else copy.deepcopy(v)
+        # 前の版で作ってあった索引は、書き換えた日だけを足し引きして引き継ぐ
+        indexes = {}
+        for (name, keep), index in list(sh.indexes.items()):
+            add, remove = app[name].changed_days(keep)
+            indexes[(name, keep)] = index.changed(add, remove) if add or remove else index
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        with self._lock:
+            self._version += 1
+            sh = self._shared[path] = _Shared(self._version, mtime, shared, indexes)
+        self._attach(app, path, sh)
+
+    def _sync_metrics(self, path, data, days, prev_stamp):
+        """日別指標の索引（daily_metrics.py）の書き換えた日の行を直す。失敗しても保存は止めない"""
+        try:
+            daily_metrics.sync(path, data, days, prev_stamp)
+        except (OSError, ValueError):
+            pass
+
+    def date_index(self, app, name, keep=None):
+        """
+        このセッションから見た区分 name の月別索引（keep(値) が偽の日は入れない）。
+        共有の内容の分は版ごとに1回だけ作り、自分の書き換えた日だけを足し引きする（再実行のたびに全日をたどらない）
+        """
+        sec = app.get(name)
+        if not isinstance(sec, CowSection):
+            return DateIndex.of(sec or {}, keep)
+        info = getattr(app, "info", None)
+        with self._lock:
+            sh = self._shared.get(info["path"]) if info else None
+        if sh is None or sh.data.get(name) is not sec._base:
+            # 共有の内容が新しくなっていて、このセッションがまだ乗り換えていない（次の touch() まで）
+            return DateIndex.of(sec, keep)
+        index = sh.indexes.get((name, keep))
+        if index is None:
+            index = sh.indexes[(name, keep)] = DateIndex.of(sec._base, keep)
+        add, remove = sec.changed_days(keep)
+        return index.changed(add, remove) if add or remove else index
+
+    def metrics(self, app):
+        """このセッションの利用者の日別指標（保存済みの内容）"""
+        info = getattr(app, "info", None)
+        path = info["path"] if info else os.path.abspath(storage.APP_FILE)
+        return daily_metrics.for_app(path, load=lambda: self._load_shared(path).data)
+
+    # -------------------------
+    # 上限・計上
+    # -------------------------
+    def enforce(self, current=None, idle_seconds=None, cap_bytes=None):
+        """使われていないセッションと、合計の上限を超えた分の自分用コピー（共有と同じもの）を捨てる"""
+        idle_seconds = IDLE_SECONDS if idle_seconds is None else idle_seconds
+        cap_bytes = PRIVATE_CAP_BYTES if cap_bytes is None else cap_bytes
+        now = time.time()
+        sessions = sorted((app for app in list(self._sessions.values()) if app is not current),
+                          key=lambda app: app.info["last_used"])
+        freed = 0
+        total = sum(app.private_bytes() for app in sessions)
+        for app in sessions:
+            idle = now - app.info["last_used"]
+            if idle < idle_seconds and total <= cap_bytes:
+                break
+            if idle < MIN_IDLE_SECONDS:
+                # 実行中かもしれないセッションには触らない
+                break
+            before = app.private_bytes()
+            for v in app.values():
+                if isinstance(v, CowSection):
+                    v.drop_clean()
+            got = before - app.private_bytes()
+            if got > 0:
+                freed += got
+                total -= got
+                self._evictions += 1
+        self._evicted_bytes += freed
+        return freed
+
+    @contextlib.contextmanager
+    def measure(self, app):
+        """APP_TRACEMALLOC=1 のとき、with の中（1回の再実行）で増えた確保量をこのセッションに記録する"""
+        info = getattr(app, "info", None)
+        if info is None or not tracemalloc.is_tracing():
+            yield
+            return
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            # 他のセッションの同時実行分も混ざるので目安
+            info["alloc"] = tracemalloc.get_traced_memory()[0] - before
+
+    def stats(self):
+        with self._lock:
+            shared = {p: {"version": sh.version, "bytes": sh.bytes} for p, sh in self._shared.items()}
+        sessions = list(self._sessions.values())
+        now = time.time()
+        per_session = [{"private_bytes": app.private_bytes(), "idle_s": round(now - app.info["last_used"], 1),
+                        "alloc_last_run": app.info["alloc"]}
+                       for app in sessions]
+        shared_bytes = sum(s["bytes"] for s in shared.values())
+        private = sum(s["private_bytes"] for s in per_session)
+        # 共有しなければ、各セッションが全体を1つずつ持っていた
+        full_copy = {p: sh["bytes"] for p, sh in shared.items()}
+        without_sharing = sum(full_copy.get(app.info["path"], 0) for app in sessions)
+        out = {
+            "sessions": len(sessions),
+            "shared_bytes": shared_bytes,
+            "private_bytes": private,
+            "bytes_saved": max(0, without_sharing - shared_bytes - private),
+            "evictions": self._evictions,
+            "evicted_bytes": self._evicted_bytes,
+            "caps": {"idle_seconds": IDLE_SECONDS, "private_cap_bytes": PRIVATE_CAP_BYTES},
+            "per_session": sorted(per_session, key=lambda s: -s["private_bytes"])[:20],
+        }
+        if tracemalloc.is_tracing():
+            cur, peak = tracemalloc.get_traced_memory()
+            out["tracemalloc"] = {"current_bytes": cur, "peak_bytes": peak}
+        return out
+
+
+# プロセス共有インスタンス
+STORE = AppStore()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+過去日のフィードバック一括生成（バックフィル）
+- meal_data に食事があるのに feedback が無い日を探し、画面と同じプロンプト（try_generate_feedback）で生成する
+- asyncio + 非同期クライアントで、同時実行数の上限つきでまとめて流す（レート制限・台帳はアプリと共通）。
+  複数の利用者も同時に進め、LLM の同時呼び出し数の上限（--concurrency）は全利用者で共有する
+- 利用者ごとの1日上限は画面用（LLM_USER_DAILY_REQUESTS）ではなく、バックフィル用の --user-daily-requests
+  （既定: LLM_BACKFILL_DAILY_REQUESTS、0 は無制限）を使う。上限に達した利用者はそこで止め、残りの日は
+  失敗とは数えずに次回に回す
+- 生成できた日は都度チェックポイント（<DIR>/feedback_backfill.ckpt.jsonl）に追記するので、中断しても再開できる
+- app_data への反映は storage.path_lock の中で 読み直し → 未生成の日だけ追加 → 一時ファイル経由で置き換え。
+  画面側の保存（app_store.AppStore.save）も同じロックの中で最新のファイルに乗り換えてから書くので、互いの分を消さない
+
+使い方:
+    python backfill_feedback.py --dry-run                    # 対象日を表示するだけ
+    python backfill_feedback.py data/u1 --concurrency 8
+    python backfill_feedback.py --users-root data --since 2026-09-01 --base-url http://127.0.0.1:8000/v1
+"""
+
+import argparse, asyncio, json, os, sys, time
+
+import llm
+import llm_ledger
+import ratelimit
+from nutrition import calc_nutrition
+from storage import USER_FILE, APP_FILE, find_user_dirs, load_user, load_app, save_app, path_lock
+
+CHECKPOINT_FILE = "feedback_backfill.ckpt.jsonl"
+MEALS = ["朝食","昼食","夕食","間食"]
+
+
+def missing_dates(app_data, since=None, until=None):
+    """食事記録があり、フィードバックが無い日（古い順）"""
+    feedback = app_data.get("feedback", {})
+    out = []
+    for day, meals in app_data.get("meal_data", {}).items():
+        if day in feedback or not isinstance(meals, dict):
+            continue
+        if since and day < since or until and day > until:
+            continue
+        if any(meals.get(k) for k in MEALS):
+            out.append(day)
+    return sorted(out)
+
+
+def build_entry(user_info, app_data, day):
+    """(prompt, 保存する feedback の雛形) を作る。meta は画面の show_feedback と同じ形"""
+    meals = app_data["meal_data"][day]
+    age = user_info.get("age", 0)
+    gender = user_info.get("gender", "")
+    self_esteem = user_info.get("self_esteem_level", "")
+    sel_m = app_data.get("missions", {}).get(day, {}).get("selected")
+    totals, tendencies = calc_nutrition(meals)
+    prompt = llm.build_feedback_prompt(age, gender, self_esteem, meals, selected_mission=sel_m)
+    entry = {
+        "text": None,
+        "meta": {
+            "age": age,
+            "gender": gender,
+            "self_esteem": self_esteem,
+            "selected_mission": sel_m,
+            "nutrient_totals": totals,
+            "tendencies": tendencies,
+            "input_fingerprint": llm.feedback_fingerprint(age, gender, self_esteem, meals, sel_m),
+            "meals_fingerprint": llm.meals_fingerprint(meals),
+            "backfilled": True
+        }
+    }
+    return prompt, entry
+
+
+# -------------------------
+# チェックポイント
+# -------------------------
+def load_checkpoint(path):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            try:
+                rec = json.loads(ln)
+                done[rec["date"]] = rec["feedback"]
+            except Exception:
+                # 中断で途中まで書かれた行は捨てる
+                continue
+    return done
+
+
+def append_checkpoint(path, day, feedback):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"date": day, "feedback": feedback}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def merge_into_app(app_path, results):
+    """
+    最新の app_data を読み直し、まだ feedback が無い日だけ反映して原子的に保存する。Returns 反映件数。
+    画面の保存と同じ storage.path_lock の中で行う（画面側はそのあと保存するときに、この内容に乗り換える）
+    """
+    if not results:
+        return 0
+    with path_lock(app_path):
+        app_data = load_app(app_path)
+        fb = app_data.setdefault("feedback", {})
+        n = 0
+        for day, entry in results.items():
+            if day not in fb:
+                fb[day] = entry
+                n += 1
+        if n:
+            save_app(app_data, app_path)
+    return n
+
+
+# -------------------------
+# 本体
+# -------------------------
+async def backfill_user(aclient, user_dir, sem, since=None, until=None, limit=None, flush_every=10, dry_run=False):
+    user_info = load_user(os.path.join(user_dir, USER_FILE))
+    if not user_info:
+        return {"dir": user_dir, "skipped": "user_data なし"}
+    app_path = os.path.join(user_dir, APP_FILE)
+    ckpt_path = os.path.join(user_dir, CHECKPOINT_FILE)
+    app_data = load_app(app_path)
+
+    checkpoint = load_checkpoint(ckpt_path)
+    if dry_run:
+        days = [d for d in missing_dates(app_data, since, until) if d not in checkpoint]
+        return {"dir": user_dir, "resumed": len(checkpoint), "missing": days[:limit] if limit else days}
+
+    # 前回中断分：チェックポイントにある結果を先に反映
+    resumed = merge_into_app(app_path, checkpoint)
+    if resumed:
+        app_data = load_app(app_path)
+
+    days = missing_dates(app_data, since, until)
+    if limit:
+        days = days[:limit]
+
+    user = llm_ledger.user_key(user_info, user_dir)
+    pending = {}
+    stats = {"dir": user_dir, "resumed": resumed, "targets": len(days), "generated": 0, "failed": 0, "merged": 0,
+             "deferred": 0}
+    lock = asyncio.Lock()
+
+    async def one(day):
+        prompt, entry = build_entry(user_info, app_data, day)
+        async with sem:
+            if stats.get("quota"):
+                # この利用者は1日上限に達した（残りは次回）
+                stats["deferred"] += 1
+                return
+            try:
+                entry["text"] = await llm.async_chat_completion_text(
+                    aclient,
+                    [{"role": "system", "content": llm.FEEDBACK_SYSTEM}, {"role": "user", "content": prompt}],
+                    max_tokens=400, purpose="feedback_backfill", user=user
+                )
+            except ratelimit.QuotaExceeded as e:
+                if not stats.get("quota"):
+                    stats["quota"] = str(e)
+                    print(f"  [quota] {user_dir}: {e}（残りの日は次回）", file=sys.stderr)
+                stats["deferred"] += 1
+                return
+            except Exception as e:
+                # 失敗した日は保存しない（次回の実行で再挑戦）
+                stats["failed"] += 1
+                print(f"  [failed] {day}: {type(e).__name__}: {e}", file=sys.stderr)
+                return
+        async with lock:
+            append_checkpoint(ckpt_path, day, entry)
+            pending[day] = entry
+            stats["generated"] += 1
+            if len(pending) >= flush_every:
+                stats["merged"] += merge_into_app(app_path, dict(pending))
+                pending.clear()
+
+    await asyncio.gather(*(one(d) for d in days))
+    stats["merged"] += merge_into_app(app_path, pending)
+    # すべて app_data に反映できたのでチェックポイントは不要
+    if os.path.exists(ckpt_path):
+        os.remove(ckpt_path)
+    return stats
+
+
+async def run(aclient, user_dirs, concurrency, **kw):
+    """利用者を同時に進める。LLM の同時呼び出し数（sem）は全員で共有し、同時に読み込む利用者も concurrency 人まで"""
+    sem = asyncio.Semaphore(max(1, concurrency))
+    users = asyncio.Semaphore(max(1, concurrency))
+
+    async def one_user(d):
+        async with users:
+            return await backfill_user(aclient, d, sem, **kw)
+
+    return await asyncio.gather(*(one_user(d) for d in user_dirs))
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="フィードバックが無い過去日をまとめて生成する")
+    ap.add_argument("dirs", nargs="*", help="user_data.json / app_data.json があるディレクトリ（既定: .）")
+    ap.add_argument("--users-root", help="このディレクトリ直下の各サブディレクトリを利用者として処理する")
+    ap.add_argument("--since", help="この日以降（YYYY-MM-DD）")
+    ap.add_argument("--until", help="この日以前（YYYY-MM-DD）")
+    ap.add_argument("--limit", type=int, help="利用者ごとの最大件数")
+    ap.add_argument("--concurrency", type=int, default=4, help="LLM 同時呼び出し数（既定: 4）")
+    ap.add_argument("--flush-every", type=int, default=10, help="この件数ごとに app_data.json へ反映（既定: 10）")
+    ap.add_argument("--user-daily-requests", type=int, default=_env_int("LLM_BACKFILL_DAILY_REQUESTS", 0),
+                    help="利用者ごとの1日の呼び出し上限（既定: LLM_BACKFILL_DAILY_REQUESTS、0 は無制限）")
+    ap.add_argument("--dry-run", action="store_true", help="対象日を表示するだけ")
+    ap.add_argument("--api-key")
+    ap.add_argument("--base-url")
+    args = ap.parse_args(argv)
+
+    # このプロセスの呼び出しはバックフィルだけなので、利用者ごとの1日上限はバックフィル用の値にする
+    # （毎分のリクエスト数・トークン数はアプリと同じ設定のまま）
+    cur = ratelimit.LIMITER
+    ratelimit.LIMITER = ratelimit.RateLimiter(
+        rpm=int(cur.requests.capacity if cur.requests else 0),
+        tpm=int(cur.tokens.capacity if cur.tokens else 0),
+        user_daily_requests=max(0, args.user_daily_requests),
+        user_daily_tokens=cur.user_daily_tokens,
+    )
+
+    user_dirs = list(args.dirs)
+    if args.users_root:
+        user_dirs += find_user_dirs(args.users_root)
+    if not user_dirs:
+        user_dirs = ["."]
+
+    aclient = None
+    if not args.dry_run:
+        api_key = args.api_key or llm.resolve_api_key() or ("stub" if args.base_url else None)
+        aclient = llm.make_async_client(api_key, args.base_url)
+        if aclient is None:
+            print("非同期 OpenAI クライアントを初期化できません（API キーを確認してください）", file=sys.stderr)
+            return 2
+
+    t0 = time.perf_counter()
+    results = asyncio.run(run(aclient, user_dirs, args.concurrency, since=args.since, until=args.until,
+                              limit=args.limit, flush_every=args.flush_every, dry_run=args.dry_run))
+    elapsed = time.perf_counter() - t0
+
+    failed = 0
+    for r in results:
+        if "skipped" in r:
+            print(f"[skipped] {r['dir']}: {r['skipped']}")
+        elif args.dry_run:
+            print(f"{r['dir']}: {len(r['missing'])} 日（ほかにチェックポイント済み {r['resumed']} 件）")
+            for d in r["missing"]:
+                print(f"  {d}")
+        else:
+            failed += r["failed"]
+            deferred = f" / 上限で次回 {r['deferred']}" if r["deferred"] else ""
+            print(f"{r['dir']}: 対象 {r['targets']} / 生成 {r['generated']} / 失敗 {r['failed']}{deferred} / "
+                  f"反映 {r['merged']}（再開分 {r['resumed']}）")
+    print(f"({elapsed:.2f}s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
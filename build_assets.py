@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+静的アセットのビルド（フォントのサブセット化・CSS の圧縮）
+- 外部の Google Fonts を読みに行かず、Noto Sans JP を Streamlit の静的配信（static/、.streamlit/config.toml）から出す
+- フォントはアプリで使う文字だけに絞る：ソース中の文字列・ミッションライブラリ・都道府県名 + 英数字・かな・記号
+  （利用者が入力した食品名などサブセットに無い文字は、ブラウザが sans-serif の代替フォントで表示する）
+- 出力ファイル名に内容のハッシュを入れるので、内容が変わると URL も変わる。リバースプロキシで
+  /app/static/ に「Cache-Control: public, max-age=31536000, immutable」を付けて長期キャッシュさせる前提
+- static/app.css を圧縮し、@font-face を前に付けて static/app.min.css に書き出す（app_bootstrap が読み込む）
+- フォントのサブセット化には fonttools（woff2 出力には brotli も）が必要：pip install fonttools brotli
+
+使い方:
+    python build_assets.py                                  # fonts/ にある NotoSansJP-*.ttf / .otf から作る
+    python build_assets.py --font 400=/path/NotoSansJP-Regular.ttf --font 700=/path/NotoSansJP-Bold.ttf
+    python build_assets.py --css-only                       # app.css を直したあと CSS だけ作り直す
+"""
+
+import argparse, glob, hashlib, json, os, re, sys
+
+import storage
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")
+FONT_OUT_DIR = os.path.join(STATIC_DIR, "fonts")
+FONT_SRC_DIR = os.path.join(APP_DIR, "fonts")
+CSS_SRC = os.path.join(STATIC_DIR, "app.css")
+CSS_OUT = os.path.join(STATIC_DIR, "app.min.css")
+MANIFEST = os.path.join(STATIC_DIR, "assets.json")
+FONT_FAMILY = "Noto Sans JP"
+# Streamlit の静的配信は <アプリのURL>/app/static/ 以下
+STATIC_URL = "app/static"
+
+WEIGHT_NAMES = {"Light": 300, "Regular": 400, "Medium": 500, "Bold": 700}
+
+
+# -------------------------
+# CSS の圧縮
+# -------------------------
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    css = css.replace(";}", "}")
+    return css.strip()
+
+
+# -------------------------
+# 使う文字の収集
+# -------------------------
+def _ranges(*pairs):
+    return "".join(chr(c) for a, b in pairs for c in range(a, b + 1))
+
+
+# 英数字・記号、ひらがな・カタカナ、全角英数・記号、CJK の記号
+BASE_GLYPHS = _ranges((0x20, 0x7E), (0x3000, 0x303F), (0x3040, 0x309F), (0x30A0, 0x30FF), (0xFF01, 0xFF9F)) + "・…×○●△▲▼★☆→←↑↓〜"
+
+
+def collect_glyphs(app_dir=APP_DIR):
+    """アプリ中の文字列（*.py・CSS・ミッションライブラリ）に出てくる文字 + BASE_GLYPHS"""
+    chars = set(BASE_GLYPHS)
+    paths = glob.glob(os.path.join(app_dir, "*.py")) + [CSS_SRC]
+    library = os.path.join(app_dir, os.getenv("MISSION_LIBRARY_PATH", "mission_library.json"))
+    if os.path.exists(library):
+        paths.append(library)
+    for p in paths:
+        with open(p, "r", encoding="utf-8") as f:
+            chars.update(ch for ch in f.read() if ord(ch) >= 0x80 and ch.isprintable())
+    return "".join(sorted(chars))
+
+
+# -------------------------
+# フォントのサブセット化
+# -------------------------
+def find_source_fonts(src_dir=FONT_SRC_DIR):
+    """fonts/NotoSansJP-<Weight>.(ttf|otf) を {weight: path} で返す"""
+    found = {}
+    for p in sorted(glob.glob(os.path.join(src_dir, "NotoSansJP-*"))):
+        m = re.match(r"NotoSansJP-(\w+)\.(ttf|otf)$", os.path.basename(p))
+        if m and m.group(1) in WEIGHT_NAMES:
+            found[WEIGHT_NAMES[m.group(1)]] = p
+    return found
+
+
+def subset_font(src, text, out_dir=FONT_OUT_DIR, weight=400):
+    """src を text の文字だけに絞った woff2 を out_dir に書き出し、ファイル名を返す"""
+    try:
+        from fontTools import subset
+    except ImportError:
+        raise SystemExit("fonttools が見つかりません（pip install fonttools brotli）")
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.layout_features = ["*"]
+    options.name_IDs = ["*"]
+    font = subset.load_font(src, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=text)
+    subsetter.subset(font)
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = os.path.join(out_dir, f".tmp-{weight}.woff2")
+    subset.save_font(font, tmp, options)
+    with open(tmp, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:10]
+    name = f"NotoSansJP-{weight}.{digest}.woff2"
+    os.replace(tmp, os.path.join(out_dir, name))
+    return name
+
+
+def font_face_css(fonts):
+    rules = []
+    for weight, name in sorted(fonts.items()):
+        rules.append(
+            f"@font-face{{font-family:'{FONT_FAMILY}';font-style:normal;font-weight:{weight};"
+            f"font-display:swap;src:url('{STATIC_URL}/fonts/{name}') format('woff2')}}"
+        )
+    return "".join(rules)
+
+
+def build_css(fonts=None, src=CSS_SRC):
+    with open(src, "r", encoding="utf-8") as f:
+        css = minify_css(f.read())
+    return font_face_css(fonts or {}) + css
+
+
+def _built_fonts():
+    """前回のビルドで作ったフォント（manifest にあり、ファイルも残っているもの）"""
+    try:
+        with open(MANIFEST, "r", encoding="utf-8") as f:
+            fonts = json.load(f).get("fonts", {})
+    except Exception:
+        return {}
+    return {int(w): n for w, n in fonts.items() if os.path.exists(os.path.join(FONT_OUT_DIR, n))}
+
+
+def _write(path, text):
+    storage.write_atomic(path, lambda f: f.write(text))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Noto Sans JP のサブセットと圧縮済み CSS を static/ に作る")
+    ap.add_argument("--font", action="append", default=[], metavar="WEIGHT=PATH",
+                    help="元フォント（例: 400=fonts/NotoSansJP-Regular.ttf）。既定は fonts/ から探す")
+    ap.add_argument("--css-only", action="store_true", help="フォントは作り直さず（前回の分を使い）CSS の圧縮だけ行う")
+    args = ap.parse_args(argv)
+
+    fonts = _built_fonts() if args.css_only else {}
+    glyphs = ""
+    if not args.css_only:
+        sources = find_source_fonts()
+        for spec in args.font:
+            weight, _, path = spec.partition("=")
+            sources[int(weight)] = path
+        if not sources:
+            print("元フォントがありません（fonts/ に NotoSansJP-Regular.ttf などを置くか --font で指定）", file=sys.stderr)
+            return 2
+        glyphs = collect_glyphs()
+        # 古いサブセットは消してから作り直す
+        for old in glob.glob(os.path.join(FONT_OUT_DIR, "NotoSansJP-*.woff2")):
+            os.remove(old)
+        for weight, path in sorted(sources.items()):
+            fonts[weight] = subset_font(path, glyphs, weight=weight)
+            size = os.path.getsize(os.path.join(FONT_OUT_DIR, fonts[weight]))
+            print(f"  {weight}: {os.path.basename(path)} → {fonts[weight]}（{size / 1024:.1f} KiB）")
+
+    css = build_css(fonts)
+    _write(CSS_OUT, css)
+    if not args.css_only:
+        _write(MANIFEST, json.dumps({"css": os.path.basename(CSS_OUT), "fonts": {str(w): n for w, n in fonts.items()},
+                                     "glyphs": len(glyphs)}, ensure_ascii=False, indent=2))
+    with open(CSS_SRC, "r", encoding="utf-8") as f:
+        src_len = len(f.read().encode("utf-8"))
+    print(f"{CSS_OUT}: {src_len} → {len(css.encode('utf-8'))} bytes（フォント {len(fonts)} 種）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
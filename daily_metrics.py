@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+利用者ごとの日別指標（列指向・メモリマップ）
+- 「直近90日の塩分の平均」「今月の達成率」のような期間の集計を、app_data の日付キー（文字列）の dict を
+  たどらずに答えるための索引。app_data.json と同じディレクトリの daily_metrics.bin に置く
+- 1日1行で、行番号は「日の序数 - 先頭日の序数」。列ごとに型のそろった配列を連ねてファイルに置き、
+  mmap して memoryview で読むので、開くときに全体を読み込まない（複数プロセスでも同じページを共有する）
+    cal / タンパク質 / 脂質 / 炭水化物 / 塩分   calc_nutrition の合計（float64）
+    items                                       記録した品目数（uint16）
+    mission                                     -1 ミッション未選択 / 0 選択して未達成 / 1 達成（int8）
+    feedback                                    フィードバックあり 1（uint8）
+- 同期：app_store.AppStore.save が、書き換えた日の行だけをその場で書き直す。ヘッダに元の app_data.json の
+  更新時刻・大きさを持ち、ほかの経路（バッチ処理など）で app_data.json が変わっていたら開いたときに作り直す
+- 範囲外の日を書くときは、前後に余裕を持たせて広げたファイルを作って置き換える
+- 標準ライブラリだけで動く（array / mmap / struct）
+
+使い方:
+    python daily_metrics.py build data/u1
+    python daily_metrics.py build --users-root data
+    python daily_metrics.py query data/u1 --col 塩分 --days 90
+    python daily_metrics.py query data/u1 --month 2026-10
+"""
+
+import argparse, array, calendar, datetime, mmap, os, struct, sys, threading, time
+
+import meal_pack
+import storage
+from nutrition import calc_nutrition
+
+METRICS_FILE = "daily_metrics.bin"
+MEALS = ["朝食","昼食","夕食","間食"]
+NUTRIENTS = ("cal", "タンパク質", "脂質", "炭水化物", "塩分")
+# (列名, array の型コード, 空の日の値)。8バイト境界にそろうよう大きい型から並べる
+COLUMNS = tuple((name, "d", 0.0) for name in NUTRIENTS) + (
+    ("items", "H", 0),
+    ("mission", "b", -1),
+    ("feedback", "B", 0),
+)
+COLUMN_NAMES = tuple(c[0] for c in COLUMNS)
+
+_MAGIC = b"DMETRIC1"
+# magic, 先頭日の序数, 行数, 列数, 元の app_data.json の mtime_ns, 大きさ
+_HEADER = struct.Struct("<8sqiiqq")
+_HEADER_SIZE = 64
+_STAMP_OFFSET = struct.calcsize("<8sqii")
+# 広げるときに先へ足しておく日数
+GROW_DAYS = 366
+
+
+def metrics_path(app_path):
+    return os.path.join(os.path.dirname(os.path.abspath(app_path)), METRICS_FILE)
+
+
+def source_stamp(app_path):
+    """app_data.json の (mtime_ns, 大きさ)。無ければ (0, 0)"""
+    try:
+        st = os.stat(app_path)
+    except OSError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _ordinal(day):
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day)
+    return day.toordinal()
+
+
+def _offsets(capacity):
+    out, pos = [], _HEADER_SIZE
+    for _, code, _ in COLUMNS:
+        out.append(pos)
+        pos += -(-capacity * array.array(code).itemsize // 8) * 8
+    return out, pos
+
+
+# -------------------------
+# 1日分の値
+# -------------------------
+def day_row(app_data, day):
+    """app_data の day の1行（列名 → 値）"""
+    meals = app_data.get("meal_data", {}).get(day) or {}
+    row = dict.fromkeys(NUTRIENTS, 0.0)
+    if isinstance(meals, meal_pack.PackedDay):
+        items = meals.count()
+    else:
+        items = sum(len(meals.get(k) or []) for k in MEALS) if isinstance(meals, dict) else 0
+    if items:
+        totals, _ = calc_nutrition(meals)
+        for k in NUTRIENTS:
+            row[k] = float(totals.get(k, 0.0))
+    row["items"] = min(items, 0xFFFF)
+    m = app_data.get("missions", {}).get(day) or {}
+    sel = m.get("selected")
+    row["mission"] = -1 if not sel else int(m.get("status", {}).get(sel) is True)
+    row["feedback"] = int(bool(app_data.get("feedback", {}).get(day)))
+    return row
+
+
+def _all_days(app_data):
+    days = set()
+    for name in ("meal_data", "missions", "feedback"):
+        days.update(app_data.get(name, {}))
+    return sorted(d for d in days if _valid_day(d))
+
+
+def _valid_day(day):
+    try:
+        _ordinal(day)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+# -------------------------
+# ファイル
+# -------------------------
+def _write_file(path, day0, arrays, stamp):
+    """列の配列（同じ長さ）をファイルに書いて置き換える"""
+    capacity = len(arrays[0]) if arrays else 0
+    offsets, size = _offsets(capacity)
+    buf = bytearray(size)
+    _HEADER.pack_into(buf, 0, _MAGIC, day0, capacity, len(COLUMNS), *stamp)
+    for off, arr in zip(offsets, arrays):
+        raw = arr.tobytes()
+        buf[off:off + len(raw)] = raw
+    storage.write_atomic(path, lambda f: f.write(buf), binary=True)
+
+
+def _empty_arrays(capacity):
+    return [array.array(code, [empty]) * capacity for _, code, empty in COLUMNS]
+
+
+class _Mapped:
+    """mmap したファイルと列ごとの memoryview。置き換えたら古いものは参照が切れたときに閉じる"""
+    __slots__ = ("mm", "day0", "capacity", "ino", "cols", "__weakref__")
+
+    def __init__(self, path):
+        with open(path, "r+b") as f:
+            self.ino = os.fstat(f.fileno()).st_ino
+            self.mm = mmap.mmap(f.fileno(), 0)
+        magic, self.day0, self.capacity, ncols, _, _ = _HEADER.unpack_from(self.mm, 0)
+        if magic != _MAGIC or ncols != len(COLUMNS):
+            raise ValueError(f"{path}: 形式が違います")
+        offsets, _ = _offsets(self.capacity)
+        whole = memoryview(self.mm)
+        self.cols = {name: whole[off:off + self.capacity * array.array(code).itemsize].cast(code)
+                     for (name, code, _), off in zip(COLUMNS, offsets)}
+
+    @property
+    def stamp(self):
+        # 他のプロセスがその場で書き換えることもあるので、毎回ファイル（の写し）から読む
+        return struct.unpack_from("<qq", self.mm, _STAMP_OFFSET)
+
+    def set_stamp(self, stamp):
+        struct.pack_into("<qq", self.mm, _STAMP_OFFSET, *stamp)
+
+    def arrays(self):
+        return [array.array(code, self.cols[name]) for name, code, _ in COLUMNS]
+
+
+class DailyMetrics:
+    """1利用者分。集計は読むだけなのでロックを取らない（書き換えは _lock の中で行う）"""
+
+    def __init__(self, app_path):
+        self.app_path = os.path.abspath(app_path)
+        self.path = metrics_path(app_path)
+        self._lock = threading.Lock()
+        self._m = None
+
+    # -------------------------
+    # 開く・作り直す
+    # -------------------------
+    def _open(self):
+        try:
+            self._m = _Mapped(self.path)
+        except (OSError, ValueError):
+            self._m = None
+        return self._m
+
+    def fresh(self, load=None):
+        """app_data.json と食い違っていれば作り直す。load() は作り直しに使う app_data（省略時はファイルから）"""
+        m = self._m
+        stamp = source_stamp(self.app_path)
+        try:
+            ino = os.stat(self.path).st_ino
+        except OSError:
+            ino = None
+        if m is not None and m.ino == ino and m.stamp == stamp:
+            return self
+        with self._lock:
+            m = self._open() if ino is not None else None
+            if m is None or m.stamp != stamp:
+                data = load() if load else storage.load_app(self.app_path)
+                self._rebuild(data, stamp)
+        return self
+
+    def _rebuild(self, app_data, stamp):
+        days = _all_days(app_data)
+        if days:
+            day0 = _ordinal(days[0])
+            capacity = _ordinal(days[-1]) - day0 + 1 + GROW_DAYS
+        else:
+            day0, capacity = datetime.date.today().toordinal(), GROW_DAYS
+        arrays = _empty_arrays(capacity)
+        for day in days:
+            i = _ordinal(day) - day0
+            row = day_row(app_data, day)
+            for arr, name in zip(arrays, COLUMN_NAMES):
+                arr[i] = row[name]
+        _write_file(self.path, day0, arrays, stamp)
+        self._open()
+
+    def rebuild(self, app_data=None):
+        with self._lock:
+            self._rebuild(app_data if app_data is not None else storage.load_app(self.app_path),
+                          source_stamp(self.app_path))
+        return self
+
+    def _grow(self, ordinal):
+        """ordinal の日が入るように広げたファイルに置き換える"""
+        m = self._m
+        old = m.arrays()
+        day0 = min(m.day0, ordinal)
+        end = max(m.day0 + m.capacity, ordinal + 1 + GROW_DAYS)
+        arrays = _empty_arrays(end - day0)
+        shift = m.day0 - day0
+        for arr, src in zip(arrays, old):
+            arr[shift:shift + len(src)] = src
+        _write_file(self.path, day0, arrays, m.stamp)
+        return self._open()
+
+    # -------------------------
+    # 書き換え
+    # -------------------------
+    def sync(self, app_data, days, prev_stamp, stamp):
+        """
+        app_data.json を保存した直後に呼ぶ。prev_stamp は保存前の (mtime_ns, 大きさ)。
+        この索引が保存前の内容に合っていれば days の行だけ書き直し、合っていなければ全体を作り直す
+        """
+        with self._lock:
+            m = self._m if self._m is not None else self._open()
+            if m is None or m.stamp != tuple(prev_stamp):
+                self._rebuild(app_data, stamp)
+                return
+            for day in days:
+                if not _valid_day(day):
+                    continue
+                o = _ordinal(day)
+                if not m.day0 <= o < m.day0 + m.capacity:
+                    m = self._grow(o)
+                row = day_row(app_data, day)
+                i = o - m.day0
+                for name in COLUMN_NAMES:
+                    m.cols[name][i] = row[name]
+            m.set_stamp(stamp)
+
+    # -------------------------
+    # 集計（start / end は両端を含む日付。文字列 "YYYY-MM-DD" か date）
+    # -------------------------
+    def _span(self, start, end):
+        m = self._m
+        if m is None:
+            return None, 0, 0
+        a = max(_ordinal(start) - m.day0, 0)
+        b = min(_ordinal(end) - m.day0 + 1, m.capacity)
+        return m, a, max(a, b)
+
+    def row(self, day):
+        m, a, b = self._span(day, day)
+        if m is None or a == b:
+            return None
+        return {name: m.cols[name][a] for name in COLUMN_NAMES}
+
+    def series(self, col, start, end):
+        m, a, b = self._span(start, end)
+        return m.cols[col][a:b].tolist() if m is not None else []
+
+    def total(self, col, start, end):
+        m, a, b = self._span(start, end)
+        return sum(m.cols[col][a:b].tolist()) if m is not None else 0
+
+    def logged_days(self, start, end):
+        """食事を1品以上記録した日数"""
+        m, a, b = self._span(start, end)
+        return (b - a) - m.cols["items"][a:b].tolist().count(0) if m is not None else 0
+
+    def mean(self, col, start, end):
+        """食事を記録した日の平均（記録が無ければ None）"""
+        n = self.logged_days(start, end)
+        return self.total(col, start, end) / n if n else None
+
+    def achievement(self, start, end):
+        """(ミッションを選んだ日数, 達成した日数, 達成率 or None)"""
+        m, a, b = self._span(start, end)
+        if m is None:
+            return 0, 0, None
+        xs = m.cols["mission"][a:b].tolist()
+        selected = len(xs) - xs.count(-1)
+        achieved = xs.count(1)
+        return selected, achieved, (achieved / selected if selected else None)
+
+    def feedback_days(self, start, end):
+        m, a, b = self._span(start, end)
+        return m.cols["feedback"][a:b].tolist().count(1) if m is not None else 0
+
+
+def month_range(month):
+    """"YYYY-MM" の (初日, 末日)"""
+    y, m = int(month[:4]), int(month[5:7])
+    return datetime.date(y, m, 1), datetime.date(y, m, calendar.monthrange(y, m)[1])
+
+
+def last_days(n, today=None):
+    """今日までの n 日の (初日, 今日)"""
+    today = today or datetime.date.today()
+    return today - datetime.timedelta(days=n - 1), today
+
+
+# プロセス内で利用者（app_data.json）ごとに1つ
+_OPEN = {}
+_OPEN_LOCK = threading.Lock()
+
+
+def _get(app_path):
+    key = os.path.abspath(app_path)
+    with _OPEN_LOCK:
+        dm = _OPEN.get(key)
+        if dm is None:
+            dm = _OPEN[key] = DailyMetrics(key)
+    return dm
+
+
+def for_app(app_path=storage.APP_FILE, load=None):
+    """app_path の索引（食い違っていれば作り直してから返す）"""
+    return _get(app_path).fresh(load)
+
+
+def sync(app_path, app_data, days, prev_stamp):
+    """app_data を app_path に保存した直後に呼ぶ。days は書き換えた日（None なら全体を作り直す）"""
+    dm = _get(app_path)
+    stamp = source_stamp(dm.app_path)
+    if days is None:
+        with dm._lock:
+            dm._rebuild(app_data, stamp)
+    else:
+        dm.sync(app_data, days, prev_stamp, stamp)
+    return dm
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="日別指標の索引（daily_metrics.bin）の作成・集計")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    bp = sub.add_parser("build", help="app_data.json から作り直す")
+    bp.add_argument("dirs", nargs="*", default=["."], help="利用者のディレクトリ（既定: カレント）")
+    bp.add_argument("--users-root", help="この下の利用者ディレクトリをすべて")
+    qp = sub.add_parser("query", help="期間の集計")
+    qp.add_argument("dir", nargs="?", default=".")
+    qp.add_argument("--col", default="塩分", choices=COLUMN_NAMES)
+    qp.add_argument("--days", type=int, default=90, help="今日までの日数（既定: 90）")
+    qp.add_argument("--month", help="YYYY-MM（指定すると --days の代わりにその月）")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "build":
+        dirs = storage.find_user_dirs(args.users_root) if args.users_root else args.dirs
+        for d in dirs:
+            t0 = time.perf_counter()
+            dm = DailyMetrics(os.path.join(d, storage.APP_FILE)).rebuild()
+            print(f"{dm.path}  {dm._m.capacity} 日分  {(time.perf_counter() - t0) * 1000:.1f}ms")
+        return 0
+
+    dm = for_app(os.path.join(args.dir, storage.APP_FILE))
+    start, end = month_range(args.month) if args.month else last_days(args.days)
+    t0 = time.perf_counter()
+    mean = dm.mean(args.col, start, end)
+    selected, achieved, rate = dm.achievement(start, end)
+    us = (time.perf_counter() - t0) * 1e6
+    print(f"{start} 〜 {end}")
+    print(f"  記録した日 {dm.logged_days(start, end)}  フィードバック {dm.feedback_days(start, end)}")
+    print(f"  {args.col} の平均（記録した日）: {'-' if mean is None else f'{mean:.2f}'}")
+    print(f"  ミッション達成 {achieved}/{selected}" + (f"（{rate:.0%}）" if rate is not None else ""))
+    print(f"  集計 {us:.1f}µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+日付キー（YYYY-MM-DD）の月別索引
+- app_data の missions / feedback / meal_data は日付キーの dict なので、月ごとに日付をまとめて
+  履歴画面では表示中の月の分だけを読み出して描画する
+- 作るのはキーの並べ替えだけ（keep を渡したときだけ値を読む）。それでも全日をたどるので、画面からは
+  app_store.AppStore.date_index を使う（共有の内容の版ごとに1回だけ作り、書き換えた日だけを changed で足し引きする）
+- 日ごとの記録の有無（day_flags）も日付キーで直接引き、カレンダーの印に使う
+- Streamlit に依存しない
+"""
+
+import meal_pack
+
+
+class DateIndex:
+    def __init__(self, days):
+        self._by_month = {}
+        for day in sorted(days):
+            self._by_month.setdefault(day[:7], []).append(day)
+
+    @classmethod
+    def of(cls, mapping, keep=None):
+        """mapping（日付キーの dict）から作る。keep(value) が偽の日は入れない"""
+        if keep is None:
+            return cls(mapping.keys())
+        return cls(day for day, v in mapping.items() if keep(v))
+
+    def changed(self, add=(), remove=()):
+        """add の日を足し、remove の日を除いた新しい索引（変わった月の分だけ作り直し、ほかの月は共有する）"""
+        out = DateIndex(())
+        out._by_month = dict(self._by_month)
+        touched = {}
+        for day in remove:
+            touched.setdefault(day[:7], (set(), set()))[1].add(day)
+        for day in add:
+            touched.setdefault(day[:7], (set(), set()))[0].add(day)
+        for month, (added, removed) in touched.items():
+            days = (set(self._by_month.get(month, ())) - removed) | added
+            if days:
+                out._by_month[month] = sorted(days)
+            else:
+                out._by_month.pop(month, None)
+        return out
+
+    def months(self):
+        """記録がある月（"YYYY-MM"、新しい順）"""
+        return sorted(self._by_month, reverse=True)
+
+    def days_in(self, month, reverse=False):
+        days = self._by_month.get(month, [])
+        return list(reversed(days)) if reverse else list(days)
+
+    def __contains__(self, day):
+        return day in self._by_month.get(day[:7], ())
+
+    def __len__(self):
+        return sum(len(v) for v in self._by_month.values())
+
+
+def has_selection(mission):
+    """ミッション履歴に出す日（ミッションを選んだ日）"""
+    return bool(mission and mission.get("selected"))
+
+
+def has_meals(meals):
+    """食事を1品以上記録した日。詰めた日（meal_pack.PackedDay）は品目数だけを見る（区分のリストを作らない）"""
+    if isinstance(meals, meal_pack.PackedDay):
+        return meals.count() > 0
+    return bool(meals) and any(meals.get(k) for k in ("朝食", "昼食", "夕食", "間食"))
+
+
+# -------------------------
+# 日ごとの記録の有無（カレンダーの印）
+# -------------------------
+HAS_MEALS = 1
+MISSION_DONE = 2
+HAS_FEEDBACK = 4
+MARKS = ((HAS_MEALS, "🍱"), (MISSION_DONE, "✅"), (HAS_FEEDBACK, "📝"))
+
+
+def day_flags(app_data, days):
+    """
+    days の各日について、食事記録・ミッション達成・フィードバックの有無をビットで返す。
+    日付キーで直接引くだけなので、app_data 全体は走査しない（1か月分なら最大31回の参照）
+    """
+    meal_data = app_data.get("meal_data", {})
+    missions = app_data.get("missions", {})
+    feedback = app_data.get("feedback", {})
+    out = {}
+    for day in days:
+        f = 0
+        if has_meals(meal_data.get(day)):
+            f |= HAS_MEALS
+        m = missions.get(day)
+        if m and m.get("selected") and m.get("status", {}).get(m["selected"]):
+            f |= MISSION_DONE
+        if day in feedback:
+            f |= HAS_FEEDBACK
+        out[day] = f
+    return out
+
+
+def marks(flags):
+    return "".join(sym for bit, sym in MARKS if flags & bit)
@@ -2,211 +2,83 @@
 """
 卒論用 Streamlit アプリ（統合版 main.py）
 - RSES 6件法（逆転項目は7-値で処理）
-- 自尊感情を元にした AI ミッション自動生成（利用不可時はフォールバック）
+- 自尊感情・栄養傾向・達成率を元にしたミッション推薦（ローカル推薦が既定、AI 生成も選択可）
 - 簡易栄養計算（量を考慮）を拡張
 - データ永続化： user_data.json / app_data.json
 - CSS（フォント・背景・スマホ対応）を統合
+- 設定・クライアント・CSS の初期化は app_bootstrap.py でプロセスにつき1回だけ行う
 """
 
-import streamlit as st
-import datetime, calendar, os, json
-from dotenv import load_dotenv
-
-# -------------------------
-# OpenAI クライアント初期化（新/旧どちらにも対応）
-# -------------------------
-client = None
-openai_client_inited = False
-try:
-    # prefer new client style (OpenAI)
-    from openai import OpenAI
-    api_key = None
-    try:
-        api_key = st.secrets.get("OPENAI_KEY")
-    except Exception:
-        api_key = None
-    if not api_key:
-        api_key = os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_KEY")
-    if api_key:
-        try:
-            client = OpenAI(api_key=api_key)
-            openai_client_inited = True
-        except Exception:
-            client = None
-            openai_client_inited = False
-    else:
-        client = None
-        openai_client_inited = False
-except Exception:
-    # fallback to legacy openai
-    try:
-        import openai
-        load_dotenv()
-        k = None
-        try:
-            k = st.secrets.get("OPENAI_KEY")
-        except Exception:
-            k = None
-        if not k:
-            k = os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_KEY")
-        if k:
-            openai.api_key = k
-            client = openai
-            openai_client_inited = True
-        else:
-            client = None
-            openai_client_inited = False
-    except Exception:
-        client = None
-        openai_client_inited = False
+import time
+_rerun_t0 = time.perf_counter()
 
-load_dotenv()
+import streamlit as st
+import datetime, calendar, os
+import app_bootstrap
+import singleflight
+import ratelimit
+import llm
+import llm_ledger
+import prompt_budget
+import mission_recommender
+import date_index
+import session_model
+import tracing
+import profiler
+import app_store
+import daily_metrics
+from nutrition import calc_nutrition
+from storage import load_user, save_user
+
+# 保存・読み込み・栄養計算の所要時間を区間として記録する（tracing.py）
+load_user = tracing.traced("storage.load_user")(load_user)
+save_user = tracing.traced("storage.save_user")(save_user)
+# app_data はセッション間で共有し、書き換えた日だけをセッションごとに持つ（app_store.py）
+load_app = tracing.traced("storage.load_app")(app_store.STORE.open)
+save_app = tracing.traced("storage.save_app")(app_store.STORE.save)
+calc_nutrition = tracing.traced("nutrition.calc")(calc_nutrition)
 
 # -------------------------
 # 設定
 # -------------------------
 st.set_page_config(page_title="卒論アプリ（拡張・RSES6＋AIミッション）", layout="centered", initial_sidebar_state="collapsed")
 
-# debug (can remove)
-try:
-    st.write("DEBUG_API_KEY_PRESENT:", bool(st.secrets.get("OPENAI_KEY")))
-except Exception:
-    st.write("DEBUG_API_KEY_PRESENT: unknown")
-
-# ============================================
-# ▼ CSS（フォント・背景 ＋ スマホ対応）
-# ============================================
-custom_css = """
-<style>
-@import url('https://fonts.googleapis.com/css2?family=Noto+Sans+JP:wght@300;400;500;700&display=swap');
-
-html, body, [class*="css"] {
-    font-family: 'Noto Sans JP', sans-serif !important;
-    color: #111 !important;
-    -webkit-font-smoothing: antialiased;
-}
-
-body {
-    background: #FFF4E8 !important;
-}
-
-.main, .block-container {
-    background-color: #FFF4E8 !important;
-}
-
-.asuken-card, .card {
-    background: #ffffff;
-    border-radius: 16px;
-    padding: 16px 20px;
-    margin-bottom: 18px;
-    box-shadow: 0 3px 8px rgba(0,0,0,0.08);
-}
-
-.asuken-title {
-    font-size: 1.4rem;
-    font-weight: 700;
-    color: #D66A1F;
-    margin-bottom: 10px;
-}
-
-.asuken-subtitle {
-    font-size: 1.1rem;
-    font-weight: 500;
-    color: #E67E22;
-    margin-top: 10px;
-}
-
-.stButton>button {
-    background-color: #FF9F54 !important;
-    color: #ffffff !important;
-    border-radius: 10px !important;
-    padding: 10px 18px !important;
-    font-size: 1rem !important;
-}
-
-@media (max-width: 480px) {
-    .asuken-card {
-        padding: 14px 16px;
-        margin-bottom: 14px;
-    }
-    .asuken-title {
-        font-size: 1.25rem;
-    }
-    .asuken-subtitle {
-        font-size: 1.05rem;
-    }
-    .stButton>button {
-        width: 100% !important;
-        font-size: 1.1rem !important;
-        padding: 14px !important;
-    }
-    .block-container {
-        padding-left: 1rem !important;
-        padding-right: 1rem !important;
-    }
-}
-
-.section { max-width: 760px; margin: 0 auto; padding: 12px; }
-input[type="text"], textarea { font-size:16px !important; padding:10px !important; }
-.bottom-nav { margin-top:14px; margin-bottom:18px; }
-.header-btn { display:flex; justify-content:flex-end; }
-
-</style>
-"""
-st.markdown(custom_css, unsafe_allow_html=True)
-
 # -------------------------
-# ファイル永続化
+# 初期化（.env / secrets / OpenAI クライアント / CSS はプロセスで1回だけ。app_bootstrap.py）
 # -------------------------
-USER_FILE = "user_data.json"
-APP_FILE = "app_data.json"
+boot = app_bootstrap.get()
+client, openai_client_inited = boot.client, boot.openai_client_inited
+PREFECTURES = app_bootstrap.PREFECTURES
 
-def load_user():
-    if os.path.exists(USER_FILE):
-        try:
-            with open(USER_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return None
-    return None
-
-def save_user(data):
-    with open(USER_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def load_app():
-    if os.path.exists(APP_FILE):
-        try:
-            with open(APP_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {"missions": {}, "meal_data": {}, "feedback": {}}
-    return {"missions": {}, "meal_data": {}, "feedback": {}}
-
-def save_app(data):
-    with open(APP_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+# ============================================
+# ▼ CSS（フォント・背景 ＋ スマホ対応）static/app.css
+# ============================================
+st.markdown(boot.css, unsafe_allow_html=True)
 
 # -------------------------
 # session init (safe)
 # -------------------------
 if "registered" not in st.session_state:
     st.session_state.registered = False
-if "page" not in st.session_state:
-    st.session_state.page = "init_register"
+# 画面遷移・選択中の日付・編集中の品目・一時フラグ（session_model.py）
+sm = session_model.of(st.session_state)
 if "user_info" not in st.session_state:
     u = load_user()
     if u:
+        if not u.get("user_id"):
+            # 台帳・利用者ごとの上限のキー（llm_ledger.user_key）。古いデータには最初の読み込みで付ける
+            u["user_id"] = llm_ledger.new_user_id()
+            save_user(u)
         st.session_state.user_info = u
         st.session_state.registered = True
     else:
-        st.session_state.user_info = {"birth": None, "gender": "", "region": "", "age": 0, "self_esteem_level": ""}
+        st.session_state.user_info = {"birth": None, "gender": "", "region": "", "age": 0, "self_esteem_level": "",
+                                      "user_id": llm_ledger.new_user_id()}
 if "app_data" not in st.session_state:
     st.session_state.app_data = load_app()
-if "today_date" not in st.session_state:
-    st.session_state.today_date = datetime.date.today()
-if "show_calendar" not in st.session_state:
-    st.session_state.show_calendar = False
+else:
+    # 他のセッションが保存していれば新しい共有の内容に乗り換える
+    app_store.STORE.touch(st.session_state.app_data)
 
 # -------------------------
 # helpers
@@ -216,276 +88,62 @@ def safe_rerun():
     elif hasattr(st, "experimental_rerun"): st.experimental_rerun()
     else: pass
 
+# st.fragment で囲んだ部分は、その中の操作ではその部分だけが再実行される（古い Streamlit では通常の関数）
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
 def calculate_age(birth_date):
     today = datetime.date.today()
     return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
 
 # -------------------------
-# ★ AIミッション生成（Part2のロジックを統合）
+# ★ ミッション生成（既定はローカル推薦 mission_recommender.py、MISSION_SOURCE=llm で AI 生成 llm.py）
 # -------------------------
+@tracing.traced("llm.missions")
 def try_generate_missions():
-    fallback = ["野菜を1食とる", "水を1杯飲む", "20分歩く"]
-    # if no client available, return fallback
-    if not client or not openai_client_inited:
-        return fallback
-
-    # gather context
-    age = st.session_state.user_info.get("age", 0)
-    gender = st.session_state.user_info.get("gender", "")
-    self_esteem = st.session_state.user_info.get("self_esteem_level", "")
-    today = st.session_state.today_date.strftime("%Y-%m-%d")
-    meal_data = st.session_state.app_data.get("meal_data", {}).get(today, {})
-    nutrient_totals, tendencies = calc_nutrition(meal_data)
-
-    # build prompt
-    prompt = f"""あなたは健康行動支援の専門家です。
-以下の情報をもとに、対象者が今日取り組める簡単な行動ミッションを**短く具体的に3つ**提案してください。
-各ミッションは3〜7語程度にまとめてください。
-
-【プロフィール】
-- 年齢: {age}
-- 性別: {gender}
-- 自尊感情レベル: {self_esteem}
-
-【簡易栄養（内部単位）】
-タンパク質: {nutrient_totals.get('タンパク質', nutrient_totals.get('p',0))}g, 脂質: {nutrient_totals.get('脂質', nutrient_totals.get('f',0))}g, 炭水化物: {nutrient_totals.get('炭水化物', nutrient_totals.get('c',0))}g
-
-【栄養傾向】
-{', '.join(tendencies) if tendencies else '特になし'}
-
-出力は1行ずつ「1. ○○」の形式で3行にしてください。
-例:
-1. 野菜をもう一品追加する
-2. 夜に間食を控える
-3. 15分間速歩する
-"""
-    try:
-        # support both new OpenAI client and legacy openai
-        if hasattr(client, "chat") and hasattr(client.chat, "completions"):
-            # new client style
-            resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role":"system","content":"あなたは親切で実用的な健康支援アドバイザーです。"}, {"role":"user","content":prompt}],
-                temperature=0.7, max_tokens=200
-            )
-            text = resp.choices[0].message.content.strip()
-        else:
-            # legacy openai
-            resp = client.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[{"role":"system","content":"あなたは親切で実用的な健康支援アドバイザーです。"}, {"role":"user","content":prompt}],
-                temperature=0.7, max_tokens=200
-            )
-            text = resp.choices[0].message.content.strip()
-
-        # parse into lines starting with 1. 2. 3.
-        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-        missions = []
-        for ln in lines:
-            # try to strip "1." or "1)" prefixes
-            # handle common patterns
-            cleaned = ln
-            if ln.startswith(("1.","2.","3.","1)","2)","3)")):
-                cleaned = ln[2:].strip()
-            elif len(ln) >= 3 and ln[1:3] == ". ":
-                cleaned = ln[3:].strip()
-            cleaned = cleaned.lstrip('0123456789. )\t-')
-            cleaned = cleaned.strip()
-            if cleaned:
-                missions.append(cleaned)
-        # ensure length 3
-        out = missions[:3]
-        while len(out) < 3:
-            out.append(fallback[len(out)])
-        return out
-    except Exception:
-        return fallback
+    if os.getenv("MISSION_SOURCE", "local") == "llm" and client and openai_client_inited:
+        today = sm.date_key
+        meal_data = st.session_state.app_data.get("meal_data", {}).get(today, {})
+        try:
+            return llm.request_missions(client, st.session_state.user_info, meal_data, fallback_on_error=True)
+        except Exception:
+            pass
+    # LLM を使わない・使えないときはローカル推薦
+    return mission_recommender.recommend(st.session_state.user_info, st.session_state.app_data, sm.selected_date)
 
 # -------------------------
 # フィードバック生成（ラッパー）
 # -------------------------
-def generate_feedback_from_prompt(prompt):
+def generate_feedback_from_prompt(prompt, regenerate=False):
     """Low-level wrapper: try OpenAI then fallback text."""
-    fallback_short = "フィードバックを生成できませんでした。食事改善のポイントを意識してください。"
-    if not client or not openai_client_inited:
-        return fallback_short
-    try:
-        if hasattr(client, "chat") and hasattr(client.chat, "completions"):
-            resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "あなたは親切で実用的な栄養指導の専門家です。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7, max_tokens=400
-            )
-            return resp.choices[0].message.content.strip()
-        else:
-            resp = client.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "あなたは親切で実用的な栄養指導の専門家です。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7, max_tokens=400
-            )
-            return resp.choices[0].message.content.strip()
-    except Exception:
-        return fallback_short
+    return llm.generate_feedback(client if openai_client_inited else None, prompt,
+                                 user=llm_ledger.user_key(st.session_state.user_info), reuse=not regenerate)
 
-def try_generate_feedback(age, gender, self_esteem_level, meals, selected_mission=None):
+@tracing.traced("llm.feedback")
+def try_generate_feedback(age, gender, self_esteem_level, meals, selected_mission=None, regenerate=False):
     """
     meals: {"朝食": [ {"item": "...", "intake":"普通"}, ... ], ...}
+    regenerate: 「再生成する」で明示的に作り直すとき True（直前の同じ結果を使い回さない）
     """
-    # normalize old-style data if necessary
-    normalized_meals = {}
-    for k in ["朝食","昼食","夕食","間食"]:
-        raw_items = meals.get(k, []) if meals else []
-        norm = []
-        for it in raw_items:
-            if isinstance(it, str):
-                norm.append({"item": it, "intake": "普通"})
-            elif isinstance(it, dict):
-                name = it.get("item") or it.get("name")
-                intake = it.get("intake") or it.get("amount_label") or "普通"
-                norm.append({"item": name, "intake": intake})
-        normalized_meals[k] = norm
-
-    # create meal text
-    meal_lines = []
-    for meal_name, items in normalized_meals.items():
-        for it in items:
-            meal_lines.append(f"{meal_name}: {it['item']}（量: {it['intake']}）")
-    meal_text = "\n".join(meal_lines) if meal_lines else "食事記録がありません。"
-
-    totals, tendencies = calc_nutrition(normalized_meals)
-
-    mission_text = selected_mission or "なし"
-    # Build prompt
-    prompt = f"""あなたは親切で実用的な栄養指導の専門家です。
-以下の情報を踏まえて、5〜8文でフィードバックを作ってください。良い点・改善点・次の行動提案を必ず含めてください。最後は「明日も少しずつ続けていきましょう」で締めてください。
-
-年齢: {age}
-性別: {gender}
-自尊感情レベル: {self_esteem_level}
-今日のミッション: {mission_text}
-
-【食事内容（量付き）】
-{meal_text}
-
-【推定栄養（内部単位）】
-タンパク質: {totals.get('タンパク質', totals.get('p',0))}g, 脂質: {totals.get('脂質', totals.get('f',0))}g, 炭水化物: {totals.get('炭水化物', totals.get('c',0))}g
-
-【栄養傾向】
-{', '.join(tendencies) if tendencies else '特になし'}
-"""
-    return generate_feedback_from_prompt(prompt)
+    prompt = llm.build_feedback_prompt(age, gender, self_esteem_level, meals, selected_mission)
+    return generate_feedback_from_prompt(prompt, regenerate)
 
-# -------------------------
-# ★ 簡易栄養計算（拡張版）
-# -------------------------
-def calc_nutrition(meals):
+@tracing.traced("llm.feedback_and_missions")
+def try_generate_feedback_and_missions(age, gender, self_esteem_level, meals, selected_mission=None, regenerate=False):
     """
-    meals expected:
-    {"朝食": [ "卵", {"item":"サラダ","intake":"普通"}, ... ], ... }
-    old string-only items are supported and treated as intake="普通".
-    Returns totals (タンパク質, 脂質, 炭水化物, cal, 塩分) and tendencies list.
-    Works with both simple item lists and the extended meal dicts used elsewhere.
+    構造化出力モード：フィードバックと翌日のミッションを1回の呼び出しで生成する。
+    Returns (feedback_text, next_missions, rationale)。構造化出力が無効・失敗した場合は
+    従来のフィードバック生成にフォールバックし、next_missions / rationale は None。
     """
-    # Accept also a flat mapping like {"卵":"普通"}: handle gracefully
-    intake_factor = {"少なめ": 0.8, "普通": 1.0, "多め": 1.2}
-    # expanded nutrition DB (per portion approximate)
-    NUTRITION_DB = {
-        "ごはん": {"タンパク質":3, "脂質":1, "炭水化物":37, "cal":168, "塩分":0},
-        "ご飯": {"タンパク質":3, "脂質":1, "炭水化物":37, "cal":168, "塩分":0},
-        "パン": {"タンパク質":4, "脂質":5, "炭水化物":30, "cal":200, "塩分":0.5},
-        "パスタ": {"タンパク質":6, "脂質":8, "炭水化物":40, "cal":350, "塩分":0.8},
-        "魚": {"タンパク質":20, "脂質":10, "炭水化物":0, "cal":240, "塩分":0.2},
-        "肉": {"タンパク質":25, "脂質":20, "炭水化物":0, "cal":300, "塩分":0.3},
-        "鶏肉": {"タンパク質":20, "脂質":10, "炭水化物":0, "cal":220, "塩分":0.2},
-        "卵": {"タンパク質":6, "脂質":5, "炭水化物":1, "cal":90, "塩分":0.1},
-        "サラダ": {"タンパク質":1, "脂質":1, "炭水化物":3, "cal":60, "塩分":0.1},
-        "ヨーグルト": {"タンパク質":4, "脂質":2, "炭水化物":5, "cal":80, "塩分":0.05},
-        "味噌汁": {"タンパク質":3, "脂質":1, "炭水化物":3, "cal":40, "塩分":1.0},
-        "プロテイン": {"タンパク質":20, "脂質":2, "炭水化物":3, "cal":120, "塩分":0.2},
-        "サンドイッチ": {"タンパク質":10, "脂質":12, "炭水化物":35, "cal":350, "塩分":1.0},
-        "ハンバーグ": {"タンパク質":18, "脂質":20, "炭水化物":5, "cal":350, "塩分":0.8},
-        "揚げ物": {"タンパク質":8, "脂質":22, "炭水化物":20, "cal":400, "塩分":0.6},
-        "お菓子": {"タンパク質":3, "脂質":15, "炭水化物":45, "cal":300, "塩分":0.2},
-        "バナナ": {"タンパク質":1, "脂質":0.2, "炭水化物":22, "cal":90, "塩分":0},
-    }
-
-    totals = {"タンパク質":0.0, "脂質":0.0, "炭水化物":0.0, "cal":0.0, "塩分":0.0}
-    tendencies = []
-
-    # If meals looks like flat nutrition mapping (not meal->items), try to handle
-    if isinstance(meals, dict) and all(isinstance(v, str) for v in meals.values()):
-        # e.g. {"卵":"普通", "ごはん":"多め"}
-        for name, amount in meals.items():
-            matched = None
-            for k in NUTRITION_DB.keys():
-                if k in name or name == k:
-                    matched = NUTRITION_DB[k]; break
-            factor = intake_factor.get(amount, 1.0)
-            if matched:
-                totals["タンパク質"] += matched.get("タンパク質",0) * factor
-                totals["脂質"] += matched.get("脂質",0) * factor
-                totals["炭水化物"] += matched.get("炭水化物",0) * factor
-                totals["cal"] += matched.get("cal",0) * factor
-                totals["塩分"] += matched.get("塩分",0) * factor
-    else:
-        # expected structure: {"朝食":[...],"昼食":[...],...}
-        for meal, items in (meals or {}).items():
-            if not items:
-                continue
-            for it in items:
-                if isinstance(it, str):
-                    name = it
-                    intake = "普通"
-                elif isinstance(it, dict):
-                    name = it.get("item") or it.get("name") or it.get("food") or ""
-                    intake = it.get("intake") or it.get("amount") or it.get("amount_label") or "普通"
-                else:
-                    continue
-
-                matched = None
-                if name in NUTRITION_DB:
-                    matched = NUTRITION_DB[name]
-                else:
-                    for k in NUTRITION_DB.keys():
-                        if k in name:
-                            matched = NUTRITION_DB[k]
-                            break
-
-                factor = intake_factor.get(intake, 1.0)
-                if matched:
-                    totals["タンパク質"] += matched.get("タンパク質",0) * factor
-                    totals["脂質"] += matched.get("脂質",0) * factor
-                    totals["炭水化物"] += matched.get("炭水化物",0) * factor
-                    totals["cal"] += matched.get("cal",0) * factor
-                    totals["塩分"] += matched.get("塩分",0) * factor
-                else:
-                    # fallback heuristics
-                    if any(x in name for x in ["肉","魚","鶏","ハンバーグ"]):
-                        totals["タンパク質"] += 10 * factor
-                    if any(x in name for x in ["揚げ","バター","油","フライ"]):
-                        totals["脂質"] += 5 * factor
-                    if any(x in name for x in ["ごはん","ご飯","パン","パスタ","麺","うどん","そば"]):
-                        totals["炭水化物"] += 30 * factor
-
-    totals = {k: round(v,1) for k,v in totals.items()}
-
-    # tendencies
-    if totals["タンパク質"] < 40:
-        tendencies.append("タンパク質不足傾向")
-    if totals["脂質"] > 70:
-        tendencies.append("脂質多めの傾向")
-    if totals["炭水化物"] > 300:
-        tendencies.append("炭水化物多めの傾向")
-    if totals["塩分"] > 6:
-        tendencies.append("塩分多めの傾向")
-
-    return totals, tendencies
+    if client and openai_client_inited and llm.structured_output_enabled():
+        try:
+            out = llm.request_combined(client, age, gender, self_esteem_level, meals, selected_mission,
+                                       user=llm_ledger.user_key(st.session_state.user_info), reuse=not regenerate,
+                                       fallback_on_error=True)
+            return out["feedback"], out["missions"], out.get("rationale")
+        except Exception:
+            pass
+    return try_generate_feedback(age, gender, self_esteem_level, meals, selected_mission=selected_mission,
+                                 regenerate=regenerate), None, None
 
 # -------------------------
 # UI helpers
@@ -499,21 +157,67 @@ def show_header(left_text="", right_callable=None):
         except Exception:
             cols[1].markdown("")
 
-PREFECTURES = [
- "北海道","青森県","岩手県","宮城県","秋田県","山形県","福島県",
- "茨城県","栃木県","群馬県","埼玉県","千葉県","東京都","神奈川県",
- "新潟県","富山県","石川県","福井県","山梨県","長野県",
- "岐阜県","静岡県","愛知県","三重県",
- "滋賀県","京都府","大阪府","兵庫県","奈良県","和歌山県",
- "鳥取県","島根県","岡山県","広島県","山口県",
- "徳島県","香川県","愛媛県","高知県",
- "福岡県","佐賀県","長崎県","熊本県","大分県","宮崎県","鹿児島県","沖縄県"
-]
+# -------------------------
+# ページ登録・遷移
+# - 画面は @page("名前") で登録し、末尾の route() が sm.nav.page の画面を描画する
+# - 遷移はボタンの on_click（描画より前に呼ばれる）で行うので、1回のスクリプト実行で次の画面が出る
+# -------------------------
+PAGES = {}
+
+def page(name):
+    def deco(fn):
+        PAGES[name] = fn
+        return fn
+    return deco
+
+def go(target):
+    """on_click 用の遷移。遷移にかかったスクリプト実行回数を route() で数える"""
+    sm.flags.leave_page()
+    sm.nav.go(target)
+
+def nav_button(label, target, key=None, container=None):
+    return (container or st).button(label, key=key, on_click=go, args=(target,))
+
+def show_month_pager(months, state_key):
+    """
+    履歴画面の月送り（months は新しい順の "YYYY-MM"）。Returns 表示する月。
+    表示する月の分だけを描画するので、履歴が増えても1ページの量は1か月分で頭打ちになる
+    """
+    if st.session_state.get(state_key) not in months:
+        st.session_state[state_key] = months[0]
+    def step(delta):
+        i = months.index(st.session_state[state_key]) + delta
+        st.session_state[state_key] = months[max(0, min(i, len(months)-1))]
+    i = months.index(st.session_state[state_key])
+    p1,p2,p3 = st.columns([0.25,0.5,0.25])
+    p1.button("◀ 前の月", key=f"{state_key}_prev", on_click=step, args=(1,), disabled=i == len(months)-1)
+    p2.selectbox("表示する月", months, key=state_key, label_visibility="collapsed",
+                 format_func=lambda ym: f"{ym[:4]}年{int(ym[5:])}月")
+    p3.button("次の月 ▶", key=f"{state_key}_next", on_click=step, args=(-1,), disabled=i == 0)
+    return st.session_state[state_key]
+
+def show_nav_bar(meal_key=None, feedback_key=None, today_key=None):
+    c1,c2,c3 = st.columns(3)
+    nav_button("🍱 食事管理", "meal", key=meal_key, container=c1)
+    nav_button("📝 フィードバック", "feedback", key=feedback_key, container=c2)
+    nav_button("🎯 今日のミッション", "today_mission_display", key=today_key, container=c3)
+
 
 # -------------------------
 # 初期登録
 # -------------------------
+@page("init_register")
 def show_init_register():
+    def on_submit():
+        ss = st.session_state
+        birth = datetime.date(ss.yr_final, ss.mo_final, ss.dy_final)
+        age = calculate_age(birth)
+        ss.user_info.update({"birth": birth.strftime("%Y-%m-%d"), "gender": ss.gnd_final, "region": ss.pref_final, "age": age})
+        ss.registered = True
+        save_user(ss.user_info)
+        ensure_today_mission()
+        go("self_esteem")
+
     show_header("初期登録")
     st.markdown('<div class="section">', unsafe_allow_html=True)
     with st.form("init_form_final"):
@@ -521,28 +225,20 @@ def show_init_register():
         years = list(range(1950, datetime.date.today().year+1))
         months = list(range(1,13)); days = list(range(1,32))
         c1,c2,c3 = st.columns(3)
-        year = c1.selectbox("年", years, index=years.index(2000), key="yr_final")
-        month = c2.selectbox("月", months, index=0, key="mo_final")
-        day = c3.selectbox("日", days, index=0, key="dy_final")
+        c1.selectbox("年", years, index=years.index(2000), key="yr_final")
+        c2.selectbox("月", months, index=0, key="mo_final")
+        c3.selectbox("日", days, index=0, key="dy_final")
         st.subheader("性別")
-        gender = st.selectbox("性別を選択してください", ["男性","女性","その他"], key="gnd_final")
+        st.selectbox("性別を選択してください", ["男性","女性","その他"], key="gnd_final")
         st.subheader("地域")
-        region = st.selectbox("お住まいの都道府県", PREFECTURES, key="pref_final")
-        submitted = st.form_submit_button("登録して次へ", key="init_submit_final")
-    if submitted:
-        birth = datetime.date(year,month,day)
-        age = calculate_age(birth)
-        st.session_state.user_info.update({"birth": birth.strftime("%Y-%m-%d"), "gender": gender, "region": region, "age": age})
-        st.session_state.registered = True
-        save_user(st.session_state.user_info)
-        ensure_today_mission()
-        st.session_state.page = "self_esteem"
-        safe_rerun()
+        st.selectbox("お住まいの都道府県", PREFECTURES, key="pref_final")
+        st.form_submit_button("登録して次へ", key="init_submit_final", on_click=on_submit)
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # 自尊感情診断（RSES 6件法）
 # -------------------------
+@page("self_esteem")
 def show_self_esteem():
     show_header("タイプ診断")
     st.markdown('<div class="section">', unsafe_allow_html=True)
@@ -565,19 +261,10 @@ def show_self_esteem():
     # 逆転項目: 3,5,8,9,10
     reverse_idxs = {3,5,8,9,10}
 
-    answers = []
-    with st.form("se_form_final"):
-        st.markdown("**以下は6件法で回答してください（1〜6）**")
-        st.markdown("1 = 全くそう思わない, 2 = あまりそう思わない, 3 = ややそう思わない, 4 = ややそう思う, 5 = そう思う, 6 = 非常にそう思う")
-        for i,q in enumerate(questions, start=1):
-            # default index -> 3 (value 4) to be roughly neutral
-            default_val = 4
-            val = st.radio(f"{i}. {q}", [1,2,3,4,5,6], index=default_val-1, horizontal=True, key=f"se_final_{i}")
-            answers.append(val)
-        submitted = st.form_submit_button("診断する", key="se_submit_final")
-    if submitted:
+    def on_submit():
         score = 0
-        for idx, a in enumerate(answers, start=1):
+        for idx in range(1, len(questions)+1):
+            a = st.session_state[f"se_final_{idx}"]
             if idx in reverse_idxs:
                 score += (7 - a)
             else:
@@ -589,18 +276,27 @@ def show_self_esteem():
         st.session_state.user_info["self_esteem_score"] = score
         save_user(st.session_state.user_info)
         ensure_today_mission()
-        st.session_state.page = "mission"
-        safe_rerun()
+        go("mission")
+
+    with st.form("se_form_final"):
+        st.markdown("**以下は6件法で回答してください（1〜6）**")
+        st.markdown("1 = 全くそう思わない, 2 = あまりそう思わない, 3 = ややそう思わない, 4 = ややそう思う, 5 = そう思う, 6 = 非常にそう思う")
+        for i,q in enumerate(questions, start=1):
+            # default index -> 3 (value 4) to be roughly neutral
+            default_val = 4
+            st.radio(f"{i}. {q}", [1,2,3,4,5,6], index=default_val-1, horizontal=True, key=f"se_final_{i}")
+        st.form_submit_button("診断する", key="se_submit_final", on_click=on_submit)
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # ミッション画面（AI生成版）
 # -------------------------
+@page("mission")
 def show_mission():
     show_header("ミッション")
     st.markdown('<div class="section">', unsafe_allow_html=True)
 
-    today = st.session_state.today_date.strftime("%Y-%m-%d")
+    today = sm.date_key
     st.session_state.app_data.setdefault("missions", {})
 
     # date init
@@ -613,29 +309,17 @@ def show_mission():
         }
         save_app(st.session_state.app_data)
 
-    data = st.session_state.app_data["missions"][today]
-
-    st.write("#### 今日のミッション（選択して次へ）")
-
-    # 自動生成ミッション一覧表示
-    for m in data["auto"]:
-        st.markdown(f"- {m}")
-
-    # 選択 UI
-    with st.form("mission_form_after_se"):
-        custom = st.text_input("自作ミッション（任意）", key="mission_custom_after")
-        labels = data["auto"] + ["自作ミッション"]
-
-        sel = st.radio("候補から選択", labels, index=0, key="mission_choice_after")
-        # ここは3段階の回答という意図がありましたが既存UIでは選択肢から1つ選ぶ形です。
-        # 必要なら別途"達成度: 未達成/部分達成/達成"の UI を追加可能です。
-        submitted = st.form_submit_button("選択して次へ")
+    # 描画は読み取り用の get（共有の内容をコピーしない）。書き換えは on_submit の中で [] で取り出す
+    data = st.session_state.app_data["missions"].get(today)
 
-    if submitted:
+    def on_submit():
+        custom = st.session_state.get("mission_custom_after", "")
+        sel = st.session_state.get("mission_choice_after")
+        data = st.session_state.app_data["missions"][today]
         # 自作ミッション
         if sel == "自作ミッション":
             if not custom.strip():
-                st.warning("自作ミッションが空です。入力してください。")
+                sm.flags.flash("mission_custom_empty")
                 return
             chosen = custom.strip()
             if chosen not in data["custom"]:
@@ -652,26 +336,44 @@ def show_mission():
         save_app(st.session_state.app_data)
 
         # 次の画面へ
-        st.session_state.page = "meal"
-        safe_rerun()
+        go("meal")
+
+    st.write("#### 今日のミッション（選択して次へ）")
+
+    # 自動生成ミッション一覧表示
+    for m in data["auto"]:
+        st.markdown(f"- {m}")
+
+    # 選択 UI
+    with st.form("mission_form_after_se"):
+        st.text_input("自作ミッション（任意）", key="mission_custom_after")
+        labels = data["auto"] + ["自作ミッション"]
+
+        st.radio("候補から選択", labels, index=0, key="mission_choice_after")
+        # ここは3段階の回答という意図がありましたが既存UIでは選択肢から1つ選ぶ形です。
+        # 必要なら別途"達成度: 未達成/部分達成/達成"の UI を追加可能です。
+        st.form_submit_button("選択して次へ", on_click=on_submit)
+
+    if sm.flags.take("mission_custom_empty", False):
+        st.warning("自作ミッションが空です。入力してください。")
+        return
 
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # 今日のミッション表示（ホーム下部のボタンで遷移）
 # -------------------------
+@page("today_mission_display")
 def show_today_mission_display():
 
     # 右上の「過去」ボタン
     def right_comp(col):
-        if col.button("過去"):
-            st.session_state.page = "mission_history"
-            safe_rerun()
+        nav_button("過去", "mission_history", container=col)
 
     show_header("ミッション", right_callable=right_comp)
     st.markdown('<div class="section">', unsafe_allow_html=True)
 
-    key_date = st.session_state.today_date.strftime("%Y-%m-%d")
+    key_date = sm.date_key
     st.session_state.app_data.setdefault("missions", {})
 
     # データがない場合は生成
@@ -684,7 +386,7 @@ def show_today_mission_display():
         }
         save_app(st.session_state.app_data)
 
-    data = st.session_state.app_data["missions"][key_date]
+    data = st.session_state.app_data["missions"].get(key_date)
     chosen = data.get("selected")
 
     st.markdown("#### 今日のミッション")
@@ -695,54 +397,49 @@ def show_today_mission_display():
             unsafe_allow_html=True
         )
 
-        data.setdefault("status", {})
-        current_status = data["status"].get(chosen, False)
-
-        cols = st.columns(2)
-
-        if cols[0].button("未達成", key="mission_unachieved_btn"):
-            data["status"][chosen] = False
-            st.session_state.app_data["missions"][key_date] = data
+        def set_status(done):
+            data = st.session_state.app_data["missions"][key_date]
+            data.setdefault("status", {})[chosen] = done
             save_app(st.session_state.app_data)
-            safe_rerun()
 
-        if cols[1].button("達成", key="mission_achieved_btn"):
-            data["status"][chosen] = True
-            st.session_state.app_data["missions"][key_date] = data
-            save_app(st.session_state.app_data)
-            safe_rerun()
+        cols = st.columns(2)
+        cols[0].button("未達成", key="mission_unachieved_btn", on_click=set_status, args=(False,))
+        cols[1].button("達成", key="mission_achieved_btn", on_click=set_status, args=(True,))
 
         st.write("---")
 
     else:
         st.info("ミッションがまだ選択されていません。最初のミッション選択画面で選択してください。")
 
-    c1, c2, c3 = st.columns(3)
-    if c1.button("🍱 食事管理"):
-        st.session_state.page = "meal"; safe_rerun()
-    if c2.button("📝 フィードバック"):
-        st.session_state.page = "feedback"; safe_rerun()
-    if c3.button("🎯 今日のミッション"):
-        st.session_state.page = "today_mission_display"; safe_rerun()
+    show_nav_bar()
 
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # 過去のミッション画面（修正版）
 # -------------------------
+@page("mission_history")
 def show_mission_history():
     show_header("過去のミッション")
 
     st.markdown('<div class="section">', unsafe_allow_html=True)
 
     missions = st.session_state.app_data.get("missions", {})
+    index = app_store.STORE.date_index(st.session_state.app_data, "missions", date_index.has_selection)
 
-    if not missions:
+    if not len(index):
         st.write("まだミッション履歴がありません。")
         return
 
-    for day in sorted(missions.keys()):
-        data = missions[day]
+    month = show_month_pager(index.months(), "mission_history_month")
+    # 月の達成率は日別指標（daily_metrics.py）の範囲集計で出す
+    with tracing.span("metrics.query"):
+        selected_n, achieved_n, rate = app_store.STORE.metrics(st.session_state.app_data).achievement(
+            *daily_metrics.month_range(month))
+    if rate is not None:
+        st.caption(f"この月の達成率 {rate:.0%}（ミッションを選んだ {selected_n} 日のうち {achieved_n} 日達成）")
+    for day in index.days_in(month):
+        data = missions.get(day)
         selected = data.get("selected")
         if not selected:
             continue
@@ -772,90 +469,82 @@ def show_mission_history():
 
     st.markdown('</div>', unsafe_allow_html=True)
 
-    if st.button("⬅ 戻る"):
-        st.session_state.page = "today_mission_display"
-        safe_rerun()
+    nav_button("⬅ 戻る", "today_mission_display")
 
 # -------------------------
 # カレンダー描画（既存）
 # -------------------------
+def select_date(d):
+    sm.select_date(d)
+
+def shift_month(delta):
+    """選択日を delta か月ずらす（日は月末で丸める）"""
+    cur = sm.selected_date
+    y, m = divmod(cur.year * 12 + cur.month - 1 + delta, 12)
+    m += 1
+    sm.select_date(datetime.date(y, m, min(cur.day, calendar.monthrange(y, m)[1])))
+
+CAL_WEEKDAYS = ["日","月","火","水","木","金","土"]
+
 def render_month_calendar(year, month):
-    cal = calendar.Calendar(firstweekday=6)
-    weeks = cal.monthdayscalendar(year, month)
-    st.markdown(f"#### {year}年 {month}月")
-    days = ["日","月","火","水","木","金","土"]
-    cols = st.columns(7)
-    for i,d in enumerate(days):
-        cols[i].markdown(f"**{d}**")
+    """
+    月のカレンダーを1つの表（st.dataframe のセル選択）で描く。日付のセルを選ぶと選択日が変わる。
+    各日の印（🍱 食事 / ✅ ミッション達成 / 📝 フィードバック）は date_index.day_flags で日付キーから直接引く
+    """
+    weeks = calendar.Calendar(firstweekday=6).monthdayscalendar(year, month)
+    days = [datetime.date(year, month, d) for wk in weeks for d in wk if d]
+    flags = date_index.day_flags(st.session_state.app_data, [d.isoformat() for d in days])
+    grid = {w: [] for w in CAL_WEEKDAYS}
     for wk in weeks:
-        cols = st.columns(7)
-        for i,day in enumerate(wk):
+        for i, day in enumerate(wk):
             if day == 0:
-                cols[i].write(" ")
-            else:
-                d = datetime.date(year, month, day)
-                label = str(day)
-                display_label = f"▶ {label}" if d == st.session_state.today_date else label
-                if cols[i].button(display_label, key=f"cal_{year}_{month}_{day}"):
-                    st.session_state.today_date = d
-                    safe_rerun()
+                grid[CAL_WEEKDAYS[i]].append("")
+                continue
+            d = datetime.date(year, month, day)
+            label = f"▶{day}" if d == sm.selected_date else str(day)
+            grid[CAL_WEEKDAYS[i]].append(f"{label} {date_index.marks(flags[d.isoformat()])}".rstrip())
+
+    key = f"cal_{year}_{month}"
+    def on_select():
+        cells = st.session_state[key]["selection"]["cells"]
+        if not cells:
+            return
+        row, col = cells[0]
+        day = weeks[row][CAL_WEEKDAYS.index(col)]
+        if day:
+            select_date(datetime.date(year, month, day))
+
+    st.markdown(f"#### {year}年 {month}月")
+    st.dataframe(grid, key=key, on_select=on_select, selection_mode="single-cell",
+                 hide_index=True, width="stretch", height=36 * (len(weeks) + 1) + 3)
+    st.caption("🍱 食事の記録あり　✅ ミッション達成　📝 フィードバックあり")
 
 # -------------------------
 # 食事管理画面（量選択・削除機能追加）
 # -------------------------
-def show_meal():
-    def hdr_right(col):
-        if col.button("📅 カレンダー", key="hdr_cal_main"):
-            st.session_state.show_calendar = not st.session_state.show_calendar
-    show_header("食事管理", right_callable=hdr_right)
-    st.markdown('<div class="section">', unsafe_allow_html=True)
-    st.markdown(f"**選択中の日付：** {st.session_state.today_date.strftime('%Y-%m-%d')}")
-    if st.session_state.show_calendar:
-        y = st.session_state.today_date.year
-        m = st.session_state.today_date.month
-        n1,n2,n3 = st.columns([0.2,0.6,0.2])
-        if n1.button("◀", key="cal_prev_main"):
-            if m == 1:
-                y -= 1; m = 12
-            else:
-                m -= 1
-            st.session_state.today_date = datetime.date(y,m,st.session_state.today_date.day if st.session_state.today_date.day<=calendar.monthrange(y,m)[1] else calendar.monthrange(y,m)[1])
-            safe_rerun()
-        if n3.button("▶", key="cal_next_main"):
-            if m == 12:
-                y += 1; m = 1
-            else:
-                m += 1
-            st.session_state.today_date = datetime.date(y,m,st.session_state.today_date.day if st.session_state.today_date.day<=calendar.monthrange(y,m)[1] else calendar.monthrange(y,m)[1])
-            safe_rerun()
-        render_month_calendar(y,m)
-    st.write("---")
-    st.subheader("食事入力")
-    key_date = st.session_state.today_date.strftime("%Y-%m-%d")
-
-    md = st.session_state.app_data.setdefault("meal_data", {})
-    if key_date not in md:
-        md[key_date] = {"朝食":[],"昼食":[],"夕食":[],"間食":[]}
-    for dkey, dd in md.items():
-        for meal in ["朝食","昼食","夕食","間食"]:
-            items = dd.get(meal, [])
-            new_items = []
-            for it in items:
-                if isinstance(it, str):
-                    new_items.append({"item": it, "intake": "普通"})
-                elif isinstance(it, dict) and ("item" in it or "name" in it or "food" in it):
-                    name = it.get("item") or it.get("name") or it.get("food")
-                    intake = it.get("intake") or it.get("amount_label") or "普通"
-                    new_items.append({"item": name, "intake": intake})
-                else:
-                    pass
-            dd[meal] = new_items
-        md[dkey] = dd
-    st.session_state.app_data["meal_data"] = md
-
-    meals = st.session_state.app_data["meal_data"][key_date]
-
-    for meal in ["朝食","昼食","夕食","間食"]:
+def add_meal_item(meal, key_date):
+    """「追加」の on_click。fragment の再実行より前に呼ばれるので、描画し直しの rerun は不要"""
+    new_key = f"add_{meal}_{key_date}"
+    new_val = st.session_state.get(new_key,"").strip()
+    if not new_val:
+        sm.flags.flash(f"add_warning_{meal}")
+        return
+    intake = st.session_state.get(f"intake_{meal}_{key_date}", "普通")
+    st.session_state.app_data["meal_data"][key_date][meal].append({"item": new_val, "intake": intake})
+    save_app(st.session_state.app_data)
+
+def delete_meal_item(meal, key_date, i):
+    st.session_state.app_data["meal_data"][key_date][meal].pop(i)
+    save_app(st.session_state.app_data)
+
+@fragment
+def show_meal_slot(meal, key_date):
+    """1区分分の一覧と追加欄。この中の追加・削除ではこの区分だけが再実行される"""
+    t0 = time.perf_counter()
+    # 部分の再実行ではそれ自体を1回の run として記録する（全体の再実行の中ではただの区間）
+    fragment_run = not tracing.in_run()
+    with tracing.start_run(f"meal:{meal}"):
+        meals = st.session_state.app_data["meal_data"].get(key_date) or {}
         st.markdown(f"**{meal}**")
         if meals.get(meal):
             for i,it in enumerate(meals[meal]):
@@ -863,94 +552,191 @@ def show_meal():
                 display_name = f"{it['item']}（{it.get('intake','普通')}）" if isinstance(it, dict) else f"{it}（普通）"
                 cols[0].write(f"- {display_name}")
                 if cols[1].button("編集", key=f"edit_{meal}_{i}_{key_date}"):
-                    st.session_state[f"edit_item_{meal}_{i}_{key_date}"] = it
-                    st.session_state[f"edit_idx_{meal}_{key_date}"] = i
-                    st.session_state[f"edit_meal_{meal}_{key_date}"] = meal
-                    st.session_state.page = "edit_item"
-                    save_app(st.session_state.app_data)
-                    safe_rerun()
-                if cols[2].button("削除", key=f"del_{meal}_{i}_{key_date}"):
-                    meals[meal].pop(i)
-                    st.session_state.app_data["meal_data"][key_date] = meals
-                    save_app(st.session_state.app_data)
+                    sm.begin_edit(meal, i, it)
+                    # fragment 内の on_click ではその fragment しか再実行されないので、ページ遷移は全体を再実行する
+                    go("edit_item")
                     safe_rerun()
+                cols[2].button("削除", key=f"del_{meal}_{i}_{key_date}", on_click=delete_meal_item, args=(meal, key_date, i))
         new_key = f"add_{meal}_{key_date}"
         st.text_input(f"{meal} を追加 (例: ハンバーグ)", key=new_key, placeholder="食事名を入力してください")
         intake_key = f"intake_{meal}_{key_date}"
-        intake = st.selectbox("量を選択", ["少なめ","普通","多め"], index=1, key=intake_key)
-        if st.button("追加", key=f"btn_{new_key}"):
-            new_val = st.session_state.get(new_key,"").strip()
-            if new_val:
-                meals[meal].append({"item": new_val, "intake": intake})
-                st.session_state.app_data["meal_data"][key_date] = meals
-                save_app(st.session_state.app_data)
-                safe_rerun()
-            else:
-                st.warning("入力が空です。")
-    if st.button("保存（全体）", key="save_meals_main"):
-        st.session_state.app_data["meal_data"][key_date] = meals
-        save_app(st.session_state.app_data)
+        st.selectbox("量を選択", ["少なめ","普通","多め"], index=1, key=intake_key)
+        st.button("追加", key=f"btn_{new_key}", on_click=add_meal_item, args=(meal, key_date))
+        if sm.flags.take(f"add_warning_{meal}", False):
+            st.warning("入力が空です。")
+    if fragment_run:
+        # 全体の再実行の中で描いた分は "app" の所要時間に含まれるので、区分単位の再実行としては数えない
+        app_bootstrap.record_rerun(time.perf_counter() - t0, scope=f"meal:{meal}")
+
+# -------------------------
+# まとめて入力（全区分を1つの表で編集し、保存は1回）
+# -------------------------
+MEAL_SLOTS = ["朝食","昼食","夕食","間食"]
+INTAKES = ["少なめ","普通","多め"]
+
+def meals_to_rows(meals):
+    return [{"区分": meal, "食品名": it["item"], "量": it.get("intake","普通")}
+            for meal in MEAL_SLOTS for it in meals.get(meal, [])]
+
+def rows_to_meals(rows):
+    """表の行を区分ごとにまとめ直す。食品名が空の行は捨てる"""
+    meals = {meal: [] for meal in MEAL_SLOTS}
+    for r in rows:
+        name = (r.get("食品名") or "").strip()
+        if not name:
+            continue
+        meal = r.get("区分") if r.get("区分") in meals else "間食"
+        intake = r.get("量") if r.get("量") in INTAKES else "普通"
+        meals[meal].append({"item": name, "intake": intake})
+    return meals
+
+def apply_editor_changes(rows, changes):
+    """st.data_editor の変更（edited_rows / added_rows / deleted_rows）を元の行に当てる"""
+    rows = [dict(r) for r in rows]
+    for i, diff in changes.get("edited_rows", {}).items():
+        rows[int(i)].update(diff)
+    deleted = set(changes.get("deleted_rows", []))
+    rows = [r for i, r in enumerate(rows) if i not in deleted]
+    for added in changes.get("added_rows", []):
+        rows.append({"区分": "間食", "食品名": "", "量": "普通", **added})
+    return rows
+
+def bulk_editor_key(key_date):
+    # 保存・コピーのたびに版を上げて、表を保存後の内容で作り直す（古い変更が残らないように）
+    return f"bulk_{key_date}_{sm.flags.bulk_ver}"
+
+def save_bulk_meals(key_date):
+    """「まとめて保存」の on_click。表の変更をまとめて当てて、save_app は1回だけ"""
+    md = st.session_state.app_data["meal_data"]
+    changes = st.session_state.get(bulk_editor_key(key_date)) or {}
+    md[key_date] = rows_to_meals(apply_editor_changes(meals_to_rows(md[key_date]), changes))
+    save_app(st.session_state.app_data)
+    sm.flags.bulk_ver += 1
+    sm.flags.flash("bulk_saved")
+
+def copy_meals_from(key_date):
+    """「この日の食事を追加」の on_click。選んだ日の全区分を今の日に足す"""
+    src = st.session_state.get("copy_src")
+    md = st.session_state.app_data["meal_data"]
+    if not src or src not in md:
+        return
+    for meal in MEAL_SLOTS:
+        md[key_date][meal].extend(dict(it) for it in md.get(src, {}).get(meal, []))
+    save_app(st.session_state.app_data)
+    sm.flags.bulk_ver += 1
+    sm.flags.flash("bulk_copied", src)
+
+def show_bulk_meal_editor(key_date):
+    md = st.session_state.app_data["meal_data"]
+    with st.form(f"bulk_form_{key_date}", border=False):
+        st.data_editor(
+            meals_to_rows(md.get(key_date) or {}), key=bulk_editor_key(key_date), num_rows="dynamic",
+            hide_index=True, width="stretch",
+            column_order=["区分", "食品名", "量"],
+            column_config={
+                "区分": st.column_config.SelectboxColumn("区分", options=MEAL_SLOTS, required=True, default="間食"),
+                "食品名": st.column_config.TextColumn("食品名", required=True),
+                "量": st.column_config.SelectboxColumn("量", options=INTAKES, required=True, default="普通"),
+            },
+        )
+        st.form_submit_button("まとめて保存", on_click=save_bulk_meals, args=(key_date,))
+    if sm.flags.take("bulk_saved", False):
         st.success("保存しました。")
-    c1,c2,c3 = st.columns(3)
-    if c1.button("🍱 食事管理", key="nav_meal_main"): st.session_state.page="meal"; safe_rerun()
-    if c2.button("📝 フィードバック", key="nav_feedback_main"): st.session_state.page="feedback"; safe_rerun()
-    if c3.button("🎯 今日のミッション", key="nav_today_from_meal"): st.session_state.page="today_mission_display"; safe_rerun()
+
+    # 他の日の食事をまとめてコピー（記録がある日だけ、新しい順）
+    days = app_store.STORE.date_index(st.session_state.app_data, "meal_data", date_index.has_meals)
+    options = [d for m in days.months() for d in days.days_in(m, reverse=True) if d != key_date]
+    if options:
+        c1, c2 = st.columns([0.6, 0.4])
+        c1.selectbox("他の日からコピー", options, key="copy_src")
+        c2.button("この日の食事を追加", key="copy_meals_btn", on_click=copy_meals_from, args=(key_date,))
+    copied = sm.flags.take("bulk_copied")
+    if copied:
+        st.success(f"{copied} の食事を追加しました。")
+
+@page("meal")
+def show_meal():
+    def toggle_calendar():
+        sm.show_calendar = not sm.show_calendar
+    def hdr_right(col):
+        col.button("📅 カレンダー", key="hdr_cal_main", on_click=toggle_calendar)
+    show_header("食事管理", right_callable=hdr_right)
+    st.markdown('<div class="section">', unsafe_allow_html=True)
+    st.markdown(f"**選択中の日付：** {sm.date_key}")
+    if sm.show_calendar:
+        y = sm.selected_date.year
+        m = sm.selected_date.month
+        n1,n2,n3 = st.columns([0.2,0.6,0.2])
+        n1.button("◀", key="cal_prev_main", on_click=shift_month, args=(-1,))
+        n3.button("▶", key="cal_next_main", on_click=shift_month, args=(1,))
+        render_month_calendar(y,m)
+    st.write("---")
+    st.subheader("食事入力")
+    key_date = sm.date_key
+
+    md = st.session_state.app_data.setdefault("meal_data", {})
+    if key_date not in md:
+        md[key_date] = {"朝食":[],"昼食":[],"夕食":[],"間食":[]}
+
+    mode = st.radio("入力方法", ["1品ずつ", "まとめて"], key="meal_entry_mode", horizontal=True)
+    if mode == "まとめて":
+        # 全区分を1つの表で追加・編集・削除し、「まとめて保存」で1回だけ書き込む
+        show_bulk_meal_editor(key_date)
+    else:
+        # 区分ごとに fragment にして、追加・削除ではその区分だけを再実行する
+        for meal in MEAL_SLOTS:
+            show_meal_slot(meal, key_date)
+        if st.button("保存（全体）", key="save_meals_main"):
+            # 追加・削除は各区分の on_click で書き換え済み
+            save_app(st.session_state.app_data)
+            st.success("保存しました。")
+    show_nav_bar("nav_meal_main", "nav_feedback_main", "nav_today_from_meal")
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # edit item page (simple)
 # -------------------------
+@page("edit_item")
 def show_edit_item():
-    keys = [k for k in st.session_state.keys() if k.startswith("edit_item_")]
-    today = st.session_state.today_date.strftime("%Y-%m-%d")
-    edit_keys = [k for k in st.session_state.keys() if k.endswith(f"_{today}")]
-    if not edit_keys:
-        st.session_state.page = "meal"; safe_rerun(); return
-    edit_item_key = [k for k in edit_keys if k.startswith("edit_item_")][0]
-    edit_idx_key = [k for k in edit_keys if k.startswith("edit_idx_")][0]
-    edit_meal_key = [k for k in edit_keys if k.startswith("edit_meal_")][0]
-
-    item = st.session_state.get(edit_item_key)
-    idx = st.session_state.get(edit_idx_key)
-    meal = st.session_state.get(edit_meal_key)
+    # 編集中の品目は sm.edit（選択中の日付のものだけ。日付を変えると消える）
+    ctx = sm.current_edit()
+    if ctx is None:
+        go("meal"); safe_rerun(); return
+    item, idx, meal = ctx.item, ctx.idx, ctx.meal
 
     show_header("食事編集")
     st.markdown('<div class="section">', unsafe_allow_html=True)
 
-    name = st.text_input("食事名", value=item.get("item",""))
-    intake = st.selectbox("量", ["少なめ","普通","多め"], index=["少なめ","普通","多め"].index(item.get("intake","普通")))
+    def finish(save):
+        if save:
+            key_date = ctx.date
+            md = st.session_state.app_data.setdefault("meal_data", {})
+            if key_date in md and meal in md[key_date] and idx < len(md[key_date][meal]):
+                md[key_date][meal][idx] = {"item": st.session_state.edit_name, "intake": st.session_state.edit_intake}
+                st.session_state.app_data["meal_data"] = md
+                save_app(st.session_state.app_data)
+        sm.end_edit()
+        go("meal")
 
-    if st.button("保存"):
-        key_date = st.session_state.today_date.strftime("%Y-%m-%d")
-        md = st.session_state.app_data.setdefault("meal_data", {})
-        if key_date in md and meal in md[key_date] and idx < len(md[key_date][meal]):
-            md[key_date][meal][idx] = {"item": name, "intake": intake}
-            st.session_state.app_data["meal_data"] = md
-            save_app(st.session_state.app_data)
-        st.session_state.page = "meal"
-        for k in [edit_item_key, edit_idx_key, edit_meal_key]:
-            if k in st.session_state: del st.session_state[k]
-        safe_rerun()
+    st.text_input("食事名", value=item.get("item",""), key="edit_name")
+    st.selectbox("量", ["少なめ","普通","多め"], index=["少なめ","普通","多め"].index(item.get("intake","普通")), key="edit_intake")
 
-    if st.button("キャンセル"):
-        st.session_state.page = "meal"
-        for k in [edit_item_key, edit_idx_key, edit_meal_key]:
-            if k in st.session_state: del st.session_state[k]
-        safe_rerun()
+    st.button("保存", on_click=finish, args=(True,))
+    st.button("キャンセル", on_click=finish, args=(False,))
 
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # フィードバック（右上に過去ボタン）
 # -------------------------
+@page("feedback")
 def show_feedback():
     def hdr_right(col):
-        if col.button("過去", key="hdr_past_fb"):
-            st.session_state.page = "feedback_history"; safe_rerun()
+        nav_button("過去", "feedback_history", key="hdr_past_fb", container=col)
     show_header("フィードバック", right_callable=hdr_right)
     st.markdown('<div class="section">', unsafe_allow_html=True)
 
-    key_date = st.session_state.today_date.strftime("%Y-%m-%d")
+    key_date = sm.date_key
     meals = st.session_state.app_data.get("meal_data", {}).get(key_date, {"朝食":[],"昼食":[],"夕食":[],"間食":[]})
     age = st.session_state.user_info.get("age", 0)
     gender = st.session_state.user_info.get("gender", "")
@@ -960,35 +746,84 @@ def show_feedback():
     st.write("食事・プロフィール・自尊感情を踏まえたフィードバックを生成します。")
 
     nutrient_totals, tendencies = calc_nutrition(meals)
+    sel_m = st.session_state.app_data.get("missions", {}).get(key_date, {}).get("selected")
 
-    if st.button("フィードバック生成", key="gen_fb_btn"):
-        sel_m = st.session_state.app_data.get("missions", {}).get(key_date, {}).get("selected")
-        fb_text = try_generate_feedback(age, gender, self_esteem, meals, selected_mission=sel_m)
-        st.session_state.app_data.setdefault("feedback", {})[key_date] = {
-            "text": fb_text,
-            "meta": {
-                "age": age,
-                "gender": gender,
-                "self_esteem": self_esteem,
-                "selected_mission": sel_m,
-                "nutrient_totals": nutrient_totals,
-                "tendencies": tendencies
-            }
+    # 入力の指紋：前回生成時と同じなら再生成しない（確認したときだけ再生成）
+    fingerprint = llm.feedback_fingerprint(age, gender, self_esteem, meals, sel_m)
+    meals_fp = llm.meals_fingerprint(meals)
+    fb_obj = st.session_state.app_data.get("feedback", {}).get(key_date)
+    stored_fp = (fb_obj or {}).get("meta", {}).get("input_fingerprint")
+    # 固定文（生成失敗・利用上限）のフィードバックは確認なしで作り直せるようにする
+    unchanged = bool(fb_obj) and stored_fp == fingerprint and not llm.is_fallback_feedback(fb_obj.get("text"))
+
+    def generate(regenerate=False):
+        fb_text, next_missions, rationale = try_generate_feedback_and_missions(age, gender, self_esteem, meals, selected_mission=sel_m,
+                                                                               regenerate=regenerate)
+        meta = {
+            "age": age,
+            "gender": gender,
+            "self_esteem": self_esteem,
+            "selected_mission": sel_m,
+            "nutrient_totals": nutrient_totals,
+            "tendencies": tendencies,
+            "meals_fingerprint": meals_fp
         }
+        if not llm.is_fallback_feedback(fb_text):
+            # 入力の指紋はモデルの応答が得られたときだけ残す（失敗した分は次回そのまま作り直す）
+            meta["input_fingerprint"] = fingerprint
+        st.session_state.app_data.setdefault("feedback", {})[key_date] = {"text": fb_text, "meta": meta}
+        # 同じ呼び出しで得た翌日ミッションを保存しておき、翌日のミッション生成を省く。
+        # 過去の日のフィードバックでは、別の過去の日のミッションを作ったり書き換えたりしないよう保存しない
+        if next_missions and sm.selected_date == datetime.date.today():
+            next_date = (sm.selected_date + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+            nxt = st.session_state.app_data.setdefault("missions", {}).setdefault(
+                next_date, {"auto": [], "custom": [], "selected": None, "status": {}}
+            )
+            if not nxt.get("auto"):
+                nxt["auto"] = next_missions
+            if rationale:
+                st.session_state.app_data["feedback"][key_date]["meta"]["mission_rationale"] = rationale
         save_app(st.session_state.app_data)
+        sm.flags.take("fb_regen_confirm")
         st.success("フィードバックを生成しました。")
         safe_rerun()
 
+    if st.button("フィードバック生成", key="gen_fb_btn"):
+        if unchanged:
+            sm.flags.flash("fb_regen_confirm", key_date)
+        else:
+            generate()
+
+    if unchanged and sm.flags.peek("fb_regen_confirm") == key_date:
+        st.info("食事・ミッション・プロフィールは前回の生成時から変わっていません。同じ条件で作り直しますか？")
+        r1, r2 = st.columns(2)
+        if r1.button("再生成する", key="fb_regen_yes"):
+            generate(regenerate=True)
+        r2.button("やめる", key="fb_regen_no", on_click=lambda: sm.flags.take("fb_regen_confirm"))
+
     fb_obj = st.session_state.app_data.get("feedback", {}).get(key_date)
     if fb_obj:
         st.markdown("**生成済みフィードバック**")
         meta = fb_obj.get("meta", {})
+        if stored_fp and not unchanged:
+            # 生成後に入力が変わった（古い）フィードバック
+            if meta.get("meals_fingerprint") != meals_fp:
+                reason = "生成後に食事内容が変更されています"
+            else:
+                reason = "生成後にミッションまたはプロフィールが変更されています"
+            st.markdown(
+                f"<span style='background:#FDEBD0; color:#B9770E; border-radius:6px; padding:2px 8px; font-size:0.9rem;'>"
+                f"⚠ 古いフィードバック：{reason}</span>",
+                unsafe_allow_html=True
+            )
         with st.expander("プロフィールと簡易栄養結果（表示）", expanded=True):
             st.write(f"年齢: {meta.get('age', age)}")
             st.write(f"性別: {meta.get('gender', gender)}")
             st.write(f"自尊感情レベル: {meta.get('self_esteem', self_esteem)}")
             selm = meta.get('selected_mission') or 'なし'
             st.write(f"選択ミッション: {selm}")
+            if meta.get('mission_rationale'):
+                st.write(f"明日のミッションの理由: {meta['mission_rationale']}")
             nt = meta.get('nutrient_totals') or nutrient_totals
             tend = meta.get('tendencies') or tendencies
             st.write("**簡易栄養合計（内部単位）**")
@@ -1003,59 +838,65 @@ def show_feedback():
         st.write(fb_obj.get("text",""))
 
     st.write("---")
-    c1,c2,c3 = st.columns(3)
-    if c1.button("🍱 食事管理", key="nav_meal_fb"):
-        st.session_state.page="meal"; safe_rerun()
-    if c2.button("📝 フィードバック", key="nav_feedback_fb"):
-        st.session_state.page="feedback"; safe_rerun()
-    if c3.button("🎯 今日のミッション", key="nav_today_fb"):
-        st.session_state.page="today_mission_display"; safe_rerun()
+    show_nav_bar("nav_meal_fb", "nav_feedback_fb", "nav_today_fb")
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # 過去のフィードバック画面
 # -------------------------
+@fragment
+def show_feedback_history_day(dt):
+    """1日分。本文と食事は「詳しく見る」を開いたときだけ描画する（開閉はこの日だけ再実行）"""
+    fb = st.session_state.app_data.get("feedback", {}).get(dt) or {}
+    text = fb.get("text","") or ""
+    preview = text[:40] + ("…" if len(text) > 40 else "")
+    st.markdown(f"**{dt}**　{preview}")
+    if st.toggle("詳しく見る", key=f"fbh_open_{dt}"):
+        meta = fb.get('meta', {})
+        st.write(f"年齢: {meta.get('age','-')}, 性別: {meta.get('gender','-')}, 自尊感情: {meta.get('self_esteem','-')}")
+        nt = meta.get('nutrient_totals') or {}
+        if nt:
+            st.write(f"タンパク質: {nt.get('タンパク質',0)}, 脂質: {nt.get('脂質',0)}, 炭水化物: {nt.get('炭水化物',0)}")
+
+        md = st.session_state.app_data.get("meal_data", {}).get(dt, {})
+        if md:
+            st.write("**その日の食事（量つき）**")
+            for meal_name, items in md.items():
+                for it in items:
+                    if isinstance(it, str):
+                        st.write(f"- {meal_name}: {it}（普通）")
+                    else:
+                        st.write(f"- {meal_name}: {it.get('item', it.get('name',''))}（{it.get('intake','普通')}）")
+
+        st.write(text)
+    st.write("---")
+
+@page("feedback_history")
 def show_feedback_history():
     show_header("過去のフィードバック")
     st.markdown('<div class="section">', unsafe_allow_html=True)
-    feedbacks = st.session_state.app_data.get("feedback", {})
-    if not feedbacks:
+    index = app_store.STORE.date_index(st.session_state.app_data, "feedback")
+    if not len(index):
         st.write("まだフィードバックはありません。")
     else:
-        for dt in sorted(feedbacks.keys(), reverse=True):
-            st.markdown(f"**{dt}**")
-            meta = feedbacks[dt].get('meta', {})
-            st.write(f"年齢: {meta.get('age','-')}, 性別: {meta.get('gender','-')}, 自尊感情: {meta.get('self_esteem','-')}")
-            nt = meta.get('nutrient_totals') or {}
-            if nt:
-                st.write(f"タンパク質: {nt.get('タンパク質',0)}, 脂質: {nt.get('脂質',0)}, 炭水化物: {nt.get('炭水化物',0)}")
-
-            md = st.session_state.app_data.get("meal_data", {}).get(dt, {})
-            if md:
-                st.write("**その日の食事（量つき）**")
-                for meal_name, items in md.items():
-                    for it in items:
-                        if isinstance(it, str):
-                            st.write(f"- {meal_name}: {it}（普通）")
-                        else:
-                            st.write(f"- {meal_name}: {it.get('item', it.get('name',''))}（{it.get('intake','普通')}）")
-
-            st.write(feedbacks[dt].get("text",""))
-            st.write("---")
-    c1,c2,c3 = st.columns(3)
-    if c1.button("🍱 食事管理", key="nav_meal_fbh"):
-        st.session_state.page="meal"; safe_rerun()
-    if c2.button("📝 フィードバック", key="nav_feedback_fbh"):
-        st.session_state.page="feedback"; safe_rerun()
-    if c3.button("🎯 今日のミッション", key="nav_today_fbh"):
-        st.session_state.page="today_mission_display"; safe_rerun()
+        month = show_month_pager(index.months(), "feedback_history_month")
+        with tracing.span("metrics.query"):
+            dm = app_store.STORE.metrics(st.session_state.app_data)
+            span = daily_metrics.last_days(90)
+            cal, salt = dm.mean("cal", *span), dm.mean("塩分", *span)
+        if cal is not None:
+            st.caption(f"直近90日の平均（食事を記録した {dm.logged_days(*span)} 日）: "
+                       f"エネルギー {cal:.0f} kcal・塩分 {salt:.1f} g")
+        for dt in index.days_in(month, reverse=True):
+            show_feedback_history_day(dt)
+    show_nav_bar("nav_meal_fbh", "nav_feedback_fbh", "nav_today_fbh")
     st.markdown('</div>', unsafe_allow_html=True)
 
 # -------------------------
 # 初回判定・ページ遷移
 # -------------------------
 def ensure_today_mission():
-    today = st.session_state.today_date.strftime("%Y-%m-%d")
+    today = sm.date_key
     missions = st.session_state.app_data.setdefault("missions", {})
     if today not in missions:
         missions[today] = {
@@ -1065,35 +906,84 @@ def ensure_today_mission():
             "status": {}
         }
         save_app(st.session_state.app_data)
-    return missions[today]
-
-if "page" not in st.session_state:
-    st.session_state.page = "init_register" if not st.session_state.registered else "self_esteem"
-
-if st.session_state.get("registered") and st.session_state.get("page") == "init_register":
-    st.session_state.page = "self_esteem"
-
-page = st.session_state.get("page")
-if page == "init_register":
-    show_init_register()
-elif page == "self_esteem":
-    show_self_esteem()
-elif page == "mission":
-    show_mission()
-elif page == "meal":
-    if st.session_state.page == "edit_item":
-        show_edit_item()
+    return missions.get(today)
+
+if st.session_state.get("registered") and sm.nav.page == "init_register":
+    sm.nav.page = "self_esteem"
+
+def route():
+    nav = sm.nav
+    name = nav.page
+    if nav.pending:
+        nav.pending_runs += 1
+    render = PAGES.get(name)
+    if render is None:
+        st.write("不明なページです。初期画面を表示します。")
+        nav.page = "init_register"
+        safe_rerun()
+    with tracing.span(f"page:{name}"):
+        render()
+    if nav.pending == name:
+        # クリックから遷移先の描画が終わるまでのスクリプト実行回数（on_click での遷移なら1）
+        app_bootstrap.record_navigation(nav.pending_runs)
+        nav.pending = None
+
+# -------------------------
+# デバッグ表示（APP_DEBUG=1 のときだけ。ページ下部の折りたたみ）
+# -------------------------
+def show_debug_panel():
+    with st.expander("🛠 デバッグ", expanded=False):
+        run = tracing.TRACER.last_run()
+        if run:
+            st.markdown(f"**この実行：** {run['page']} {run['ms']}ms")
+            st.dataframe([{"区間": "　" * s["depth"] + s["name"], "開始(ms)": s["start_ms"], "所要(ms)": s["ms"]}
+                          for s in run["spans"]], hide_index=True, width="stretch")
+        st.markdown("**画面ごとの所要時間（直近）**")
+        st.json(tracing.TRACER.stats(), expanded=False)
+        st.download_button("計測を JSON Lines で保存", tracing.TRACER.export_jsonl(),
+                           file_name="trace.jsonl", mime="application/x-ndjson", key="dbg_trace_dl")
+        st.markdown("**プロファイル**")
+        prof = sm.profile
+        if prof is not None:
+            collapsed_path, html_path = prof.paths()
+            state = f"残り {prof.runs_left} 回" if prof.active else "完了"
+            st.caption(f"{state}（{prof.runs_done} 回・{prof.samples} サンプル）: {html_path} / {collapsed_path}")
+        p1, p2 = st.columns([0.5, 0.5])
+        p1.number_input("計測する実行回数", min_value=1, max_value=profiler.MAX_RUNS, value=5, key="dbg_profile_runs")
+        p2.button("次の実行から計測", key="dbg_profile_start", on_click=lambda: start_profile(st.session_state.dbg_profile_runs))
+        st.markdown("**その他**")
+        st.json({
+            "api_key_present": boot.api_key_present,
+            "llm_singleflight": singleflight.GROUP.stats(),
+            "llm_ratelimit": ratelimit.LIMITER.stats(),
+            "llm_prompt_tokens": prompt_budget.STATS.stats(),
+            "startup": app_bootstrap.report(),
+            "session_memory": session_model.memory_report(st.session_state),
+            "app_store": app_store.STORE.stats(),
+        }, expanded=False)
+
+# ?profile=N で、このセッションの次の N 回（最大 MAX_RUNS 回）の実行をサンプリングする（profiler.py）。
+# デバッグ表示が有効なときだけ受け付ける。URL からはすぐ消す
+if "profile" in st.query_params:
+    runs = profiler.parse_runs(st.query_params["profile"]) if boot.debug else None
+    if runs is not None:
+        sm.profile = profiler.Profile(runs)
+    del st.query_params["profile"]
+
+def start_profile(n):
+    sm.profile = profiler.Profile(n)
+
+def run_app():
+    with tracing.start_run(sm.nav.page), app_store.STORE.measure(st.session_state.app_data):
+        route()
+
+try:
+    if sm.profile is not None and sm.profile.active:
+        with profiler.sample(sm.profile, label=sm.nav.page):
+            run_app()
     else:
-        show_meal()
-elif page == "feedback":
-    show_feedback()
-elif page == "feedback_history":
-    show_feedback_history()
-elif page == "today_mission_display":
-    show_today_mission_display()
-elif page == "mission_history":
-    show_mission_history()
-else:
-    st.write("不明なページです。初期画面を表示します。")
-    st.session_state.page = "init_register"
-    safe_rerun()
\ No newline at end of file
+        run_app()
+finally:
+    app_bootstrap.record_rerun(time.perf_counter() - _rerun_t0)
+if boot.debug:
+    show_debug_panel()
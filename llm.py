@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""
+LLM（OpenAI）呼び出しまわり
+- クライアント初期化（新 OpenAI クライアント / 旧 openai モジュールの両対応）
+- chat completions 呼び出し（同一リクエストは single-flight で合流、ratelimit で流量制御、全呼び出しを llm_ledger に記録）
+- AI ミッション生成・フィードバック生成のプロンプト組み立てと応答パース
+- 構造化出力モード：フィードバックと翌日ミッションを JSON で1回の呼び出しにまとめる
+- プロンプトの雛形はモジュール読み込み時に1度だけ用意し、食事行は prompt_budget で予算内に切り詰める
+- Streamlit に依存しないので file.py とバッチ処理の両方から使う
+"""
+
+import asyncio, os, json, hashlib, time
+
+import llm_ledger
+import prompt_budget
+import ratelimit
+import singleflight
+from nutrition import calc_nutrition
+
+MODEL = "gpt-4o-mini"
+MISSION_FALLBACK = ["野菜を1食とる", "水を1杯飲む", "20分歩く"]
+MISSION_SYSTEM = "あなたは親切で実用的な健康支援アドバイザーです。"
+
+
+# -------------------------
+# クライアント初期化
+# -------------------------
+def resolve_api_key(api_key=None):
+    return api_key or os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_KEY")
+
+
+def resolve_base_url(base_url=None):
+    # ローカルのスタブサーバ等に向けるときに使う（未指定なら本番 API）
+    return base_url or os.getenv("OPENAI_BASE_URL") or None
+
+
+def make_client(api_key=None, base_url=None, max_retries=None):
+    """
+    Returns (client, inited). client は新クライアント or 旧 openai モジュール。
+    キーが無い・初期化に失敗した場合は (None, False)。
+    max_retries: 新クライアントの自動リトライ回数（None ならライブラリ既定）
+    """
+    api_key = resolve_api_key(api_key)
+    base_url = resolve_base_url(base_url)
+    if not api_key:
+        return None, False
+    try:
+        # prefer new client style (OpenAI)
+        from openai import OpenAI
+    except Exception:
+        # fallback to legacy openai
+        try:
+            import openai
+            openai.api_key = api_key
+            if base_url:
+                openai.api_base = base_url
+            return openai, True
+        except Exception:
+            return None, False
+    try:
+        kwargs = {} if max_retries is None else {"max_retries": max_retries}
+        return OpenAI(api_key=api_key, base_url=base_url, **kwargs), True
+    except Exception:
+        return None, False
+
+
+# -------------------------
+# chat completions（新/旧クライアント共通）
+# -------------------------
+# 事前生成・バックフィルなど画面操作を待たせない用途は低優先度で、期限も長めにとる
+BACKGROUND_PURPOSES = {"missions_prefetch", "feedback_backfill", "mission_library_refill"}
+INTERACTIVE_DEADLINE_S = 20.0
+BACKGROUND_DEADLINE_S = 120.0
+
+
+def estimate_tokens(messages):
+    # メッセージごとの書式分として4トークンを足す
+    text = "".join(m.get("content", "") for m in messages)
+    return prompt_budget.count_tokens(text) + 4 * len(messages)
+
+
+def _retry_after(e):
+    """上流のレート制限（429）なら待つべき秒数、それ以外は None"""
+    if getattr(e, "status_code", None) != 429 and type(e).__name__ != "RateLimitError":
+        return None
+    try:
+        return max(0.5, float(e.response.headers.get("retry-after")))
+    except Exception:
+        return 1.0
+
+
+def chat_completion_text(client, messages, model=MODEL, temperature=0.7, max_tokens=200, json_mode=False,
+                         purpose="other", user=None, parse=None, fallback_on_error=False, reuse=True):
+    """
+    chat completions を呼んで本文を返す（parse があれば parse(本文) の結果）。
+    呼び出しは llm_ledger に1件記録する。fallback_on_error は「失敗時に呼び出し側が固定文を返す（または
+    別の呼び出しで作り直す）」ことの申告。
+    reuse=False（利用者が明示的に作り直すとき）は直前の同じ結果を使い回さない（進行中の同じ呼び出しには合流する）。
+    """
+    def request():
+        # support both new OpenAI client and legacy openai
+        if hasattr(client, "chat") and hasattr(client.chat, "completions"):
+            extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+            resp = client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **extra
+            )
+        else:
+            # 旧クライアントは response_format 非対応のためプロンプトの指示だけで JSON を求める
+            resp = client.ChatCompletion.create(
+                model=model, messages=messages, temperature=temperature, max_tokens=max_tokens
+            )
+        usage = getattr(resp, "usage", None)
+        tokens = (getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+        return resp.choices[0].message.content.strip(), tokens
+
+    def call():
+        # プロセス共通のレート制限：枠が空くまで期限内で待ち、上流の 429 も期限内なら待って再試行する
+        priority = ratelimit.BACKGROUND if purpose in BACKGROUND_PURPOSES else ratelimit.INTERACTIVE
+        deadline_s = BACKGROUND_DEADLINE_S if priority == ratelimit.BACKGROUND else INTERACTIVE_DEADLINE_S
+        estimated = estimate_tokens(messages) + max_tokens
+        deadline = time.monotonic() + deadline_s
+        while True:
+            ratelimit.LIMITER.acquire(estimated, priority, user, max(0.0, deadline - time.monotonic()))
+            try:
+                text, tokens = request()
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None:
+                    raise
+                # 429 の試行は上流で数えられていないので、利用者の上限から外す
+                ratelimit.LIMITER.refund(user, estimated)
+                if time.monotonic() + retry_after >= deadline:
+                    raise
+                wait = ratelimit.LIMITER.penalize(retry_after)
+                if wait:
+                    time.sleep(wait)
+                continue
+            ratelimit.LIMITER.settle(user, estimated, sum(tokens))
+            return text, tokens
+
+    key = singleflight.request_key(model, messages, temperature=temperature, max_tokens=max_tokens, json_mode=json_mode)
+    t0 = time.perf_counter()
+    shared = False
+    tokens = (0, 0)
+    try:
+        (text, tokens), shared = singleflight.GROUP.do_shared(key, call, reuse)
+        result = parse(text) if parse else text
+    except ValueError as e:
+        # 応答は得たが形式が不正（構造化出力のスキーマ不一致など）
+        llm_ledger.record(purpose, model, time.perf_counter() - t0, "invalid_output", *tokens,
+                          cache_hit=shared, fallback=fallback_on_error, user=user, error=e)
+        raise
+    except Exception as e:
+        llm_ledger.record(purpose, model, time.perf_counter() - t0, f"error:{type(e).__name__}",
+                          cache_hit=shared, fallback=fallback_on_error, user=user, error=e)
+        raise
+    # 合流した呼び出しは上流のトークンを消費していないので 0 で記録する
+    if shared:
+        tokens = (0, 0)
+    llm_ledger.record(purpose, model, time.perf_counter() - t0, "ok", *tokens, cache_hit=shared, user=user)
+    return result
+
+
+def record_no_client(purpose, user=None):
+    """クライアントが無く固定文を返したことを記録する"""
+    llm_ledger.record(purpose, MODEL, 0.0, "no_client", fallback=True, user=user)
+
+
+# -------------------------
+# 非同期版（バックフィルなど大量の呼び出しを asyncio でまとめて流す用）
+# -------------------------
+def make_async_client(api_key=None, base_url=None, max_retries=None):
+    """Returns AsyncOpenAI or None（旧 openai モジュールは非対応）"""
+    api_key = resolve_api_key(api_key)
+    if not api_key:
+        return None
+    try:
+        from openai import AsyncOpenAI
+        kwargs = {} if max_retries is None else {"max_retries": max_retries}
+        return AsyncOpenAI(api_key=api_key, base_url=resolve_base_url(base_url), **kwargs)
+    except Exception:
+        return None
+
+
+async def async_chat_completion_text(aclient, messages, model=MODEL, temperature=0.7, max_tokens=200,
+                                     purpose="other", user=None, fallback_on_error=False):
+    """chat_completion_text の非同期版（レート制限・台帳は同じものを使う。single-flight は通さない）"""
+    priority = ratelimit.BACKGROUND if purpose in BACKGROUND_PURPOSES else ratelimit.INTERACTIVE
+    deadline_s = BACKGROUND_DEADLINE_S if priority == ratelimit.BACKGROUND else INTERACTIVE_DEADLINE_S
+    estimated = estimate_tokens(messages) + max_tokens
+    t0 = time.perf_counter()
+    deadline = time.monotonic() + deadline_s
+    try:
+        while True:
+            # 制限の待ちはスレッドでブロックする（イベントループは止めない）
+            await asyncio.to_thread(ratelimit.LIMITER.acquire, estimated, priority, user,
+                                    max(0.0, deadline - time.monotonic()))
+            try:
+                resp = await aclient.chat.completions.create(
+                    model=model, messages=messages, temperature=temperature, max_tokens=max_tokens
+                )
+                break
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None:
+                    raise
+                ratelimit.LIMITER.refund(user, estimated)
+                if time.monotonic() + retry_after >= deadline:
+                    raise
+                wait = ratelimit.LIMITER.penalize(retry_after)
+                if wait:
+                    await asyncio.sleep(wait)
+    except Exception as e:
+        llm_ledger.record(purpose, model, time.perf_counter() - t0, f"error:{type(e).__name__}",
+                          fallback=fallback_on_error, user=user, error=e)
+        raise
+    usage = getattr(resp, "usage", None)
+    tokens = (getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+    ratelimit.LIMITER.settle(user, estimated, sum(tokens))
+    llm_ledger.record(purpose, model, time.perf_counter() - t0, "ok", *tokens, user=user)
+    return resp.choices[0].message.content.strip()
+
+
+# -------------------------
+# ★ AIミッション生成
+# -------------------------
+_MISSION_TEMPLATE = """あなたは健康行動支援の専門家です。
+以下の情報をもとに、対象者が今日取り組める簡単な行動ミッションを**短く具体的に3つ**提案してください。
+各ミッションは3〜7語程度にまとめてください。
+
+【プロフィール】
+- 年齢: {age}
+- 性別: {gender}
+- 自尊感情レベル: {self_esteem}
+
+【簡易栄養（内部単位）】
+タンパク質: {p}g, 脂質: {f}g, 炭水化物: {c}g
+
+【栄養傾向】
+{tendencies}
+
+出力は1行ずつ「1. ○○」の形式で3行にしてください。
+例:
+1. 野菜をもう一品追加する
+2. 夜に間食を控える
+3. 15分間速歩する
+""".format
+
+
+def _pfc(totals):
+    return {
+        "p": totals.get('タンパク質', totals.get('p',0)),
+        "f": totals.get('脂質', totals.get('f',0)),
+        "c": totals.get('炭水化物', totals.get('c',0)),
+    }
+
+
+def build_mission_prompt(user_info, meal_data):
+    nutrient_totals, tendencies = calc_nutrition(meal_data)
+    prompt = _MISSION_TEMPLATE(
+        age=user_info.get("age", 0),
+        gender=user_info.get("gender", ""),
+        self_esteem=user_info.get("self_esteem_level", ""),
+        tendencies=', '.join(tendencies) if tendencies else '特になし',
+        **_pfc(nutrient_totals)
+    )
+    prompt_budget.STATS.observe("missions", prompt_budget.count_tokens(prompt))
+    return prompt
+
+
+def parse_missions(text, fallback=MISSION_FALLBACK):
+    # parse into lines starting with 1. 2. 3.
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    missions = []
+    for ln in lines:
+        # try to strip "1." or "1)" prefixes
+        # handle common patterns
+        cleaned = ln
+        if ln.startswith(("1.","2.","3.","1)","2)","3)")):
+            cleaned = ln[2:].strip()
+        elif len(ln) >= 3 and ln[1:3] == ". ":
+            cleaned = ln[3:].strip()
+        cleaned = cleaned.lstrip('0123456789. )\t-')
+        cleaned = cleaned.strip()
+        if cleaned:
+            missions.append(cleaned)
+    # ensure length 3
+    out = missions[:3]
+    while len(out) < 3:
+        out.append(fallback[len(out)])
+    return out
+
+
+def request_missions(client, user_info, meal_data, purpose="missions", fallback_on_error=False, user=None):
+    """LLM にミッションを問い合わせる。失敗時は例外をそのまま投げる（バッチ用）。user は利用者キー（省略時は user_info から）"""
+    prompt = build_mission_prompt(user_info, meal_data)
+    return chat_completion_text(
+        client,
+        [{"role":"system","content":MISSION_SYSTEM}, {"role":"user","content":prompt}],
+        max_tokens=200, purpose=purpose, user=user or llm_ledger.user_key(user_info),
+        parse=parse_missions, fallback_on_error=fallback_on_error
+    )
+
+
+def generate_missions(client, user_info, meal_data):
+    """画面用：クライアントが無い・失敗した場合はフォールバックを返す"""
+    if not client:
+        record_no_client("missions", llm_ledger.user_key(user_info))
+        return list(MISSION_FALLBACK)
+    try:
+        return request_missions(client, user_info, meal_data, fallback_on_error=True)
+    except Exception:
+        return list(MISSION_FALLBACK)
+
+
+# -------------------------
+# フィードバック生成
+# -------------------------
+FEEDBACK_FALLBACK = "フィードバックを生成できませんでした。食事改善のポイントを意識してください。"
+FEEDBACK_QUOTA_TEXT = "本日の AI フィードバックの利用上限に達しました。明日またお試しください。"
+FEEDBACK_SYSTEM = "あなたは親切で実用的な栄養指導の専門家です。"
+
+
+def is_fallback_feedback(text):
+    """モデルの応答ではなく固定文（失敗・利用上限）のフィードバックか"""
+    return text in (FEEDBACK_FALLBACK, FEEDBACK_QUOTA_TEXT)
+
+
+def normalize_meals(meals):
+    # normalize old-style data if necessary
+    normalized_meals = {}
+    for k in ["朝食","昼食","夕食","間食"]:
+        raw_items = meals.get(k, []) if meals else []
+        norm = []
+        for it in raw_items:
+            if isinstance(it, str):
+                norm.append({"item": it, "intake": "普通"})
+            elif isinstance(it, dict):
+                name = it.get("item") or it.get("name")
+                intake = it.get("intake") or it.get("amount_label") or "普通"
+                norm.append({"item": name, "intake": intake})
+        normalized_meals[k] = norm
+    return normalized_meals
+
+
+_CONTEXT_TEMPLATE = """年齢: {age}
+性別: {gender}
+自尊感情レベル: {self_esteem}
+今日のミッション: {mission}
+
+【食事内容（量付き）】
+{meal_text}
+
+【推定栄養（内部単位）】
+タンパク質: {p}g, 脂質: {f}g, 炭水化物: {c}g
+
+【栄養傾向】
+{tendencies}
+""".format
+
+
+def _meal_text(lines):
+    return "\n".join(lines) if lines else "食事記録がありません。"
+
+
+def _context_text(age, gender, self_esteem_level, normalized_meals, selected_mission):
+    """
+    フィードバック / 構造化出力で共通の「プロフィール・食事・栄養」部分。
+    Returns (送る文面, 切り詰めで減ったトークン数)
+    """
+    lines, trimmed = prompt_budget.meal_lines(normalized_meals)
+    mission = prompt_budget.clip_text(selected_mission)
+    # 栄養は切り詰め前の全品目で計算する
+    totals, tendencies = calc_nutrition(normalized_meals)
+    meal_text = _meal_text(lines)
+    context = _CONTEXT_TEMPLATE(
+        age=age, gender=gender, self_esteem=self_esteem_level,
+        mission=mission or "なし", meal_text=meal_text,
+        tendencies=', '.join(tendencies) if tendencies else '特になし',
+        **_pfc(totals)
+    )
+    saved = 0
+    if trimmed or mission != selected_mission:
+        raw_lines = [f"{k}: {it['item']}（量: {it['intake']}）" for k, items in normalized_meals.items() for it in items]
+        saved = (prompt_budget.count_tokens(_meal_text(raw_lines)) - prompt_budget.count_tokens(meal_text)
+                 + prompt_budget.count_tokens(selected_mission or "") - prompt_budget.count_tokens(mission or ""))
+    return context, saved
+
+
+def meals_fingerprint(meals):
+    """その日の食事内容（正規化後）のハッシュ"""
+    raw = json.dumps(normalize_meals(meals), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def feedback_fingerprint(age, gender, self_esteem_level, meals, selected_mission=None):
+    """フィードバック生成の入力（食事・ミッション・プロフィール）のハッシュ。同じなら再生成しても結果の前提は同じ"""
+    raw = json.dumps(
+        {"age": age, "gender": gender, "self_esteem": self_esteem_level,
+         "mission": selected_mission, "meals": meals_fingerprint(meals)},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+_FEEDBACK_TEMPLATE = """あなたは親切で実用的な栄養指導の専門家です。
+以下の情報を踏まえて、5〜8文でフィードバックを作ってください。良い点・改善点・次の行動提案を必ず含めてください。最後は「明日も少しずつ続けていきましょう」で締めてください。
+
+{context}""".format
+
+
+def build_feedback_prompt(age, gender, self_esteem_level, meals, selected_mission=None):
+    """
+    meals: {"朝食": [ {"item": "...", "intake":"普通"}, ... ], ...}
+    """
+    context, saved = _context_text(age, gender, self_esteem_level, normalize_meals(meals), selected_mission)
+    prompt = _FEEDBACK_TEMPLATE(context=context)
+    tokens = prompt_budget.count_tokens(prompt)
+    prompt_budget.STATS.observe("feedback", tokens, tokens + saved)
+    return prompt
+
+
+def generate_feedback(client, prompt, user=None, purpose="feedback", reuse=True):
+    """Low-level wrapper: try OpenAI then fallback text."""
+    if not client:
+        record_no_client(purpose, user)
+        return FEEDBACK_FALLBACK
+    try:
+        return chat_completion_text(
+            client,
+            [
+                {"role": "system", "content": FEEDBACK_SYSTEM},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=400, purpose=purpose, user=user, fallback_on_error=True, reuse=reuse
+        )
+    except ratelimit.QuotaExceeded:
+        return FEEDBACK_QUOTA_TEXT
+    except Exception:
+        return FEEDBACK_FALLBACK
+
+
+# -------------------------
+# 構造化出力（フィードバック＋翌日ミッションを1回で生成）
+# -------------------------
+COMBINED_SYSTEM = "あなたは親切で実用的な栄養指導・健康行動支援の専門家です。必ず JSON オブジェクトのみを出力します。"
+MISSION_MAX_CHARS = 40
+
+
+def structured_output_enabled():
+    # 既定で有効。LLM_STRUCTURED_OUTPUT=0 で従来の2回呼び出しに戻す
+    return os.getenv("LLM_STRUCTURED_OUTPUT", "1") not in ("0", "false", "False", "")
+
+
+_COMBINED_TEMPLATE = """以下の情報を踏まえて、次の2つを作ってください。
+(1) feedback: 今日の食事へのフィードバックを5〜8文で。良い点・改善点・次の行動提案を必ず含め、最後は「明日も少しずつ続けていきましょう」で締める。
+(2) missions: 対象者が明日取り組める簡単な行動ミッションを短く具体的に3つ。各ミッションは3〜7語程度。
+(3) rationale: ミッションを選んだ理由を1文（省略可）。
+
+{context}
+出力は次の形式の JSON オブジェクトのみにしてください。
+{{"feedback": "...", "missions": ["...", "...", "..."], "rationale": "..."}}
+""".format
+
+
+def build_combined_prompt(age, gender, self_esteem_level, meals, selected_mission=None):
+    context, saved = _context_text(age, gender, self_esteem_level, normalize_meals(meals), selected_mission)
+    prompt = _COMBINED_TEMPLATE(context=context)
+    tokens = prompt_budget.count_tokens(prompt)
+    prompt_budget.STATS.observe("combined", tokens, tokens + saved)
+    return prompt
+
+
+def validate_combined(obj):
+    """
+    構造化出力のスキーマ検証。正しければ正規化した dict を返し、不正なら ValueError。
+    schema: {"feedback": str(必須), "missions": [str × 3以上](必須), "rationale": str(任意)}
+    """
+    if not isinstance(obj, dict):
+        raise ValueError("top-level is not an object")
+    feedback = obj.get("feedback")
+    if not isinstance(feedback, str) or not feedback.strip():
+        raise ValueError("feedback must be a non-empty string")
+    missions = obj.get("missions")
+    if not isinstance(missions, list):
+        raise ValueError("missions must be a list")
+    cleaned = [m.strip() for m in missions if isinstance(m, str) and m.strip()]
+    if len(cleaned) < 3:
+        raise ValueError("missions must contain 3 non-empty strings")
+    if any(len(m) > MISSION_MAX_CHARS for m in cleaned[:3]):
+        raise ValueError("mission text too long")
+    out = {"feedback": feedback.strip(), "missions": cleaned[:3]}
+    rationale = obj.get("rationale")
+    if rationale is not None:
+        if not isinstance(rationale, str):
+            raise ValueError("rationale must be a string")
+        if rationale.strip():
+            out["rationale"] = rationale.strip()
+    return out
+
+
+def parse_combined(text):
+    # json_mode でもコードブロックで囲まれることがあるので外側の {...} を取り出す
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("no JSON object in response")
+    return validate_combined(json.loads(text[start:end + 1]))
+
+
+def request_combined(client, age, gender, self_esteem_level, meals, selected_mission=None, user=None, reuse=True,
+                     fallback_on_error=False):
+    """
+    1回の呼び出しでフィードバックと翌日ミッションを得る。失敗・スキーマ不一致は例外。
+    失敗時に呼び出し側が従来の2回呼び出しに切り替えるなら fallback_on_error=True（台帳の fallback に記録する）
+    """
+    prompt = build_combined_prompt(age, gender, self_esteem_level, meals, selected_mission)
+    return chat_completion_text(
+        client,
+        [{"role": "system", "content": COMBINED_SYSTEM}, {"role": "user", "content": prompt}],
+        max_tokens=600, json_mode=True, purpose="combined", user=user, parse=parse_combined, reuse=reuse,
+        fallback_on_error=fallback_on_error
+    )
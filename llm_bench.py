@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 経路のベンチマーク
+- アプリと同じ llm.generate_missions / llm.generate_feedback（try_generate_missions / try_generate_feedback の本体）を
+  指定した同時実行数で呼び、スループットとレイテンシのパーセンタイルを表示する
+- --base-url を省略すると llm_stub のスタブサーバをプロセス内で起動して使う（遅延・エラー率は llm_stub と同じ引数）
+- --stream ではストリーミング応答の最初のトークンまでの時間（TTFT）も測る
+- --target combined で構造化出力（1回呼び出し）の経路を測り、mixed（2回呼び出し）と比べられる
+
+使い方:
+    python llm_bench.py --target mixed --requests 200 --concurrency 16 --latency-dist lognormal --latency-mean 0.6 --latency-jitter 0.5
+    python llm_bench.py --base-url http://127.0.0.1:8000/v1 --target feedback --concurrency 8
+"""
+
+import argparse, json, os, random, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import llm
+import llm_stub
+import prompt_budget
+import ratelimit
+import singleflight
+from llm_ledger import percentile
+
+FOODS = ["ごはん", "パン", "パスタ", "魚", "肉", "鶏肉", "卵", "サラダ", "ヨーグルト", "味噌汁",
+         "プロテイン", "サンドイッチ", "ハンバーグ", "揚げ物", "お菓子", "バナナ", "うどん", "そば"]
+INTAKES = ["少なめ", "普通", "多め"]
+
+
+def synthetic_case(rng):
+    user_info = {
+        "age": rng.randint(18, 70),
+        "gender": rng.choice(["男性", "女性", "その他"]),
+        "self_esteem_level": rng.choice(["高", "低"]),
+    }
+    meals = {}
+    for meal in ["朝食", "昼食", "夕食", "間食"]:
+        meals[meal] = [{"item": rng.choice(FOODS), "intake": rng.choice(INTAKES)} for _ in range(rng.randint(0, 3))]
+    mission = rng.choice(llm.MISSION_FALLBACK + [None])
+    return user_info, meals, mission
+
+
+def run_one(client, target, case, stream):
+    user_info, meals, mission = case
+    t0 = time.perf_counter()
+    ttft = None
+    if stream:
+        prompt = llm.build_feedback_prompt(user_info["age"], user_info["gender"], user_info["self_esteem_level"], meals, mission)
+        chunks = client.chat.completions.create(
+            model=llm.MODEL, stream=True, max_tokens=400, temperature=0.7,
+            messages=[{"role": "system", "content": llm.FEEDBACK_SYSTEM}, {"role": "user", "content": prompt}],
+        )
+        for ch in chunks:
+            if ttft is None and ch.choices and ch.choices[0].delta.content:
+                ttft = time.perf_counter() - t0
+        target = "stream"
+        fallback = False
+    elif target == "missions":
+        out = llm.generate_missions(client, user_info, meals)
+        fallback = out == llm.MISSION_FALLBACK
+    elif target == "combined":
+        try:
+            llm.request_combined(client, user_info["age"], user_info["gender"], user_info["self_esteem_level"], meals, mission,
+                                 fallback_on_error=True)
+            fallback = False
+        except Exception:
+            fallback = True
+    else:
+        prompt = llm.build_feedback_prompt(user_info["age"], user_info["gender"], user_info["self_esteem_level"], meals, mission)
+        out = llm.generate_feedback(client, prompt)
+        fallback = out == llm.FEEDBACK_FALLBACK
+    return target, time.perf_counter() - t0, ttft, fallback
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50": round(percentile(latencies, 50), 4),
+        "p90": round(percentile(latencies, 90), 4),
+        "p95": round(percentile(latencies, 95), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "max": round(max(latencies), 4) if latencies else 0.0,
+    }
+
+
+def run_bench(client, target="mixed", requests=100, concurrency=8, same_prompt=False, stream=False, seed=0):
+    rng = random.Random(seed)
+    fixed = synthetic_case(rng)
+    cases = []
+    for i in range(requests):
+        t = target if target != "mixed" else ("missions" if i % 2 == 0 else "feedback")
+        cases.append((t, fixed if same_prompt else synthetic_case(rng)))
+
+    singleflight.GROUP.reset_stats()
+    prompt_budget.STATS.reset_stats()
+    results = []
+    lock = threading.Lock()
+
+    def task(t, case):
+        r = run_one(client, t, case, stream)
+        with lock:
+            results.append(r)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        for f in [ex.submit(task, t, c) for t, c in cases]:
+            f.result()
+    wall = time.perf_counter() - t0
+
+    report = {
+        "target": target, "requests": requests, "concurrency": concurrency, "stream": stream,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2) if wall > 0 else 0.0,
+        "fallbacks": sum(1 for r in results if r[3]),
+        "latency_s": summarize([r[1] for r in results]),
+        "by_target": {},
+        "singleflight": singleflight.GROUP.stats(),
+        "ratelimit": ratelimit.LIMITER.stats(),
+        "prompt_tokens": prompt_budget.STATS.stats(),
+    }
+    for t in sorted({r[0] for r in results}):
+        report["by_target"][t] = summarize([r[1] for r in results if r[0] == t])
+    if stream:
+        report["ttft_s"] = summarize([r[2] for r in results if r[2] is not None])
+    return report
+
+
+def print_report(rep):
+    print(f"target={rep['target']} requests={rep['requests']} concurrency={rep['concurrency']} stream={rep['stream']}")
+    print(f"  wall {rep['wall_s']}s  throughput {rep['throughput_rps']} req/s  fallbacks {rep['fallbacks']}")
+    rows = [("all", rep["latency_s"])] + list(rep["by_target"].items())
+    if "ttft_s" in rep:
+        rows.append(("ttft", rep["ttft_s"]))
+    print(f"  {'':10} {'n':>6} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, s in rows:
+        print(f"  {name:10} {s['count']:>6} {s['p50']:>8.3f} {s['p90']:>8.3f} {s['p95']:>8.3f} {s['p99']:>8.3f} {s['max']:>8.3f}")
+    sf = rep["singleflight"]
+    print(f"  singleflight: upstream {sf['upstream']} / coalesced {sf['coalesced']} / reused {sf['reused']}")
+    rl = rep["ratelimit"]
+    print(f"  ratelimit: waited {rl['waited']} / timeouts {rl['timeouts']} / 429 penalties {rl['penalties']} / wait total {rl['wait_ms_total']}ms")
+    for purpose, ps in rep["prompt_tokens"].items():
+        print(f"  prompt[{purpose}]: avg {ps['avg_tokens']} tokens (raw {ps['avg_raw_tokens']}, trimmed {ps['trimmed']}/{ps['count']}) max {ps['max_tokens']}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="LLM 経路（ミッション・フィードバック生成）のベンチマーク")
+    ap.add_argument("--target", choices=["missions", "feedback", "mixed", "combined"], default="mixed",
+                    help="combined は構造化出力（フィードバック＋ミッションを1回で）")
+    ap.add_argument("--requests", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--same-prompt", action="store_true", help="全リクエストを同じプロンプトにする（single-flight の効果確認）")
+    ap.add_argument("--stream", action="store_true", help="ストリーミングで呼び TTFT も測る（フィードバック用プロンプト）")
+    ap.add_argument("--max-retries", type=int, default=0, help="クライアントの自動リトライ回数（既定 0：エラーをそのまま数える）")
+    ap.add_argument("--base-url", help="OpenAI 互換 API のベース URL。省略時はスタブをプロセス内で起動")
+    ap.add_argument("--api-key", help="API キー（既定: OPENAI_API_KEY。スタブ使用時は無くてよい）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    ap.add_argument("--ledger", default="", help="LLM 呼び出し台帳の出力先（既定: 記録しない）")
+    ap.add_argument("--rpm", type=int, help="レート制限のリクエスト数/分（既定: アプリと同じ LLM_RPM）。0 で無効")
+    ap.add_argument("--tpm", type=int, help="レート制限のトークン数/分（既定: アプリと同じ LLM_TPM）。0 で無効")
+    llm_stub.add_stub_args(ap)
+    args = ap.parse_args(argv)
+    os.environ["LLM_LEDGER_PATH"] = args.ledger
+
+    if args.rpm is not None or args.tpm is not None:
+        cur = ratelimit.LIMITER
+        ratelimit.LIMITER = ratelimit.RateLimiter(
+            rpm=args.rpm if args.rpm is not None else int(cur.requests.capacity if cur.requests else 0),
+            tpm=args.tpm if args.tpm is not None else int(cur.tokens.capacity if cur.tokens else 0),
+        )
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = llm_stub.start_server(llm_stub.config_from_args(args))
+    # キーは --api-key → OPENAI_API_KEY（アプリと同じ）。ダミーのキーはスタブに向けるときだけ
+    api_key = llm.resolve_api_key(args.api_key) or ("stub" if server else None)
+    client, inited = llm.make_client(api_key, base_url, max_retries=args.max_retries)
+    if not inited:
+        print("OpenAI クライアントを初期化できません", file=sys.stderr)
+        return 2
+    try:
+        rep = run_bench(client, args.target, args.requests, args.concurrency, args.same_prompt, args.stream,
+                        seed=args.seed or 0)
+    finally:
+        if server:
+            server.shutdown()
+    rep["base_url"] = base_url
+    if args.json:
+        print(json.dumps(rep, ensure_ascii=False, indent=2))
+    else:
+        print_report(rep)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
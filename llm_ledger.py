@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 呼び出し台帳（追記のみの JSON Lines）
+- 1回の呼び出しごとに 日時・用途・モデル・トークン数・レイテンシ・キャッシュヒット・結果・フォールバック有無 を記録
+- 保存先は環境変数 LLM_LEDGER_PATH（既定: llm_ledger.jsonl）。LLM_LEDGER_PATH を空にすると記録しない
+- 集計コマンドで 日別 / 利用者別 / 用途別 の p50・p95 レイテンシ、エラー率、トークン消費と概算コストを表示する
+
+使い方:
+    python llm_ledger.py report --by day
+    python llm_ledger.py report --by user --since 2026-10-01
+    python llm_ledger.py tail -n 20
+"""
+
+import argparse, datetime, hashlib, json, os, sys, threading, uuid
+
+DEFAULT_PATH = "llm_ledger.jsonl"
+# USD / 100万トークン（入力, 出力）。表にないモデルはコスト 0 として扱う
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+_lock = threading.Lock()
+
+
+def ledger_path():
+    return os.getenv("LLM_LEDGER_PATH", DEFAULT_PATH)
+
+
+def new_user_id():
+    """利用者登録時に user_data に保存する乱数の id"""
+    return uuid.uuid4().hex[:12]
+
+
+def user_key(user_info, user_dir=None):
+    """
+    台帳・利用者ごとの1日上限に使う利用者キー。user_data の user_id（乱数）を使う。
+    user_id の無い古いデータは、利用者ごとの保存ディレクトリ（user_dir）のハッシュ。どちらも無ければ None
+    （生年月日・性別・地域からは作らない：同じ属性の別の利用者が同じキーになるため）
+    """
+    if user_info and user_info.get("user_id"):
+        return str(user_info["user_id"])
+    if user_dir:
+        return "dir-" + hashlib.sha1(os.path.abspath(user_dir).encode("utf-8")).hexdigest()[:10]
+    return None
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    p_in, p_out = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * p_in + completion_tokens * p_out) / 1_000_000
+
+
+def record(purpose, model, latency_s, outcome="ok", prompt_tokens=0, completion_tokens=0,
+           cache_hit=False, fallback=False, user=None, error=None):
+    """1件追記する。台帳の書き込み失敗でアプリを止めないよう例外は握りつぶす"""
+    path = ledger_path()
+    if not path:
+        return None
+    entry = {
+        "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "purpose": purpose,
+        "model": model,
+        "user": user,
+        "prompt_tokens": int(prompt_tokens or 0),
+        "completion_tokens": int(completion_tokens or 0),
+        "latency_ms": round(latency_s * 1000, 1),
+        "cache_hit": bool(cache_hit),
+        "outcome": outcome,
+        "fallback": bool(fallback),
+    }
+    if error:
+        entry["error"] = str(error)[:200]
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    try:
+        with _lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+    except Exception:
+        pass
+    return entry
+
+
+def read_entries(path=None, since=None):
+    path = path or ledger_path()
+    if not path or not os.path.exists(path):
+        return []
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            ln = ln.strip()
+            if not ln:
+                continue
+            try:
+                e = json.loads(ln)
+            except Exception:
+                # 書き込み途中で切れた行は飛ばす
+                continue
+            if since and e.get("ts", "") < since:
+                continue
+            out.append(e)
+    return out
+
+
+# -------------------------
+# 集計
+# -------------------------
+def percentile(values, p):
+    """線形補間のパーセンタイル（p は 0〜100）"""
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = (len(xs) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def _group_key(e, by):
+    if by == "day":
+        return e.get("ts", "")[:10]
+    if by == "user":
+        return e.get("user") or "-"
+    if by == "purpose":
+        return e.get("purpose") or "-"
+    return "all"
+
+
+def summarize(entries, by="day"):
+    groups = {}
+    for e in entries:
+        groups.setdefault(_group_key(e, by), []).append(e)
+    rows = []
+    for key in sorted(groups):
+        es = groups[key]
+        # キャッシュヒット・未呼び出しは上流レイテンシに含めない
+        upstream = [e for e in es if not e.get("cache_hit") and e.get("outcome") != "no_client"]
+        lat = [e["latency_ms"] for e in upstream]
+        errors = sum(1 for e in upstream if e.get("outcome") != "ok")
+        pt = sum(e.get("prompt_tokens", 0) for e in es)
+        ct = sum(e.get("completion_tokens", 0) for e in es)
+        cost = sum(estimate_cost(e.get("model"), e.get("prompt_tokens", 0), e.get("completion_tokens", 0)) for e in es)
+        rows.append({
+            "key": key,
+            "calls": len(es),
+            "upstream": len(upstream),
+            "cache_hits": sum(1 for e in es if e.get("cache_hit")),
+            "fallbacks": sum(1 for e in es if e.get("fallback")),
+            "error_rate": round(errors / len(upstream), 3) if upstream else 0.0,
+            "p50_ms": round(percentile(lat, 50), 1),
+            "p95_ms": round(percentile(lat, 95), 1),
+            "prompt_tokens": pt,
+            "completion_tokens": ct,
+            "cost_usd": round(cost, 5),
+        })
+    return rows
+
+
+def print_rows(rows, by):
+    print(f"{by:12} {'calls':>6} {'upstrm':>6} {'hit':>5} {'fallbk':>6} {'err%':>6} {'p50ms':>8} {'p95ms':>8} {'in_tok':>8} {'out_tok':>8} {'usd':>9}")
+    for r in rows:
+        print(f"{r['key'][:12]:12} {r['calls']:>6} {r['upstream']:>6} {r['cache_hits']:>5} {r['fallbacks']:>6} "
+              f"{r['error_rate'] * 100:>6.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['prompt_tokens']:>8} {r['completion_tokens']:>8} {r['cost_usd']:>9.5f}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="LLM 呼び出し台帳の集計")
+    ap.add_argument("--path", help=f"台帳ファイル（既定: LLM_LEDGER_PATH または {DEFAULT_PATH}）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("report", help="日別 / 利用者別 / 用途別に集計")
+    rp.add_argument("--by", choices=["day", "user", "purpose", "all"], default="day")
+    rp.add_argument("--since", help="この日時以降（YYYY-MM-DD など ISO 形式の前方一致比較）")
+    rp.add_argument("--json", action="store_true")
+    tp = sub.add_parser("tail", help="直近の記録を表示")
+    tp.add_argument("-n", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "tail":
+        for e in read_entries(args.path)[-args.n:]:
+            print(json.dumps(e, ensure_ascii=False))
+        return 0
+
+    rows = summarize(read_entries(args.path, since=args.since), by=args.by)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    elif not rows:
+        print("記録がありません。")
+    else:
+        print_rows(rows, args.by)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+OpenAI 互換のローカルスタブサーバ（負荷試験・動作確認用）
+- POST /v1/chat/completions（stream=true なら SSE で少しずつ返す）と GET /v1/models を実装
+- 応答遅延の分布（fixed / uniform / normal / lognormal）、エラー率、ストリーミングの間隔を指定できる
+- ミッション用プロンプトには「1. ○○」形式の3行、response_format=json_object なら構造化出力の JSON、
+  それ以外にはフィードバック文を返す
+- アプリ側は OPENAI_BASE_URL（または secrets の OPENAI_BASE_URL）を http://127.0.0.1:<port>/v1 にすると使える
+
+使い方:
+    python llm_stub.py --port 8000 --latency-dist lognormal --latency-mean 0.8 --latency-jitter 0.4 --error-rate 0.05
+"""
+
+import argparse, json, random, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MISSION_POOL = [
+    "野菜をもう一品追加する", "夜に間食を控える", "15分間速歩する", "水を1杯多く飲む",
+    "朝食にたんぱく質をとる", "汁物の量を半分にする", "階段を使う", "寝る前にストレッチする",
+]
+FEEDBACK_POOL = [
+    "主食と主菜がそろっていて良いバランスです。",
+    "たんぱく質がやや少なめなので、卵や魚を一品加えると良いでしょう。",
+    "間食は量を決めて楽しむと続けやすくなります。",
+    "野菜を意識して取り入れられている点が素晴らしいです。",
+    "汁物や加工食品が多い日は塩分に気をつけましょう。",
+    "今日のミッションに取り組めたことは大きな一歩です。",
+]
+
+
+class StubConfig:
+    def __init__(self, latency_dist="fixed", latency_mean=0.0, latency_jitter=0.0,
+                 error_rate=0.0, error_status=429, stream_chunk_delay=0.02, seed=None):
+        self.latency_dist = latency_dist
+        self.latency_mean = latency_mean
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_chunk_delay = stream_chunk_delay
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "streams": 0}
+
+    def sample_latency(self):
+        mean, jitter = self.latency_mean, self.latency_jitter
+        with self.lock:
+            if self.latency_dist == "uniform":
+                v = self.rng.uniform(mean - jitter, mean + jitter)
+            elif self.latency_dist == "normal":
+                v = self.rng.gauss(mean, jitter)
+            elif self.latency_dist == "lognormal":
+                # mean を中央値、jitter を対数の標準偏差として扱う
+                v = mean * self.rng.lognormvariate(0.0, jitter) if mean > 0 else 0.0
+            else:
+                v = mean
+        return max(0.0, v)
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    def choose(self, pool, k):
+        with self.lock:
+            return self.rng.sample(pool, k)
+
+
+def estimate_tokens(text):
+    # 日本語はおおよそ1文字1トークン、英数字は4文字1トークン程度
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def fake_reply(cfg, messages, json_mode=False):
+    user_text = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+    if '"difficulty"' in user_text:
+        # ミッション集の補充（mission_recommender refill）
+        picks = cfg.choose(MISSION_POOL, 5)
+        return json.dumps({"missions": [{"text": m, "difficulty": 1 + i % 3} for i, m in enumerate(picks)]},
+                          ensure_ascii=False)
+    if json_mode or '"missions"' in user_text:
+        obj = {
+            "feedback": "".join(cfg.choose(FEEDBACK_POOL, 4)) + "明日も少しずつ続けていきましょう。",
+            "missions": cfg.choose(MISSION_POOL, 3),
+            "rationale": "今日の栄養傾向から、無理なく続けられる行動を選びました。",
+        }
+        return json.dumps(obj, ensure_ascii=False)
+    if "行動ミッション" in user_text:
+        picks = cfg.choose(MISSION_POOL, 3)
+        return "\n".join(f"{i}. {m}" for i, m in enumerate(picks, start=1))
+    picks = cfg.choose(FEEDBACK_POOL, 4)
+    return "".join(picks) + "明日も少しずつ続けていきましょう。"
+
+
+def make_handler(cfg):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, obj, headers=None):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "stub"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                req = json.loads(self.rfile.read(length) or b"{}")
+            except Exception:
+                self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                return
+
+            with cfg.lock:
+                cfg.counters["requests"] += 1
+            time.sleep(cfg.sample_latency())
+            if cfg.should_fail():
+                with cfg.lock:
+                    cfg.counters["errors"] += 1
+                self._send_json(cfg.error_status, {"error": {"message": "stub injected error", "type": "stub_error"}},
+                                headers={"Retry-After": "1"} if cfg.error_status == 429 else None)
+                return
+
+            messages = req.get("messages") or []
+            model = req.get("model", "gpt-4o-mini")
+            json_mode = (req.get("response_format") or {}).get("type") == "json_object"
+            text = fake_reply(cfg, messages, json_mode)
+            prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+            completion_tokens = estimate_tokens(text)
+            cid = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+            created = int(time.time())
+
+            if req.get("stream"):
+                with cfg.lock:
+                    cfg.counters["streams"] += 1
+                self._stream(cid, created, model, text)
+                return
+
+            self._send_json(200, {
+                "id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        def _stream(self, cid, created, model, text):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def emit(delta, finish=None):
+                chunk = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            emit({"role": "assistant", "content": ""})
+            for i in range(0, len(text), 8):
+                emit({"content": text[i:i + 8]})
+                time.sleep(cfg.stream_chunk_delay)
+            emit({}, finish="stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_server(cfg, host="127.0.0.1", port=0):
+    """バックグラウンドスレッドで起動して (server, base_url) を返す。port=0 なら空きポート"""
+    server = ThreadingHTTPServer((host, port), make_handler(cfg))
+    server.daemon_threads = True
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_stub_args(ap):
+    ap.add_argument("--latency-dist", choices=["fixed", "uniform", "normal", "lognormal"], default="fixed")
+    ap.add_argument("--latency-mean", type=float, default=0.5, help="平均（lognormal は中央値）遅延 秒")
+    ap.add_argument("--latency-jitter", type=float, default=0.0, help="ばらつき（uniform は幅、normal は標準偏差、lognormal は σ）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="エラー応答の割合 0〜1")
+    ap.add_argument("--error-status", type=int, default=429)
+    ap.add_argument("--stream-chunk-delay", type=float, default=0.02, help="ストリーミング時のチャンク間隔 秒")
+    ap.add_argument("--seed", type=int)
+
+
+def config_from_args(args):
+    return StubConfig(args.latency_dist, args.latency_mean, args.latency_jitter,
+                      args.error_rate, args.error_status, args.stream_chunk_delay, args.seed)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="OpenAI 互換のローカルスタブサーバ")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    add_stub_args(ap)
+    args = ap.parse_args(argv)
+    cfg = config_from_args(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(cfg))
+    server.daemon_threads = True
+    print(f"stub listening on http://{args.host}:{args.port}/v1 （OPENAI_BASE_URL に設定してください）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"stub counters: {cfg.counters}")
+
+
+if __name__ == "__main__":
+    main()
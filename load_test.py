@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+同時セッションの負荷試験（ヘッドレス）
+- file.py のセッションを N 個同時に動かし、各セッションに
+  登録 → 自尊感情の診断 → ミッション選択 → 食事入力 → フィードバック生成 を AppTest で操作させる
+- AppTest は実行のたびにプロセス全体の Streamlit Runtime を差し替えるので、1プロセスの中では同時に動かせない。
+  そのためセッションごとに子プロセスを立て、同じマシンの CPU・同じデータファイル・同じスタブを取り合わせる
+- LLM は llm_stub のスタブサーバ（プロセス内で起動。遅延・エラー率は llm_stub と同じ引数）に向ける
+- --sessions 1,4,8,16 のように N を増やしながら、段ごとに次を表示する
+    スループット（完了した流れ / 秒・スクリプト実行 / 秒）、手順ごとのレイテンシ p50 / p95、
+    メモリの増え方（RSS）、ファイルの取り合いによるエラー、その他のエラー
+- アプリはカレントディレクトリの user_data.json / app_data.json を使うので、同じ段のセッションは同じファイルを
+  読み書きする（本番の1サーバと同じ）。段ごとに空の一時ディレクトリから始める
+- メモリは子プロセスごとの RSS（流れの前後）を合計して見る
+
+使い方:
+    python load_test.py --sessions 1,4,8 --latency-mean 0.3
+    python load_test.py --sessions 16 --rounds 3 --json
+
+終了コード: どの段でも例外が1つも無ければ 0、あれば 1（同じファイルの同時保存で起きた例外も許容しない）
+"""
+
+import argparse, collections, json, multiprocessing, os, resource, sys, tempfile, time
+
+import llm_stub
+from llm_ledger import percentile
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "file.py")
+# open は子プロセスでの最初の表示（app_bootstrap の初期化を含む）
+STEPS = ["open", "register", "self_esteem", "mission", "meal_add", "to_feedback", "feedback"]
+# 例外のうち、同じファイルを同時に読み書きしたことで起きるもの（例外名・メッセージの一部）
+CONTENTION_ERRORS = ("FileNotFoundError", "JSONDecodeError", "PermissionError",
+                     "No such file or directory", "Expecting value", "Permission denied")
+
+
+def rss_kib():
+    """いまの RSS（KiB）。/proc が無い環境では最大 RSS で代用する"""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class StepError(Exception):
+    def __init__(self, step, message, contention):
+        super().__init__(f"{step}: {message}")
+        self.step = step
+        self.contention = contention
+
+
+class Session:
+    """1人分の操作。手順ごとの所要時間を記録する"""
+
+    def __init__(self, idx, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.idx = idx
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.times = collections.defaultdict(list)
+        self.runs = 0
+
+    def _step(self, name, action):
+        t0 = time.perf_counter()
+        action()
+        self.times[name].append(time.perf_counter() - t0)
+        self.runs += 1
+        if self.at.exception:
+            exc = self.at.exception[0]
+            msg = exc.message or ""
+            kind = " ".join(getattr(exc, "stack_trace", None) or []) + msg
+            raise StepError(name, msg.splitlines()[0] if msg else "exception",
+                            any(e in kind for e in CONTENTION_ERRORS))
+
+    def _button(self, label):
+        for b in self.at.button:
+            if b.label == label:
+                return b
+        raise StepError(self.page(), f"ボタン「{label}」がありません", False)
+
+    def page(self):
+        return self.at.session_state["model"].nav.page
+
+    def run_flow(self):
+        at = self.at
+        self._step("open", at.run)
+        # 先に別のセッションが登録していれば、登録画面は出ない
+        if self.page() == "init_register":
+            self._step("register", lambda: self._button("登録して次へ").click().run())
+        self._step("self_esteem", lambda: self._button("診断する").click().run())
+        self._step("mission", lambda: self._button("選択して次へ").click().run())
+        if self.page() != "meal":
+            raise StepError("mission", f"食事画面に進めません（{self.page()}）", False)
+        key = next(t.key for t in at.text_input if t.key and t.key.startswith("add_朝食"))
+        at.text_input(key=key).input(f"ごはん{self.idx}")
+        btn = next(b for b in at.button if b.key and b.key.startswith("btn_add_朝食"))
+        self._step("meal_add", lambda: btn.click().run())
+        self._step("to_feedback", lambda: self._button("📝 フィードバック").click().run())
+        self._step("feedback", lambda: self._button("フィードバック生成").click().run())
+
+
+def _worker(idx, rounds, data_dir, timeout, env, barrier, queue):
+    """子プロセス：1セッション分の流れを rounds 回。結果は queue に入れる"""
+    os.environ.update(env)
+    os.chdir(data_dir)
+    from streamlit.testing.v1 import AppTest  # noqa: F401  読み込み時間を計測に入れない
+    out = {"times": collections.defaultdict(list), "runs": 0, "completed": 0,
+           "errors": collections.Counter(), "contention": collections.Counter()}
+    rss0 = rss_kib()
+    barrier.wait()
+    t0 = time.time()
+    for r in range(rounds):
+        s = Session(idx * rounds + r, timeout)
+        try:
+            s.run_flow()
+            out["completed"] += 1
+        except StepError as e:
+            (out["contention"] if e.contention else out["errors"])[str(e)] += 1
+        except Exception as e:
+            out["errors"][f"{type(e).__name__}: {e}"] += 1
+        for name, xs in s.times.items():
+            out["times"][name].extend(xs)
+        out["runs"] += s.runs
+    queue.put({**out, "times": dict(out["times"]), "t0": t0, "t1": time.time(), "rss0": rss0, "rss1": rss_kib()})
+
+
+def run_level(n, rounds, timeout, data_dir, env):
+    """n セッション（子プロセス）を同時に、それぞれ rounds 回流す"""
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(n)
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(i, rounds, data_dir, timeout, env, barrier, queue)) for i in range(n)]
+    for p in procs:
+        p.start()
+    parts = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    steps = collections.defaultdict(list)
+    errors, contention = collections.Counter(), collections.Counter()
+    for part in parts:
+        for name, xs in part["times"].items():
+            steps[name].extend(xs)
+        errors.update(part["errors"])
+        contention.update(part["contention"])
+    completed = sum(p["completed"] for p in parts)
+    runs = sum(p["runs"] for p in parts)
+    elapsed = max(p["t1"] for p in parts) - min(p["t0"] for p in parts)
+    rss0 = sum(p["rss0"] for p in parts)
+    rss1 = sum(p["rss1"] for p in parts)
+    return {
+        "sessions": n,
+        "flows": n * rounds,
+        "completed": completed,
+        "elapsed_s": round(elapsed, 2),
+        "flows_per_s": round(completed / elapsed, 2) if elapsed else 0.0,
+        "runs_per_s": round(runs / elapsed, 2) if elapsed else 0.0,
+        "steps": {name: {"n": len(steps[name]),
+                         "p50_ms": round(percentile(steps[name], 50) * 1000, 1),
+                         "p95_ms": round(percentile(steps[name], 95) * 1000, 1)}
+                  for name in STEPS if steps.get(name)},
+        # 子プロセスの RSS の合計（流れの前後）と1セッションあたりの増え方
+        "rss_kib": {"before": rss0, "after": rss1, "growth": rss1 - rss0,
+                    "growth_per_session": round((rss1 - rss0) / n)},
+        "contention_errors": dict(contention),
+        "errors": dict(errors),
+    }
+
+
+def print_level(r):
+    print(f"\n== {r['sessions']} セッション同時（{r['flows']} 回中 {r['completed']} 回完了、{r['elapsed_s']}s）")
+    print(f"スループット {r['flows_per_s']} 流れ/s  {r['runs_per_s']} 実行/s  "
+          f"RSS 合計 {r['rss_kib']['before'] / 1024:.0f} → {r['rss_kib']['after'] / 1024:.0f} MiB"
+          f"（1セッションあたり +{r['rss_kib']['growth_per_session'] / 1024:.1f} MiB）")
+    for name, s in r["steps"].items():
+        print(f"  {name:12} n={s['n']:<4} p50 {s['p50_ms']:>8.1f}ms  p95 {s['p95_ms']:>8.1f}ms")
+    for label, errs in (("ファイル競合（保存・読み込みの失敗）", r["contention_errors"]), ("エラー", r["errors"])):
+        for msg, c in errs.items():
+            print(f"  {label} ×{c}: {msg}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="file.py を N セッション同時に動かす負荷試験")
+    ap.add_argument("--sessions", default="1,4,8", help="同時セッション数（カンマ区切りで段階的に。既定: 1,4,8）")
+    ap.add_argument("--rounds", type=int, default=1, help="各セッションが流れを繰り返す回数（既定: 1）")
+    ap.add_argument("--timeout", type=float, default=120, help="1回の実行の待ち時間の上限 秒")
+    ap.add_argument("--base-url", help="OpenAI 互換 API のベース URL。省略時はスタブをプロセス内で起動")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    llm_stub.add_stub_args(ap)
+    args = ap.parse_args(argv)
+    levels = [int(x) for x in args.sessions.split(",") if x.strip()]
+
+    base_url = args.base_url
+    server = None
+    if not base_url:
+        server, base_url = llm_stub.start_server(llm_stub.config_from_args(args))
+    # 子プロセスの app_bootstrap が最初の実行で読む設定。台帳・計測ファイルは書かない
+    env = {"OPENAI_BASE_URL": base_url, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "stub"),
+           "LLM_LEDGER_PATH": "", "TRACE_PATH": ""}
+
+    results = []
+    try:
+        for n in levels:
+            with tempfile.TemporaryDirectory() as d:
+                results.append(run_level(n, args.rounds, args.timeout, d, env))
+            if not args.json:
+                print_level(results[-1])
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    failed = sum(sum(r["contention_errors"].values()) + sum(r["errors"].values()) for r in results)
+    if args.json:
+        print(json.dumps({"stub": base_url if server is None else "in-process", "levels": results,
+                          "failed": failed}, ensure_ascii=False, indent=2))
+    elif failed:
+        print(f"\n失敗: 例外 {failed} 件", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+食事記録のコンパクトな持ち方（品目名の番号化・1日分を1つの配列に）
+- app_data の meal_data は1品ごとに {"item": "ごはん", "intake": "普通"} の dict を持つので、同じ文字列・
+  同じ形の dict が日数 × 品目数だけメモリに並ぶ。ここでは
+    品目名   → プロセス共通の番号表（FOODS）の番号
+    量       → 少なめ 0 / 普通 1 / 多め 2（それ以外の値は続きの番号）
+  にして、1品を 32bit（品目番号 << 8 | 区分 << 6 | 量）で表し、1日分を array("I") 1つに詰める（PackedDay）
+- PackedDay は読み取り用の Mapping で、day["朝食"] を引いたときにその区分の [{"item", "intake"}, ...] を作って返す
+  （画面・calc_nutrition などの既存の読み方はそのまま使える）。copy.deepcopy すると普通の dict に戻る
+- app_store の共有の内容（読み取り専用）の meal_data をこの形で持つ。書き換えるときは CowSection がその日を
+  dict にコピーするので、画面側は dict のまま扱う
+- 詰められない日（区分の並びが違う・余分なキーがある・{"item", "intake"} 以外の品目）はそのまま dict で持つ
+- 保存形式（app_data.json）は変えない。別に、番号表と日ごとの配列（base64）で書くコンパクトな JSON
+  （to_compact / from_compact）を用意して、大きさを比べられるようにしている
+
+使い方（合成データでメモリ・保存サイズ・変換時間を比べる）:
+    python meal_pack.py measure --years 5
+    python meal_pack.py measure --years 10 --items-per-slot 4 --json
+"""
+
+import argparse, array, base64, json, random, sys, threading, time
+from collections.abc import Mapping
+
+SLOTS = ("朝食", "昼食", "夕食", "間食")
+INTAKES = ("少なめ", "普通", "多め")
+_ITEM_KEYS = frozenset(("item", "intake"))
+_MAX_INTAKES = 64
+_MAX_FOODS = 1 << 24
+
+
+class InternTable:
+    """文字列 ↔ 番号。追加するだけで、一度付けた番号は変わらない"""
+
+    def __init__(self, initial=()):
+        self._lock = threading.Lock()
+        self.names = []
+        self.ids = {}
+        for name in initial:
+            self.id(name)
+
+    def id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            with self._lock:
+                i = self.ids.get(name)
+                if i is None:
+                    i = len(self.names)
+                    self.names.append(name)
+                    self.ids[name] = i
+        return i
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _initial_foods():
+    try:
+        from nutrition import NUTRITION_DB
+    except ImportError:
+        return ()
+    return tuple(NUTRITION_DB)
+
+
+# プロセス共通の番号表
+FOODS = InternTable(_initial_foods())
+INTAKE_CODES = InternTable(INTAKES)
+
+
+def _encode_item(it, slot):
+    """1品を番号にする。詰められない品目は None"""
+    if type(it) is not dict or it.keys() != _ITEM_KEYS:
+        return None
+    name, intake = it["item"], it["intake"]
+    if not (name is None or isinstance(name, str)) or not isinstance(intake, str):
+        return None
+    food = FOODS.id(name)
+    code = INTAKE_CODES.id(intake)
+    if food >= _MAX_FOODS or code >= _MAX_INTAKES:
+        return None
+    return food << 8 | slot << 6 | code
+
+
+class PackedDay(Mapping):
+    """1日分の食事（読み取り専用）。区分ごとの品目のリストは引いたときに作る"""
+    __slots__ = ("_codes", "_n")
+
+    def __init__(self, codes, n_slots=len(SLOTS)):
+        self._codes = codes
+        self._n = n_slots
+
+    @classmethod
+    def pack(cls, meals):
+        """{"朝食": [...], ...} を詰める。詰められない日は None"""
+        if type(meals) is not dict or tuple(meals) != SLOTS[:len(meals)]:
+            return None
+        codes = array.array("I")
+        for slot, items in enumerate(meals.values()):
+            if type(items) is not list:
+                return None
+            for it in items:
+                c = _encode_item(it, slot)
+                if c is None:
+                    return None
+                codes.append(c)
+        return cls(codes, len(meals))
+
+    def _items(self, slot):
+        foods, intakes = FOODS.names, INTAKE_CODES.names
+        return [{"item": foods[c >> 8], "intake": intakes[c & 0x3F]}
+                for c in self._codes if (c >> 6) & 3 == slot]
+
+    def __getitem__(self, key):
+        try:
+            slot = SLOTS.index(key)
+        except ValueError:
+            raise KeyError(key) from None
+        if slot >= self._n:
+            raise KeyError(key)
+        return self._items(slot)
+
+    def __iter__(self):
+        return iter(SLOTS[:self._n])
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, key):
+        return key in SLOTS[:self._n]
+
+    def __eq__(self, other):
+        if isinstance(other, PackedDay):
+            return self._n == other._n and self._codes == other._codes
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def count(self):
+        """品目数（リストを作らずに数える）"""
+        return len(self._codes)
+
+    def to_dict(self):
+        return {slot: self._items(i) for i, slot in enumerate(SLOTS[:self._n])}
+
+    def __deepcopy__(self, memo):
+        # 書き換える側（CowSection の自分用コピー）には普通の dict を渡す
+        return self.to_dict()
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self._codes.__sizeof__()
+
+    def __repr__(self):
+        return f"PackedDay({self.to_dict()!r})"
+
+
+def pack_meal_data(meal_data):
+    """meal_data（正規化済み）の各日を詰めた新しい dict。詰められない日は元の dict のまま"""
+    out = {}
+    for day, meals in meal_data.items():
+        packed = PackedDay.pack(meals)
+        out[day] = meals if packed is None else packed
+    return out
+
+
+def plain(meals):
+    """保存・書き換え用の dict（PackedDay でなければそのまま）"""
+    return meals.to_dict() if isinstance(meals, PackedDay) else meals
+
+
+# -------------------------
+# コンパクトな JSON
+# -------------------------
+def to_compact(meal_data):
+    """{"foods": [...], "intakes": [...], "slots": n, "days": {日: base64}}。番号はこのデータの中だけの番号に付け直す"""
+    local, names = {}, []
+    days, loose = {}, {}
+    for day, meals in meal_data.items():
+        packed = meals if isinstance(meals, PackedDay) else PackedDay.pack(meals)
+        if packed is None or packed._n != len(SLOTS):
+            loose[day] = plain(meals)
+            continue
+        codes = array.array("I")
+        for c in packed._codes:
+            f = c >> 8
+            i = local.get(f)
+            if i is None:
+                i = local[f] = len(names)
+                names.append(FOODS.names[f])
+            codes.append(i << 8 | c & 0xFF)
+        if sys.byteorder != "little":
+            codes.byteswap()
+        days[day] = base64.b64encode(codes.tobytes()).decode("ascii")
+    out = {"foods": names, "intakes": list(INTAKE_CODES.names), "days": days}
+    if loose:
+        out["loose"] = loose
+    return out
+
+
+def from_compact(obj):
+    """to_compact の逆。各日は PackedDay（loose の日は dict）"""
+    food_ids = [FOODS.id(n) for n in obj["foods"]]
+    intake_ids = [INTAKE_CODES.id(n) for n in obj["intakes"]]
+    out = {}
+    for day, b64 in obj["days"].items():
+        raw = array.array("I", base64.b64decode(b64))
+        if sys.byteorder != "little":
+            raw.byteswap()
+        out[day] = PackedDay(array.array("I", (food_ids[c >> 8] << 8 | c & 0xC0 | intake_ids[c & 0x3F] for c in raw)))
+    out.update(obj.get("loose", {}))
+    return dict(sorted(out.items()))
+
+
+# -------------------------
+# 計測
+# -------------------------
+def measure(years=5, items_per_slot=3, seed=0):
+    """合成データ（app_bench.synth_app）の meal_data で、dict のまま と 詰めた形 を比べる"""
+    import app_bench, storage
+    from session_model import deep_sizeof
+
+    md = app_bench.synth_app(random.Random(seed), years=years, items_per_slot=items_per_slot)["meal_data"]
+    # 読み込んだ直後と同じ状態（文字列が品目ごとに別のオブジェクト）にしてから正規化する
+    md = storage.normalize_meal_data(json.loads(json.dumps(md, ensure_ascii=False)))
+    t0 = time.perf_counter()
+    packed = pack_meal_data(md)
+    pack_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    restored = {d: plain(v) for d, v in packed.items()}
+    unpack_s = time.perf_counter() - t0
+    if restored != md:
+        raise AssertionError("詰めて戻した内容が元と一致しません")
+    compact = to_compact(packed)
+    if {d: plain(v) for d, v in from_compact(compact).items()} != md:
+        raise AssertionError("コンパクトな JSON から戻した内容が元と一致しません")
+
+    # 番号表の分も詰めた形の側に足す
+    table_bytes = deep_sizeof(FOODS.names) + deep_sizeof(FOODS.ids) + deep_sizeof(INTAKE_CODES.names)
+    dict_bytes = deep_sizeof(md)
+    packed_bytes = deep_sizeof(packed) + table_bytes
+    json_bytes = len(json.dumps(md, ensure_ascii=False, indent=2).encode("utf-8"))
+    json_min_bytes = len(json.dumps(md, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    compact_bytes = len(json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return {
+        "days": len(md),
+        "items": sum(v.count() if isinstance(v, PackedDay) else 0 for v in packed.values()),
+        "packed_days": sum(isinstance(v, PackedDay) for v in packed.values()),
+        "memory_bytes": {"dict": dict_bytes, "packed": packed_bytes,
+                         "ratio": round(packed_bytes / dict_bytes, 3) if dict_bytes else None},
+        "json_bytes": {"app_data_json": json_bytes, "minified": json_min_bytes, "compact": compact_bytes,
+                       "ratio": round(compact_bytes / json_bytes, 3) if json_bytes else None},
+        "pack_ms": round(pack_s * 1000, 2),
+        "unpack_ms": round(unpack_s * 1000, 2),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="食事記録の詰めた形のメモリ・保存サイズの比較")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    mp = sub.add_parser("measure", help="合成データで dict のままと詰めた形を比べる")
+    mp.add_argument("--years", type=float, default=5)
+    mp.add_argument("--items-per-slot", type=int, default=3, help="1区分あたりの最大品目数（既定: 3）")
+    mp.add_argument("--seed", type=int, default=0)
+    mp.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = ap.parse_args(argv)
+
+    r = measure(args.years, args.items_per_slot, args.seed)
+    if args.json:
+        print(json.dumps(r, ensure_ascii=False, indent=2))
+        return 0
+    mem, js = r["memory_bytes"], r["json_bytes"]
+    print(f"{r['days']} 日・{r['items']} 品（詰めた日 {r['packed_days']}）")
+    print(f"メモリ      dict {mem['dict'] / 1024:>9.0f} KiB → 詰めた形 {mem['packed'] / 1024:>9.0f} KiB（×{mem['ratio']}）")
+    print(f"保存サイズ  app_data.json 形式 {js['app_data_json'] / 1024:.0f} KiB（改行なし {js['minified'] / 1024:.0f} KiB）"
+          f" → コンパクト {js['compact'] / 1024:.0f} KiB（×{js['ratio']}）")
+    print(f"変換        詰める {r['pack_ms']}ms / dict に戻す {r['unpack_ms']}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+ローカルのルールベース ミッション推薦（LLM 呼び出しなしで毎日のミッションを決める）
+- 栄養傾向（calc_nutrition の tendencies）ごとに索引したミッション集から候補を取り出す
+- 自尊感情レベルと過去の達成率（missions[*]["status"]）から難易度を合わせ、直近に選んだものは避ける
+- 候補は索引済みの数十件だけを採点するので1回 100 マイクロ秒程度で終わる
+- ミッション集は組み込み分 + mission_library.json（LLM で定期的に補充・多様化する分）
+
+使い方:
+    python mission_recommender.py show [DIR]              # 保存済み利用者への今日の推薦を表示
+    python mission_recommender.py stats                   # ミッション集の件数（タグ別）
+    python mission_recommender.py refill --per-tag 5      # LLM でミッション集を補充（cron 等で定期実行）
+"""
+
+import argparse, datetime, json, os, sys, zlib
+
+import storage
+from nutrition import calc_nutrition, recent_meals
+
+LIBRARY_PATH = os.getenv("MISSION_LIBRARY_PATH", "mission_library.json")
+
+# 栄養傾向 → タグ
+TENDENCY_TAGS = {
+    "タンパク質不足傾向": "protein_low",
+    "脂質多めの傾向": "fat_high",
+    "炭水化物多めの傾向": "carb_high",
+    "塩分多めの傾向": "salt_high",
+}
+TAG_LABELS = {
+    "protein_low": "タンパク質が不足しがち",
+    "fat_high": "脂質が多め",
+    "carb_high": "炭水化物が多め",
+    "salt_high": "塩分が多め",
+    "general": "食生活全般",
+    "activity": "運動・生活習慣",
+}
+
+# (tag, 難易度 1=かんたん 2=ふつう 3=がんばる, ミッション)
+BUILTIN_MISSIONS = [
+    ("protein_low", 1, "朝食に卵を1つ足す"),
+    ("protein_low", 1, "間食をヨーグルトにする"),
+    ("protein_low", 2, "昼食に肉か魚を入れる"),
+    ("protein_low", 2, "夕食に豆腐を一品足す"),
+    ("protein_low", 3, "3食すべてに主菜をとる"),
+    ("fat_high", 1, "揚げ物を1品減らす"),
+    ("fat_high", 1, "ドレッシングを半分にする"),
+    ("fat_high", 2, "夕食を焼き魚にする"),
+    ("fat_high", 2, "お菓子を1回やめる"),
+    ("fat_high", 3, "一日揚げ物なしで過ごす"),
+    ("carb_high", 1, "ごはんを少なめにする"),
+    ("carb_high", 1, "甘い飲み物を水にする"),
+    ("carb_high", 2, "麺類の日は野菜を足す"),
+    ("carb_high", 2, "主食のおかわりをしない"),
+    ("carb_high", 3, "間食の甘い物をやめる"),
+    ("salt_high", 1, "味噌汁を1杯までにする"),
+    ("salt_high", 1, "麺の汁を残す"),
+    ("salt_high", 2, "しょうゆをかけずに食べる"),
+    ("salt_high", 2, "漬物を控える"),
+    ("salt_high", 3, "加工食品を一日避ける"),
+    ("general", 1, "野菜を1食とる"),
+    ("general", 1, "水を1杯飲む"),
+    ("general", 1, "よく噛んで食べる"),
+    ("general", 2, "朝食を食べる"),
+    ("general", 2, "野菜を先に食べる"),
+    ("general", 2, "果物を1つ食べる"),
+    ("general", 3, "3食同じ時間に食べる"),
+    ("general", 3, "野菜を毎食とる"),
+    ("activity", 1, "5分ストレッチする"),
+    ("activity", 1, "階段を使う"),
+    ("activity", 2, "20分歩く"),
+    ("activity", 2, "一駅分歩く"),
+    ("activity", 3, "30分運動する"),
+    ("activity", 3, "寝る2時間前に食べ終える"),
+]
+
+HISTORY_DAYS = 28
+RECENT_DAYS = 3
+
+
+# -------------------------
+# ミッション集と索引（ファイルの更新時刻が変わったときだけ作り直す）
+# -------------------------
+_index_cache = {"mtime": None, "index": None, "size": 0}
+
+
+def load_extra_library(path=None):
+    path = path or LIBRARY_PATH
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return [(m["tag"], int(m["difficulty"]), m["text"]) for m in data.get("missions", [])
+                if m.get("tag") in TAG_LABELS and m.get("text")]
+    except Exception:
+        return []
+
+
+def get_index():
+    """tag -> [(difficulty, text), ...]"""
+    try:
+        mtime = os.stat(LIBRARY_PATH).st_mtime
+    except OSError:
+        mtime = None
+    if _index_cache["index"] is None or _index_cache["mtime"] != mtime:
+        index = {tag: [] for tag in TAG_LABELS}
+        seen = set()
+        for tag, diff, text in BUILTIN_MISSIONS + load_extra_library():
+            if text in seen:
+                continue
+            seen.add(text)
+            index[tag].append((diff, text))
+        _index_cache.update({"mtime": mtime, "index": index, "size": len(seen)})
+    return _index_cache["index"]
+
+
+# -------------------------
+# 推薦
+# -------------------------
+def achievement_history(missions, date, days=HISTORY_DAYS):
+    """直近 days 日の (ミッション別 [挑戦, 達成], 全体の達成率 or None, 直近に選んだミッション集合)"""
+    per_mission = {}
+    tries = successes = 0
+    recent = set()
+    for i in range(1, days + 1):
+        day = (date - datetime.timedelta(days=i)).isoformat()
+        d = missions.get(day)
+        if not d or not d.get("selected"):
+            continue
+        sel = d["selected"]
+        done = d.get("status", {}).get(sel) is True
+        rec = per_mission.setdefault(sel, [0, 0])
+        rec[0] += 1
+        rec[1] += int(done)
+        tries += 1
+        successes += int(done)
+        if i <= RECENT_DAYS:
+            recent.add(sel)
+    rate = successes / tries if tries else None
+    return per_mission, rate, recent
+
+
+def target_difficulty(self_esteem_level, rate):
+    # 自尊感情が低い・達成率が低いときは小さな成功体験を優先する
+    if self_esteem_level == "低" or (rate is not None and rate < 0.4):
+        return 1
+    if self_esteem_level == "高" and (rate is None or rate >= 0.7):
+        return 3 if rate is not None else 2
+    return 2
+
+
+def _jitter(seed, text):
+    # 日付・利用者ごとに決まった小さなゆらぎ（同じ日は同じ結果、日が変われば入れ替わる）
+    return (zlib.crc32(f"{seed}|{text}".encode("utf-8")) & 0xFF) / 255.0
+
+
+def recommend(user_info, app_data, date, k=3):
+    """
+    今日のミッションを k 件返す。
+    栄養傾向は当日より前の直近の記録日（なければ当日）の食事から判定する。
+    """
+    meal_data = app_data.get("meal_data", {})
+    meals = recent_meals(meal_data, date) or meal_data.get(date.isoformat(), {})
+    tendencies = calc_nutrition(meals)[1] if meals else []
+    tags = [TENDENCY_TAGS[t] for t in tendencies if t in TENDENCY_TAGS]
+
+    per_mission, rate, recent = achievement_history(app_data.get("missions", {}), date)
+    target = target_difficulty(user_info.get("self_esteem_level", ""), rate)
+    seed = f"{date.isoformat()}|{user_info.get('birth')}|{user_info.get('gender')}"
+
+    index = get_index()
+    scored = []
+    for tag in tags + ["general", "activity"]:
+        tag_bonus = 2.0 if tag in tags else 0.0
+        for diff, text in index.get(tag, []):
+            score = tag_bonus + 1.0 - abs(diff - target) / 2.0 + 0.3 * _jitter(seed, text)
+            tried, done = per_mission.get(text, (0, 0))
+            if tried:
+                # 達成できたミッションは少し優先、何度も未達成のものは下げる
+                score += 0.5 * (done / tried) - 0.3 * (tried - done)
+            if text in recent:
+                score -= 3.0
+            scored.append((score, tag, text))
+    scored.sort(reverse=True)
+
+    out, per_tag = [], {}
+    for score, tag, text in scored:
+        if text in out or per_tag.get(tag, 0) >= 2:
+            continue
+        out.append(text)
+        per_tag[tag] = per_tag.get(tag, 0) + 1
+        if len(out) == k:
+            break
+    return out
+
+
+# -------------------------
+# LLM によるミッション集の補充（定期実行）
+# -------------------------
+REFILL_SYSTEM = "あなたは健康行動支援の専門家です。必ず JSON オブジェクトのみを出力します。"
+
+
+def build_refill_prompt(tag, existing, n):
+    shown = "\n".join(f"- {t}" for t in existing[:30]) or "（なし）"
+    return f"""食生活の改善を目指す人向けに、「{TAG_LABELS[tag]}」の人が1日で取り組める行動ミッションを{n}個考えてください。
+各ミッションは3〜7語程度の短く具体的な文にし、難易度を 1（かんたん）〜3（がんばる）で付けてください。
+次の既存ミッションと重複・言い換えにならないものにしてください。
+{shown}
+
+出力は次の形式の JSON オブジェクトのみにしてください。
+{{"missions": [{{"text": "...", "difficulty": 1}}]}}
+"""
+
+
+def parse_refill(text, max_chars=40):
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("no JSON object in response")
+    obj = json.loads(text[start:end + 1])
+    items = obj.get("missions") if isinstance(obj, dict) else None
+    if not isinstance(items, list):
+        raise ValueError("missions must be a list")
+    out = []
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        t = it.get("text")
+        d = it.get("difficulty")
+        if isinstance(t, str) and t.strip() and len(t.strip()) <= max_chars and d in (1, 2, 3):
+            out.append((t.strip(), d))
+    return out
+
+
+def refill(client, per_tag=5, tags=None, path=None):
+    """タグごとに LLM へ新しいミッションを問い合わせ、mission_library.json に追記する。Returns 追加件数"""
+    import llm
+
+    path = path or LIBRARY_PATH
+    index = get_index()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        data = {"missions": []}
+    known = {text for items in index.values() for _, text in items}
+    added = 0
+    for tag in tags or list(TAG_LABELS):
+        existing = [text for _, text in index.get(tag, [])]
+        prompt = build_refill_prompt(tag, existing, per_tag)
+        try:
+            items = llm.chat_completion_text(
+                client,
+                [{"role": "system", "content": REFILL_SYSTEM}, {"role": "user", "content": prompt}],
+                temperature=0.9, max_tokens=400, json_mode=True,
+                purpose="mission_library_refill", parse=parse_refill
+            )
+        except Exception as e:
+            print(f"[{tag}] 失敗: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        for text, diff in items:
+            if text in known:
+                continue
+            known.add(text)
+            data["missions"].append({"tag": tag, "difficulty": diff, "text": text,
+                                     "added": datetime.date.today().isoformat()})
+            added += 1
+    if added:
+        storage.write_atomic(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+    return added
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ローカルのミッション推薦とミッション集の管理")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sp = sub.add_parser("show", help="保存済み利用者への推薦を表示")
+    sp.add_argument("dir", nargs="?", default=".")
+    sp.add_argument("--date", help="YYYY-MM-DD（既定: 今日）")
+    sub.add_parser("stats", help="ミッション集の件数")
+    rp = sub.add_parser("refill", help="LLM でミッション集を補充")
+    rp.add_argument("--per-tag", type=int, default=5)
+    rp.add_argument("--tag", action="append", choices=list(TAG_LABELS))
+    rp.add_argument("--api-key")
+    rp.add_argument("--base-url")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "stats":
+        index = get_index()
+        for tag, items in index.items():
+            print(f"{tag:12} {len(items):>4}  {TAG_LABELS[tag]}")
+        print(f"{'total':12} {_index_cache['size']:>4}")
+        return 0
+
+    if args.cmd == "show":
+        from storage import USER_FILE, APP_FILE, load_user, load_app
+        import time
+        user_info = load_user(os.path.join(args.dir, USER_FILE)) or {}
+        app_data = load_app(os.path.join(args.dir, APP_FILE))
+        date = datetime.datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else datetime.date.today()
+        recommend(user_info, app_data, date)
+        t0 = time.perf_counter()
+        out = recommend(user_info, app_data, date)
+        us = (time.perf_counter() - t0) * 1e6
+        for m in out:
+            print(f"- {m}")
+        print(f"({us:.0f} µs)")
+        return 0
+
+    import llm
+    client, inited = llm.make_client(args.api_key or (llm.resolve_api_key() or ("stub" if args.base_url else None)), args.base_url)
+    if not inited:
+        print("OpenAI クライアントを初期化できません（API キーを確認してください）", file=sys.stderr)
+        return 2
+    added = refill(client, args.per_tag, args.tag)
+    print(f"{added} 件追加しました（{LIBRARY_PATH}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
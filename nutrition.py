@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+簡易栄養計算（量を考慮）
+- file.py（Streamlit 画面）とバッチ処理の両方から使えるよう Streamlit に依存しない
+"""
+
+import datetime
+
+
+def recent_meals(meal_data, target_date, lookback=3):
+    """target_date より前の直近 lookback 日で、記録がある最新日の食事を返す"""
+    for i in range(1, lookback + 1):
+        day = (target_date - datetime.timedelta(days=i)).isoformat()
+        meals = meal_data.get(day) or {}
+        if any(meals.get(k) for k in ["朝食","昼食","夕食","間食"]):
+            return meals
+    return {}
+
+
+INTAKE_FACTOR = {"少なめ": 0.8, "普通": 1.0, "多め": 1.2}
+# expanded nutrition DB (per portion approximate)
+NUTRITION_DB = {
+    "ごはん": {"タンパク質":3, "脂質":1, "炭水化物":37, "cal":168, "塩分":0},
+    "ご飯": {"タンパク質":3, "脂質":1, "炭水化物":37, "cal":168, "塩分":0},
+    "パン": {"タンパク質":4, "脂質":5, "炭水化物":30, "cal":200, "塩分":0.5},
+    "パスタ": {"タンパク質":6, "脂質":8, "炭水化物":40, "cal":350, "塩分":0.8},
+    "魚": {"タンパク質":20, "脂質":10, "炭水化物":0, "cal":240, "塩分":0.2},
+    "肉": {"タンパク質":25, "脂質":20, "炭水化物":0, "cal":300, "塩分":0.3},
+    "鶏肉": {"タンパク質":20, "脂質":10, "炭水化物":0, "cal":220, "塩分":0.2},
+    "卵": {"タンパク質":6, "脂質":5, "炭水化物":1, "cal":90, "塩分":0.1},
+    "サラダ": {"タンパク質":1, "脂質":1, "炭水化物":3, "cal":60, "塩分":0.1},
+    "ヨーグルト": {"タンパク質":4, "脂質":2, "炭水化物":5, "cal":80, "塩分":0.05},
+    "味噌汁": {"タンパク質":3, "脂質":1, "炭水化物":3, "cal":40, "塩分":1.0},
+    "プロテイン": {"タンパク質":20, "脂質":2, "炭水化物":3, "cal":120, "塩分":0.2},
+    "サンドイッチ": {"タンパク質":10, "脂質":12, "炭水化物":35, "cal":350, "塩分":1.0},
+    "ハンバーグ": {"タンパク質":18, "脂質":20, "炭水化物":5, "cal":350, "塩分":0.8},
+    "揚げ物": {"タンパク質":8, "脂質":22, "炭水化物":20, "cal":400, "塩分":0.6},
+    "お菓子": {"タンパク質":3, "脂質":15, "炭水化物":45, "cal":300, "塩分":0.2},
+    "バナナ": {"タンパク質":1, "脂質":0.2, "炭水化物":22, "cal":90, "塩分":0},
+}
+
+_match_cache = {}
+_substring_cache = {}
+
+
+def match_food(name, substring_first=False):
+    """
+    品目名に対応する NUTRITION_DB の値（完全一致 → 部分一致の順、無ければ None）。結果は品目名ごとに覚える。
+    substring_first=True は「食品名 → 量」の古い形式用で、従来どおり NUTRITION_DB の並び順で最初に部分一致したもの
+    （"鶏肉" は 肉）にする
+    """
+    cache = _substring_cache if substring_first else _match_cache
+    try:
+        return cache[name]
+    except KeyError:
+        pass
+    matched = None if substring_first else NUTRITION_DB.get(name)
+    if matched is None:
+        for k in NUTRITION_DB.keys():
+            if k in name:
+                matched = NUTRITION_DB[k]
+                break
+    if len(cache) < 10000:
+        cache[name] = matched
+    return matched
+
+
+def build_index():
+    """よく出る品目名の照合結果を先に作っておく（起動時に1回呼ぶ）"""
+    for name in NUTRITION_DB:
+        match_food(name)
+    return len(_match_cache)
+
+
+def calc_nutrition(meals):
+    """
+    meals expected:
+    {"朝食": [ "卵", {"item":"サラダ","intake":"普通"}, ... ], ... }
+    old string-only items are supported and treated as intake="普通".
+    Returns totals (タンパク質, 脂質, 炭水化物, cal, 塩分) and tendencies list.
+    Works with both simple item lists and the extended meal dicts used elsewhere.
+    """
+    totals = {"タンパク質":0.0, "脂質":0.0, "炭水化物":0.0, "cal":0.0, "塩分":0.0}
+    tendencies = []
+
+    # If meals looks like flat nutrition mapping (not meal->items), try to handle
+    if isinstance(meals, dict) and all(isinstance(v, str) for v in meals.values()):
+        # e.g. {"卵":"普通", "ごはん":"多め"}
+        for name, amount in meals.items():
+            matched = match_food(name, substring_first=True)
+            factor = INTAKE_FACTOR.get(amount, 1.0)
+            if matched:
+                totals["タンパク質"] += matched.get("タンパク質",0) * factor
+                totals["脂質"] += matched.get("脂質",0) * factor
+                totals["炭水化物"] += matched.get("炭水化物",0) * factor
+                totals["cal"] += matched.get("cal",0) * factor
+                totals["塩分"] += matched.get("塩分",0) * factor
+    else:
+        # expected structure: {"朝食":[...],"昼食":[...],...}
+        for meal, items in (meals or {}).items():
+            if not items:
+                continue
+            for it in items:
+                if isinstance(it, str):
+                    name = it
+                    intake = "普通"
+                elif isinstance(it, dict):
+                    name = it.get("item") or it.get("name") or it.get("food") or ""
+                    intake = it.get("intake") or it.get("amount") or it.get("amount_label") or "普通"
+                else:
+                    continue
+
+                matched = match_food(name)
+                factor = INTAKE_FACTOR.get(intake, 1.0)
+                if matched:
+                    totals["タンパク質"] += matched.get("タンパク質",0) * factor
+                    totals["脂質"] += matched.get("脂質",0) * factor
+                    totals["炭水化物"] += matched.get("炭水化物",0) * factor
+                    totals["cal"] += matched.get("cal",0) * factor
+                    totals["塩分"] += matched.get("塩分",0) * factor
+                else:
+                    # fallback heuristics
+                    if any(x in name for x in ["肉","魚","鶏","ハンバーグ"]):
+                        totals["タンパク質"] += 10 * factor
+                    if any(x in name for x in ["揚げ","バター","油","フライ"]):
+                        totals["脂質"] += 5 * factor
+                    if any(x in name for x in ["ごはん","ご飯","パン","パスタ","麺","うどん","そば"]):
+                        totals["炭水化物"] += 30 * factor
+
+    totals = {k: round(v,1) for k,v in totals.items()}
+
+    # tendencies
+    if totals["タンパク質"] < 40:
+        tendencies.append("タンパク質不足傾向")
+    if totals["脂質"] > 70:
+        tendencies.append("脂質多めの傾向")
+    if totals["炭水化物"] > 300:
+        tendencies.append("炭水化物多めの傾向")
+    if totals["塩分"] > 6:
+        tendencies.append("塩分多めの傾向")
+
+    return totals, tendencies
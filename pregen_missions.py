@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+翌日ミッションの事前生成（バッチ）
+- 保存済みの利用者ごとに、プロフィールと直近の食事記録から try_generate_missions と同じプロンプトを組み立てる
+- 生成結果を app_data の missions[日付]["auto"] に書き込み、翌朝の画面表示を読み込みだけにする
+- スレッドプールで同時実行数を制限して LLM を呼ぶ
+- --base-url でローカルのスタブサーバに向けて動作確認できる
+
+使い方:
+    python pregen_missions.py                      # カレントディレクトリの利用者（従来の保存場所）
+    python pregen_missions.py data/u1 data/u2      # 利用者ごとのディレクトリ
+    python pregen_missions.py --users-root data    # data/ 以下の各ディレクトリを利用者として扱う
+    python pregen_missions.py --base-url http://127.0.0.1:8000/v1 --concurrency 8
+"""
+
+import argparse, datetime, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+import llm, llm_ledger
+from nutrition import recent_meals
+from storage import USER_FILE, APP_FILE, find_user_dirs, load_user, load_app, save_app, path_lock
+
+
+def pregen_user(client, user_dir, target_date, force=False):
+    """1人分を処理して (状態, 詳細) を返す。状態は generated / skipped / error"""
+    user_info = load_user(os.path.join(user_dir, USER_FILE))
+    if not user_info:
+        return "skipped", "user_data なし"
+    app_path = os.path.join(user_dir, APP_FILE)
+    app_data = load_app(app_path)
+    key_date = target_date.strftime("%Y-%m-%d")
+    existing = app_data.get("missions", {}).get(key_date)
+    if existing and existing.get("auto") and not force:
+        return "skipped", "生成済み"
+
+    meals = recent_meals(app_data.get("meal_data", {}), target_date)
+    try:
+        missions = llm.request_missions(client, user_info, meals, purpose="missions_prefetch",
+                                        user=llm_ledger.user_key(user_info, user_dir))
+    except Exception as e:
+        # 失敗時は書き込まない（当日の画面表示時に従来どおり生成される）
+        return "error", f"{type(e).__name__}: {e}"
+
+    # LLM 待ちの間に画面側が保存している可能性があるので、画面側の保存と同じロックの中で読み直してから書く
+    with path_lock(app_path):
+        app_data = load_app(app_path)
+        day = app_data.setdefault("missions", {}).setdefault(
+            key_date, {"auto": [], "custom": [], "selected": None, "status": {}}
+        )
+        day["auto"] = missions
+        save_app(app_data, app_path)
+    return "generated", " / ".join(missions)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="翌日ミッションを事前生成して app_data.json に書き込む")
+    ap.add_argument("dirs", nargs="*", help="user_data.json / app_data.json があるディレクトリ（既定: .）")
+    ap.add_argument("--users-root", help="このディレクトリ直下の各サブディレクトリを利用者として処理する")
+    ap.add_argument("--date", help="生成対象日 YYYY-MM-DD（既定: 明日）")
+    ap.add_argument("--concurrency", type=int, default=4, help="LLM 同時呼び出し数（既定: 4）")
+    ap.add_argument("--force", action="store_true", help="生成済みでも作り直す")
+    ap.add_argument("--api-key", help="OpenAI API キー（既定: 環境変数 OPENAI_API_KEY / OPENAI_KEY）")
+    ap.add_argument("--base-url", help="OpenAI 互換 API のベース URL（既定: 環境変数 OPENAI_BASE_URL）")
+    args = ap.parse_args(argv)
+
+    if args.date:
+        target_date = datetime.datetime.strptime(args.date, "%Y-%m-%d").date()
+    else:
+        target_date = datetime.date.today() + datetime.timedelta(days=1)
+
+    user_dirs = list(args.dirs)
+    if args.users_root:
+        user_dirs += find_user_dirs(args.users_root)
+    if not user_dirs:
+        user_dirs = ["."]
+
+    api_key = args.api_key
+    if not api_key and args.base_url:
+        # ローカルスタブはキーを検証しないのでダミーでよい
+        api_key = llm.resolve_api_key() or "stub"
+    client, inited = llm.make_client(api_key, args.base_url)
+    if not inited:
+        print("OpenAI クライアントを初期化できません（API キーを確認してください）", file=sys.stderr)
+        return 2
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as ex:
+        futures = [(d, ex.submit(pregen_user, client, d, target_date, args.force)) for d in user_dirs]
+        counts = {"generated": 0, "skipped": 0, "error": 0}
+        for d, fut in futures:
+            state, detail = fut.result()
+            counts[state] += 1
+            print(f"[{state}] {d}: {detail}")
+    elapsed = time.perf_counter() - t0
+
+    print(f"{target_date} 生成 {counts['generated']} / スキップ {counts['skipped']} / 失敗 {counts['error']} "
+          f"（{len(user_dirs)}人, {elapsed:.2f}s）")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+セッション単位のサンプリングプロファイラ（フレームグラフ出力）
+- デバッグ表示（APP_DEBUG）が有効なときだけ、URL の ?profile=N かデバッグ表示のボタンで、そのセッションの
+  次の N 回（最大 MAX_RUNS 回）の実行だけを計測する
+- 計測中は別スレッドが一定間隔（PROFILE_INTERVAL_MS、既定 5ms）でスクリプト実行スレッドのスタックを読み、
+  「関数;関数;...」ごとの出現回数（collapsed stacks）を数える。calc_nutrition の中や Streamlit 自身の処理も見える
+- 計測していないときは何もしない（file.py は残り回数が 0 なら素通りする）
+- 結果は PROFILE_DIR（既定: profiles/）に .collapsed（flamegraph.pl / speedscope で読める形式）と
+  単体で開ける .html のフレームグラフを書く。N 回の途中でも、実行のたびに累計で書き直す。
+  PROFILE_DIR には新しい順に PROFILE_KEEP 件（既定 20）の計測だけを残し、古いものは消す
+- 外部ライブラリは使わない（標準ライブラリとこのリポジトリの storage だけ）
+
+使い方（保存した .collapsed から HTML を作り直す・重い関数を見る）:
+    python profiler.py flame profiles/20261019-150102-ab12cd.collapsed -o flame.html
+    python profiler.py top profiles/20261019-150102-ab12cd.collapsed -n 20
+"""
+
+import argparse, collections, contextlib, datetime, html, os, re, sys, threading, uuid, zlib
+
+import storage
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+INTERVAL_MS = _env_float("PROFILE_INTERVAL_MS", 5)
+MAX_RUNS = 50
+KEEP = int(_env_float("PROFILE_KEEP", 20))
+# Profile.name の形（これに合うファイルだけを古い順に消す）
+_NAME_RE = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{6}\.(collapsed|html)$")
+
+
+def profile_dir():
+    return os.getenv("PROFILE_DIR", "profiles")
+
+
+# -------------------------
+# サンプリング
+# -------------------------
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def parse_runs(value):
+    """?profile=N の N（1〜MAX_RUNS に丸める）。数でなければ None"""
+    try:
+        return max(1, min(int(value or 1), MAX_RUNS))
+    except (TypeError, ValueError):
+        return None
+
+
+class Profile:
+    """1回の計測（N 回の実行分）の累計"""
+
+    def __init__(self, runs):
+        self.runs_left = max(1, min(int(runs), MAX_RUNS))
+        self.runs_done = 0
+        self.samples = 0
+        self.counts = collections.Counter()
+        self.name = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.pages = collections.Counter()
+
+    @property
+    def active(self):
+        return self.runs_left > 0
+
+    def paths(self, out_dir=None):
+        base = os.path.join(out_dir or profile_dir(), self.name)
+        return f"{base}.collapsed", f"{base}.html"
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, thread_id, counts, interval):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.counts = counts
+        self.interval = interval
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            if self._stop_event.is_set():
+                # 止める途中（計測対象のスレッドが join で待っているところ）は数えない
+                break
+            self.counts[_stack(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def sample(profile, label="run", interval_ms=None):
+    """with の中の実行（呼び出したスレッド）をサンプリングして profile に足し、ファイルを書き直す"""
+    counts = collections.Counter()
+    sampler = _Sampler(threading.get_ident(), counts, (interval_ms or INTERVAL_MS) / 1000.0)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        profile.counts.update(counts)
+        profile.samples += sampler.samples
+        profile.runs_done += 1
+        profile.runs_left -= 1
+        profile.pages[label] += 1
+        try:
+            write(profile)
+        except OSError:
+            # 書き出しに失敗しても画面は止めない
+            pass
+
+
+# -------------------------
+# 書き出し
+# -------------------------
+def collapsed_text(counts):
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items()))
+
+
+def read_collapsed(path):
+    counts = collections.Counter()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, n = line.rstrip("\n").rpartition(" ")
+            if stack and n.isdigit():
+                counts[stack] += int(n)
+    return counts
+
+
+def _tree(counts):
+    root = {"name": "all", "value": 0, "children": {}}
+    for stack, n in counts.items():
+        root["value"] += n
+        node = root
+        for name in stack.split(";"):
+            child = node["children"].get(name)
+            if child is None:
+                child = node["children"][name] = {"name": name, "value": 0, "children": {}}
+            child["value"] += n
+            node = child
+    return root
+
+
+_FLAME_CSS = (
+    "body{font:12px sans-serif;margin:12px}"
+    ".n{box-sizing:border-box;overflow:hidden}"
+    ".l{white-space:nowrap;overflow:hidden;text-overflow:ellipsis;padding:1px 3px;margin:0 1px 1px 0;"
+    "border-radius:2px;background:hsl(var(--h),70%,72%);cursor:default}"
+    ".c{display:flex}"
+)
+
+
+def flame_html(counts, title="profile", min_ratio=0.002):
+    """上から下へ呼び出しが深くなるフレームグラフ（アイシクル）の HTML。全体の min_ratio 未満の枝は省く"""
+    root = _tree(counts)
+    total = root["value"] or 1
+
+    def render(node, parent_value):
+        pct = 100.0 * node["value"] / parent_value
+        ratio = node["value"] / total
+        tip = html.escape(f"{node['name']}  {node['value']} samples ({ratio:.1%})", quote=True)
+        hue = 20 + zlib.crc32(node["name"].split(" (")[-1].encode("utf-8")) % 40
+        kids = [c for c in sorted(node["children"].values(), key=lambda c: -c["value"]) if c["value"] / total >= min_ratio]
+        inner = "".join(render(c, node["value"]) for c in kids)
+        return (f'<div class="n" style="width:{pct:.3f}%"><div class="l" style="--h:{hue}" title="{tip}">'
+                f'{html.escape(node["name"])}</div><div class="c">{inner}</div></div>')
+
+    return (f"<!doctype html><meta charset='utf-8'><title>{html.escape(title)}</title><style>{_FLAME_CSS}</style>"
+            f"<h3>{html.escape(title)}（{total} samples）</h3>{render(root, total)}")
+
+
+def write(profile, out_dir=None):
+    collapsed_path, html_path = profile.paths(out_dir)
+    os.makedirs(os.path.dirname(collapsed_path) or ".", exist_ok=True)
+    for path, text in ((collapsed_path, collapsed_text(profile.counts)),
+                       (html_path, flame_html(profile.counts, title=f"{profile.name} / {profile.runs_done} runs"))):
+        storage.write_atomic(path, lambda f, text=text: f.write(text))
+    prune(os.path.dirname(collapsed_path) or ".", keep=KEEP, current=profile.name)
+    return collapsed_path, html_path
+
+
+def prune(out_dir, keep=KEEP, current=None):
+    """out_dir の計測結果を新しい順に keep 件だけ残す（current は数に入れて必ず残す）。Returns 消した計測の数"""
+    by_name = collections.defaultdict(list)
+    for fn in os.listdir(out_dir):
+        if _NAME_RE.match(fn):
+            by_name[fn.rsplit(".", 1)[0]].append(os.path.join(out_dir, fn))
+
+    def newest(name):
+        return max((os.path.getmtime(p) for p in by_name[name] if os.path.exists(p)), default=0.0)
+
+    names = sorted((n for n in by_name if n != current), key=newest, reverse=True)
+    old = names[max(0, keep - (1 if current in by_name else 0)):]
+    for name in old:
+        for path in by_name[name]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return len(old)
+
+
+def top_functions(counts, n=20):
+    """自身で時間を使っている関数（スタックの末尾）の上位"""
+    self_counts = collections.Counter()
+    for stack, c in counts.items():
+        self_counts[stack.rsplit(";", 1)[-1]] += c
+    return self_counts.most_common(n)
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="collapsed stacks からフレームグラフを作る・重い関数を見る")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    fp = sub.add_parser("flame", help="HTML のフレームグラフを作る")
+    fp.add_argument("path")
+    fp.add_argument("-o", "--out", help="出力先（既定: 入力の拡張子を .html にしたもの）")
+    tp = sub.add_parser("top", help="自身の時間が長い関数の上位")
+    tp.add_argument("path")
+    tp.add_argument("-n", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    counts = read_collapsed(args.path)
+    if args.cmd == "flame":
+        out = args.out or os.path.splitext(args.path)[0] + ".html"
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(flame_html(counts, title=os.path.basename(args.path)))
+        print(out)
+        return 0
+    total = sum(counts.values()) or 1
+    for name, c in top_functions(counts, args.n):
+        print(f"{c:>8} {c / total:>7.1%}  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
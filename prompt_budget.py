@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+プロンプトのサイズ見積りと予算内への切り詰め
+- トークン数はローカルで数える（tiktoken があれば o200k_base、無ければ文字種ベースの概算）
+- 食事行は「同じ品目・同じ量」をまとめ（例: 間食: お菓子 ×4（量: 普通））、区分ごとの行数に上限をかける
+- それでも食事部分が予算を超える場合は、区分ごとの上限を1行ずつ減らして収める
+- 栄養の計算は切り詰め前の全品目で行う（プロンプトに載せる行だけを減らす）
+- 送ったプロンプトのトークン数はプロセス共通の STATS にヒストグラムとして溜め、stats() で確認する
+- 設定は環境変数 PROMPT_MEAL_LINES_PER_SLOT / PROMPT_MEAL_TOKENS / PROMPT_MISSION_MAX_CHARS / PROMPT_TOKENIZER
+
+使い方（保存済みデータで切り詰め前後のサイズを比べる）:
+    python prompt_budget.py                 # カレントディレクトリの app_data.json
+    python prompt_budget.py data/u1 --json
+"""
+
+import argparse, bisect, json, os, sys, threading
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+MEAL_LINES_PER_SLOT = _env_int("PROMPT_MEAL_LINES_PER_SLOT", 8)
+MEAL_TOKENS = _env_int("PROMPT_MEAL_TOKENS", 400)
+MISSION_MAX_CHARS = _env_int("PROMPT_MISSION_MAX_CHARS", 80)
+
+
+# -------------------------
+# トークン数の見積り
+# -------------------------
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """tiktoken のエンコーディング（初回だけ読み込む）。使えなければ None"""
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return _encoding
+    if os.getenv("PROMPT_TOKENIZER", "auto") == "heuristic":
+        _encoding_failed = True
+        return None
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # 未インストール・エンコーディング取得失敗（オフライン）のときは概算に切り替える
+        _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text):
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text))
+    # 日本語はおおよそ1文字1トークン、英数字は4文字1トークン程度の概算
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4
+
+
+def tokenizer_name():
+    return "tiktoken/o200k_base" if _get_encoding() is not None else "heuristic"
+
+
+# -------------------------
+# 食事行の集約・切り詰め
+# -------------------------
+def aggregate_items(items):
+    """同じ品目・同じ量をまとめて [(item, intake, 個数), ...]（最初に出てきた順）"""
+    counts = {}
+    for it in items:
+        key = (it["item"], it["intake"])
+        counts[key] = counts.get(key, 0) + 1
+    return [(item, intake, n) for (item, intake), n in counts.items()]
+
+
+def _slot_lines(meal_name, grouped, per_slot):
+    lines = []
+    for item, intake, n in grouped[:per_slot]:
+        name = f"{item} ×{n}" if n > 1 else f"{item}"
+        lines.append(f"{meal_name}: {name}（量: {intake}）")
+    rest = grouped[per_slot:]
+    if rest:
+        lines.append(f"{meal_name}: ほか{sum(n for _, _, n in rest)}品")
+    return lines
+
+
+def meal_lines(normalized_meals, per_slot=None, token_budget=None):
+    """
+    プロンプト用の食事行を作る。Returns (行のリスト, 切り詰めたか)
+    重複が無く上限内なら従来どおり1品1行で、内容は変わらない。
+    """
+    per_slot = MEAL_LINES_PER_SLOT if per_slot is None else per_slot
+    token_budget = MEAL_TOKENS if token_budget is None else token_budget
+    grouped = {k: aggregate_items(v) for k, v in normalized_meals.items()}
+    aggregated = any(len(g) < len(normalized_meals[k]) for k, g in grouped.items())
+    while True:
+        lines = []
+        for meal_name, g in grouped.items():
+            lines.extend(_slot_lines(meal_name, g, per_slot))
+        capped = any(len(g) > per_slot for g in grouped.values())
+        if per_slot <= 1 or not token_budget or count_tokens("\n".join(lines)) <= token_budget:
+            return lines, aggregated or capped
+        per_slot -= 1
+
+
+def clip_text(text, max_chars=None):
+    """ミッション文など自由入力の長い文字列を切る"""
+    max_chars = MISSION_MAX_CHARS if max_chars is None else max_chars
+    if not text or not max_chars or len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1] + "…"
+
+
+# -------------------------
+# プロンプトサイズのヒストグラム
+# -------------------------
+BUCKETS = (128, 256, 384, 512, 768, 1024, 1536, 2048, 4096)
+
+
+def _bucket_label(i):
+    if i == 0:
+        return f"<={BUCKETS[0]}"
+    if i == len(BUCKETS):
+        return f">{BUCKETS[-1]}"
+    return f"{BUCKETS[i - 1] + 1}-{BUCKETS[i]}"
+
+
+class PromptSizeStats:
+    """用途ごとに、送ったプロンプト（と切り詰め前）のトークン数を溜める"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_purpose = {}
+
+    def _new(self):
+        return {"count": 0, "trimmed": 0, "tokens": 0, "raw_tokens": 0, "max": 0,
+                "hist": [0] * (len(BUCKETS) + 1)}
+
+    def observe(self, purpose, tokens, raw_tokens=None):
+        raw_tokens = tokens if raw_tokens is None else raw_tokens
+        with self._lock:
+            s = self._by_purpose.get(purpose)
+            if s is None:
+                s = self._by_purpose[purpose] = self._new()
+            s["count"] += 1
+            s["tokens"] += tokens
+            s["raw_tokens"] += raw_tokens
+            s["max"] = max(s["max"], tokens)
+            if raw_tokens > tokens:
+                s["trimmed"] += 1
+            s["hist"][bisect.bisect_left(BUCKETS, tokens)] += 1
+
+    def stats(self):
+        out = {}
+        with self._lock:
+            for purpose, s in sorted(self._by_purpose.items()):
+                out[purpose] = {
+                    "count": s["count"],
+                    "trimmed": s["trimmed"],
+                    "avg_tokens": round(s["tokens"] / s["count"], 1),
+                    "avg_raw_tokens": round(s["raw_tokens"] / s["count"], 1),
+                    "saved_ratio": round(1 - s["tokens"] / s["raw_tokens"], 3) if s["raw_tokens"] else 0.0,
+                    "max_tokens": s["max"],
+                    "hist": {_bucket_label(i): n for i, n in enumerate(s["hist"]) if n},
+                }
+        return out
+
+    def reset_stats(self):
+        with self._lock:
+            self._by_purpose.clear()
+
+
+# プロセス共有インスタンス
+STATS = PromptSizeStats()
+
+
+# -------------------------
+# CLI：保存済みの食事記録で切り詰め前後を比べる
+# -------------------------
+def main(argv=None):
+    # python prompt_budget.py で実行したときも llm が使う方のモジュールの STATS を見る
+    import llm
+    import prompt_budget
+    from storage import USER_FILE, APP_FILE, load_user, load_app
+
+    ap = argparse.ArgumentParser(description="保存済みの食事記録でフィードバック用プロンプトのサイズを比べる")
+    ap.add_argument("dir", nargs="?", default=".", help="user_data.json / app_data.json があるディレクトリ（既定: .）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = ap.parse_args(argv)
+
+    user_info = load_user(os.path.join(args.dir, USER_FILE)) or {}
+    app_data = load_app(os.path.join(args.dir, APP_FILE))
+    age = user_info.get("age", 0)
+    gender = user_info.get("gender", "")
+    self_esteem = user_info.get("self_esteem_level", "")
+    prompt_budget.STATS.reset_stats()
+    for day, meals in sorted(app_data.get("meal_data", {}).items()):
+        sel_m = app_data.get("missions", {}).get(day, {}).get("selected")
+        llm.build_feedback_prompt(age, gender, self_esteem, meals, selected_mission=sel_m)
+
+    result = {"tokenizer": prompt_budget.tokenizer_name(), "stats": prompt_budget.STATS.stats()}
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    print(f"tokenizer: {result['tokenizer']}")
+    for purpose, s in result["stats"].items():
+        print(f"[{purpose}] {s['count']} 件（うち切り詰め {s['trimmed']}）  平均 {s['avg_raw_tokens']} → {s['avg_tokens']} tokens"
+              f"（削減 {s['saved_ratio']:.1%}）  最大 {s['max_tokens']}")
+        for label, n in s["hist"].items():
+            print(f"  {label:>10}: {n}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 呼び出しのプロセス共通レート制限
+- リクエスト数 / トークン数（毎分）のトークンバケットを全セッションで共有する
+- 待ち行列は優先度つき：画面操作（フィードバック生成など）を事前生成・バックフィルより先に通す
+- 期限（deadline）までは待ち、超えたら RateLimitTimeout。利用者ごとの1日上限を超えたら QuotaExceeded
+- 上流から 429 が返ったら penalize() でバケットを空にし、全員が Retry-After だけ待つ（LLM_RPM=0 でバケットが
+  無いときは、429 を受けた呼び出し側が自分で Retry-After だけ待つ）。429 になった試行は refund() で
+  利用者の1日上限・トークンのバケットに返す
+- 設定は環境変数 LLM_RPM / LLM_TPM / LLM_USER_DAILY_REQUESTS / LLM_USER_DAILY_TOKENS（0 は無制限）
+"""
+
+import datetime, heapq, itertools, os, threading, time
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, n):
+        """n 個取り出せるまでの秒数（0 なら今すぐ可）"""
+        self._refill()
+        n = min(n, self.capacity)
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+    def take(self, n):
+        self._refill()
+        self.tokens -= min(n, self.capacity)
+
+    def give_back(self, n):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + n)
+
+    def drain(self, seconds):
+        """seconds 秒間は何も取り出せないようにする"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RateLimiter:
+    def __init__(self, rpm=0, tpm=0, user_daily_requests=0, user_daily_tokens=0, clock=time.monotonic):
+        self.requests = TokenBucket(rpm, clock) if rpm else None
+        self.tokens = TokenBucket(tpm, clock) if tpm else None
+        self.user_daily_requests = user_daily_requests
+        self.user_daily_tokens = user_daily_tokens
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._usage = {}
+        self._counters = {"granted": 0, "waited": 0, "timeouts": 0, "quota_rejects": 0, "penalties": 0, "wait_ms_total": 0.0}
+
+    # -------------------------
+    # 利用者ごとの1日上限
+    # -------------------------
+    def _user_usage(self, user):
+        today = datetime.date.today().isoformat()
+        u = self._usage.get(user)
+        if not u or u["day"] != today:
+            u = {"day": today, "requests": 0, "tokens": 0}
+            self._usage[user] = u
+        return u
+
+    def _check_quota(self, user, tokens):
+        if user is None:
+            return
+        u = self._user_usage(user)
+        if self.user_daily_requests and u["requests"] + 1 > self.user_daily_requests:
+            raise QuotaExceeded(f"daily request quota reached ({self.user_daily_requests})")
+        if self.user_daily_tokens and u["tokens"] + tokens > self.user_daily_tokens:
+            raise QuotaExceeded(f"daily token quota reached ({self.user_daily_tokens})")
+
+    def _wait_time(self, tokens):
+        w = 0.0
+        if self.requests:
+            w = max(w, self.requests.time_until(1))
+        if self.tokens and tokens:
+            w = max(w, self.tokens.time_until(tokens))
+        return w
+
+    # -------------------------
+    # 取得・精算
+    # -------------------------
+    def acquire(self, tokens=0, priority=INTERACTIVE, user=None, deadline_s=30.0):
+        """
+        1リクエスト分（見積り tokens 個）の枠を取る。取れるまで優先度順に待つ。
+        Returns 待った秒数。期限切れは RateLimitTimeout、1日上限は QuotaExceeded。
+        """
+        start = self.clock()
+        deadline = start + deadline_s
+        with self._cond:
+            try:
+                self._check_quota(user, tokens)
+            except QuotaExceeded:
+                self._counters["quota_rejects"] += 1
+                raise
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    if self._queue[0] == ticket:
+                        wait = self._wait_time(tokens)
+                        if wait <= 0:
+                            self._check_quota(user, tokens)
+                            if self.requests:
+                                self.requests.take(1)
+                            if self.tokens and tokens:
+                                self.tokens.take(tokens)
+                            if user is not None:
+                                u = self._user_usage(user)
+                                u["requests"] += 1
+                                u["tokens"] += tokens
+                            waited = self.clock() - start
+                            self._counters["granted"] += 1
+                            if waited > 0.001:
+                                self._counters["waited"] += 1
+                                self._counters["wait_ms_total"] += waited * 1000
+                            return waited
+                    else:
+                        # 先頭（より優先度の高い / 先に並んだ呼び出し）の番を待つ
+                        wait = 0.05
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise RateLimitTimeout(f"rate limit wait exceeded {deadline_s}s")
+                    self._cond.wait(min(wait, remaining))
+            except QuotaExceeded:
+                self._counters["quota_rejects"] += 1
+                raise
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def settle(self, user, estimated, actual):
+        """見積りと実際のトークン数の差を精算する"""
+        if not actual:
+            return
+        diff = estimated - actual
+        with self._cond:
+            if self.tokens:
+                if diff > 0:
+                    self.tokens.give_back(diff)
+                else:
+                    self.tokens.take(-diff)
+            if user is not None:
+                self._user_usage(user)["tokens"] -= diff
+            self._cond.notify_all()
+
+    def refund(self, user, tokens):
+        """上流で受け付けられなかった（429 の）試行の分を、利用者の1日上限とトークンのバケットに返す"""
+        with self._cond:
+            if self.tokens and tokens:
+                self.tokens.give_back(tokens)
+            if user is not None:
+                u = self._user_usage(user)
+                u["requests"] = max(0, u["requests"] - 1)
+                u["tokens"] = max(0, u["tokens"] - tokens)
+            self._cond.notify_all()
+
+    def penalize(self, retry_after):
+        """
+        上流の 429 を受けたら retry_after 秒は誰も呼ばないようにする。
+        Returns 呼び出し側が自分で待つ秒数（リクエスト数のバケットが無いときは retry_after、あれば 0）
+        """
+        with self._cond:
+            self._counters["penalties"] += 1
+            if self.requests:
+                self.requests.drain(retry_after)
+                return 0.0
+        return retry_after
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._counters)
+            out["wait_ms_total"] = round(out["wait_ms_total"], 1)
+            out["queued"] = len(self._queue)
+            out["queued_background"] = sum(1 for p, _ in self._queue if p == BACKGROUND)
+            today = datetime.date.today().isoformat()
+            out["users_today"] = sum(1 for u in self._usage.values() if u["day"] == today)
+        return out
+
+    def user_usage(self, user):
+        with self._cond:
+            return dict(self._user_usage(user))
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# プロセス共有インスタンス（既定値は gpt-4o-mini の Tier1 上限を目安にしている）
+LIMITER = RateLimiter(
+    rpm=_env_int("LLM_RPM", 500),
+    tpm=_env_int("LLM_TPM", 200000),
+    user_daily_requests=_env_int("LLM_USER_DAILY_REQUESTS", 100),
+    user_daily_tokens=_env_int("LLM_USER_DAILY_TOKENS", 0),
+)
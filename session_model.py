@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+セッション状態の型付きモデル
+- 画面遷移・選択中の日付・編集中の品目・一時的なフラグ・計測中のプロファイルを、__slots__ の dataclass にまとめて
+  st.session_state["model"] に1つだけ置く（文字列キーを組み立てて探す必要がなく、属性で直接読み書きする）
+- 編集中の品目（EditContext）は begin_edit / end_edit で作って消す。日付を変えると自動で消えるので、他の日に残らない
+- 入力欄などウィジェットの値は Streamlit が key で管理するので、ここには入れない
+- memory_report() でセッションごとの状態のサイズ（キーごと・モデルの項目ごと）を見る
+- Streamlit に依存しない（session_state は dict と同じように扱う）
+"""
+
+import datetime, sys
+from dataclasses import dataclass, field, fields, is_dataclass
+
+STATE_KEY = "model"
+
+
+@dataclass(slots=True)
+class Navigation:
+    page: str = "init_register"
+    # on_click で遷移を始めたときの遷移先と、描画し終わるまでのスクリプト実行回数
+    pending: str | None = None
+    pending_runs: int = 0
+
+    def go(self, target):
+        self.page = target
+        self.pending = target
+        self.pending_runs = 0
+
+
+@dataclass(slots=True)
+class EditContext:
+    """食事編集画面で編集中の品目"""
+    date: str
+    meal: str
+    idx: int
+    item: dict
+
+
+# 画面・日付を変えたら消す通知（その画面で出した確認など）
+PAGE_NOTICES = ("fb_regen_confirm",)
+
+
+@dataclass(slots=True)
+class Flags:
+    # まとめて入力の表の版（保存・コピーのたびに上げて表を作り直す）
+    bulk_ver: int = 0
+    # 次の描画で1回だけ使う通知（入力が空・保存しました など）
+    notices: dict = field(default_factory=dict)
+
+    def leave_page(self):
+        for name in PAGE_NOTICES:
+            self.notices.pop(name, None)
+
+    def flash(self, name, value=True):
+        self.notices[name] = value
+
+    def take(self, name, default=None):
+        return self.notices.pop(name, default)
+
+    def peek(self, name, default=None):
+        return self.notices.get(name, default)
+
+
+@dataclass(slots=True)
+class SessionModel:
+    nav: Navigation = field(default_factory=Navigation)
+    selected_date: datetime.date = field(default_factory=datetime.date.today)
+    show_calendar: bool = False
+    edit: EditContext | None = None
+    flags: Flags = field(default_factory=Flags)
+    # 計測中のプロファイル（profiler.Profile）。計測していないときは None
+    profile: object = None
+
+    @property
+    def date_key(self):
+        return self.selected_date.strftime("%Y-%m-%d")
+
+    def select_date(self, d):
+        if d != self.selected_date:
+            self.end_edit()
+            self.flags.leave_page()
+        self.selected_date = d
+
+    def begin_edit(self, meal, idx, item):
+        self.edit = EditContext(self.date_key, meal, idx, dict(item))
+
+    def end_edit(self):
+        self.edit = None
+
+    def current_edit(self):
+        """選択中の日付の編集だけを返す（別の日の編集は捨てる）"""
+        if self.edit is not None and self.edit.date != self.date_key:
+            self.edit = None
+        return self.edit
+
+
+def of(session_state):
+    """セッションの SessionModel（無ければ作る）"""
+    m = session_state.get(STATE_KEY)
+    if m is None:
+        m = session_state[STATE_KEY] = SessionModel()
+    return m
+
+
+# -------------------------
+# メモリ使用量
+# -------------------------
+def deep_sizeof(obj, _seen=None):
+    """obj が参照しているものも含めたおおよそのバイト数（同じオブジェクトは1回だけ数える）"""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(x, seen) for x in obj)
+    elif is_dataclass(obj) and not isinstance(obj, type):
+        size += sum(deep_sizeof(getattr(obj, f.name), seen) for f in fields(obj))
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def memory_report(session_state, top=10):
+    """セッション状態のサイズ。キーごと（大きい順に top 件）と、モデルの項目ごと"""
+    sizes = {}
+    for k in list(session_state.keys()):
+        try:
+            sizes[k] = deep_sizeof(session_state[k])
+        except Exception:
+            # 取り出せないウィジェット値などは飛ばす
+            continue
+    m = session_state.get(STATE_KEY)
+    return {
+        "keys": len(sizes),
+        "total_bytes": sum(sizes.values()),
+        "largest": dict(sorted(sizes.items(), key=lambda kv: -kv[1])[:top]),
+        "model": {f.name: deep_sizeof(getattr(m, f.name)) for f in fields(m)} if m is not None else {},
+    }
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 呼び出しの single-flight（同一リクエストの合流）
+- 同じプロンプト（ハッシュ）の同時リクエストは上流への呼び出しを1回だけ行い、結果を共有する
+- Streamlit はセッションごとに file.py を再実行するが、このモジュールは import キャッシュされるので
+  プロセス内の全セッションで同じ GROUP を共有できる
+- 直後の二度押し対策として、完了した結果を linger 秒だけ再利用できる（利用者が明示的に作り直すときは reuse=False）
+- 合流した件数などのカウンタは stats() で取得する
+"""
+
+import hashlib, json, threading, time
+
+
+def request_key(model, messages, **params):
+    """model / messages / パラメータから安定したハッシュキーを作る"""
+    payload = {"model": model, "messages": messages, "params": params}
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "done_at")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.done_at = None
+
+
+class SingleFlight:
+    def __init__(self, linger=0.0):
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = {"calls": 0, "upstream": 0, "coalesced": 0, "reused": 0, "errors": 0}
+
+    def do(self, key, fn, reuse=True):
+        """
+        key が同じ呼び出しが進行中ならその完了を待って同じ結果を返す。
+        進行中でなければ fn() を実行する（leader）。fn の例外は待っていた全員に伝わる。
+        reuse=False では linger 中の完了済みの結果は使わず、進行中の呼び出しにだけ合流する。
+        """
+        return self.do_shared(key, fn, reuse)[0]
+
+    def do_shared(self, key, fn, reuse=True):
+        """do() と同じだが (result, shared) を返す。shared は他の呼び出しの結果を受け取った場合 True"""
+        now = time.monotonic()
+        with self._lock:
+            self._counters["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None and call.done_at is not None and (not reuse or now - call.done_at > self.linger):
+                # linger 期間切れ（または再利用しない呼び出し）
+                del self._calls[key]
+                call = None
+            if call is None:
+                self._purge_expired(now)
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+                self._counters["upstream"] += 1
+            else:
+                leader = False
+                if call.done_at is None:
+                    self._counters["coalesced"] += 1
+                else:
+                    self._counters["reused"] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                if call.error is not None or self.linger <= 0:
+                    # 失敗した結果は使い回さない
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                else:
+                    call.done_at = time.monotonic()
+            call.event.set()
+        return call.result, False
+
+    def _purge_expired(self, now):
+        expired = [k for k, c in self._calls.items() if c.done_at is not None and now - c.done_at > self.linger]
+        for k in expired:
+            del self._calls[k]
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+            out["in_flight"] = sum(1 for c in self._calls.values() if c.done_at is None)
+        calls = out["calls"]
+        out["saved_ratio"] = round((out["coalesced"] + out["reused"]) / calls, 3) if calls else 0.0
+        return out
+
+    def reset_stats(self):
+        with self._lock:
+            for k in self._counters:
+                self._counters[k] = 0
+
+
+# プロセス共有インスタンス（二度押し対策で 5 秒だけ結果を再利用）
+GROUP = SingleFlight(linger=5.0)
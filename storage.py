@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+データ永続化： user_data.json / app_data.json
+- パスは既定でカレントディレクトリ（従来どおり）。バッチ処理では利用者ごとのディレクトリを渡す
+- 書き込みは一時ファイル経由の置き換えで行い、途中で落ちても壊れたJSONを残さない
+- 読み直し → 書き換え → 保存 をひとまとまりにするときは path_lock(path) の中で行う（画面・バッチ処理で共通）
+"""
+
+import contextlib, os, json, tempfile, threading
+
+try:
+    import fcntl
+except ImportError:  # Windows などではプロセス間のロックは無し（同じプロセスのスレッド間だけ）
+    fcntl = None
+
+USER_FILE = "user_data.json"
+APP_FILE = "app_data.json"
+
+
+def empty_app():
+    return {"missions": {}, "meal_data": {}, "feedback": {}}
+
+
+def write_atomic(path, write, binary=False):
+    """write(f) で書いた一時ファイルで path を置き換える。一時ファイルは書き込みごとに別の名前にする
+    （同じ path を同時に書くスレッド・プロセスが一時ファイルを取り合わないように）。失敗したら一時ファイルは消す。
+    binary=True なら f はバイナリ（bytes を書く）"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with (os.fdopen(fd, "wb") if binary else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def path_lock(path):
+    """
+    path の読み直し〜保存を、同じプロセスの他のスレッド・（fcntl が使えれば）他のプロセスと順番にする。
+    ロックファイルは <path>.lock。入れ子にはしないこと
+    """
+    key = os.path.abspath(path)
+    with _path_locks_guard:
+        lock = _path_locks.setdefault(key, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{key}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_json(path, data):
+    write_atomic(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+
+
+def load_user(path=USER_FILE):
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+    return None
+
+
+def save_user(data, path=USER_FILE):
+    _write_json(path, data)
+
+
+def load_app(path=APP_FILE):
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return empty_app()
+    return empty_app()
+
+
+def save_app(data, path=APP_FILE):
+    _write_json(path, data)
+
+
+def normalize_meal_data(md):
+    """古い形式の食事記録（文字列だけ・name / food キー）を {"item", "intake"} にそろえる（md をその場で書き換える）"""
+    for dkey, dd in md.items():
+        for meal in ["朝食","昼食","夕食","間食"]:
+            items = dd.get(meal, [])
+            new_items = []
+            for it in items:
+                if isinstance(it, str):
+                    new_items.append({"item": it, "intake": "普通"})
+                elif isinstance(it, dict) and ("item" in it or "name" in it or "food" in it):
+                    name = it.get("item") or it.get("name") or it.get("food")
+                    intake = it.get("intake") or it.get("amount_label") or "普通"
+                    new_items.append({"item": name, "intake": intake})
+                else:
+                    pass
+            dd[meal] = new_items
+        md[dkey] = dd
+    return md
+
+
+def find_user_dirs(users_root):
+    """users_root 直下で user_data.json を持つディレクトリ（利用者ごとの保存場所）"""
+    out = []
+    for name in sorted(os.listdir(users_root)):
+        d = os.path.join(users_root, name)
+        if os.path.isfile(os.path.join(d, USER_FILE)):
+            out.append(d)
+    return out
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""app_store.py（セッション間で共有する app_data の copy-on-write）のテスト"""
+
+import os, threading
+
+import pytest
+
+import app_bench
+import app_store
+import date_index
+import meal_pack
+import storage
+from app_store import CowSection
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "file.py")
+
+
+@pytest.fixture
+def user_dir(tmp_path, monkeypatch):
+    d = app_bench.write_dataset(str(tmp_path), users=1, years=1)[0]
+    monkeypatch.chdir(d)
+    for key in ("OPENAI_API_KEY", "OPENAI_KEY", "APP_DEBUG"):
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setenv("LLM_LEDGER_PATH", "")
+    return d
+
+
+def _meal(item):
+    return {"朝食": [{"item": item, "intake": "普通"}], "昼食": [], "夕食": [], "間食": []}
+
+
+@pytest.fixture
+def app_path(tmp_path):
+    path = str(tmp_path / storage.APP_FILE)
+    app = storage.empty_app()
+    app["meal_data"] = {"2026-01-01": _meal("ごはん"), "2026-01-02": _meal("パン")}
+    app["missions"] = {"2026-01-01": {"selected": "a", "status": {"a": False}}}
+    storage.save_app(app, path)
+    return path
+
+
+def test_cow_section_reads_share_and_writes_copy():
+    base = {"d1": {"x": [1]}, "d2": {"x": [2]}}
+    sec = CowSection(base)
+    assert sec.get("d1") is base["d1"]
+    assert not sec._own
+    sec["d1"]["x"].append(9)
+    assert base["d1"] == {"x": [1]}
+    assert sec.get("d1") == {"x": [1, 9]}
+    sec["d3"] = {"x": [3]}
+    del sec["d2"]
+    assert "d2" not in sec and sec.get("d2") is None and "d2" in base
+    assert sorted(sec) == ["d1", "d3"] and len(sec) == 2
+    assert sec.merged() == {"d1": {"x": [1, 9]}, "d3": {"x": [3]}}
+    assert sorted(sec.changed_days()[0]) == ["d1", "d3"] and sec.changed_days()[1] == ["d2"]
+
+
+def test_cow_section_drop_clean_keeps_unsaved_edits():
+    base = {"d1": {"x": 1}, "d2": {"x": 2}}
+    sec = CowSection(base)
+    sec["d1"]  # 読んだだけの自分用コピー
+    sec["d2"]["x"] = 5
+    assert sec.drop_clean() > 0
+    assert list(sec._own) == ["d2"]
+    sec.rebase({"d1": {"x": 1}, "d2": {"x": 2}, "d4": {"x": 4}})
+    assert sec.get("d2") == {"x": 5} and "d4" in sec
+
+
+def test_shared_meals_are_packed_and_edits_get_dicts(app_path):
+    store = app_store.AppStore()
+    app = store.open(app_path)
+    assert isinstance(app["meal_data"].get("2026-01-01"), meal_pack.PackedDay)
+    day = app["meal_data"]["2026-01-01"]
+    assert type(day) is dict
+    day["昼食"].append({"item": "魚", "intake": "多め"})
+    store.save(app, app_path)
+    assert storage.load_app(app_path)["meal_data"]["2026-01-01"]["昼食"] == [{"item": "魚", "intake": "多め"}]
+    assert isinstance(app["meal_data"]._base["2026-01-01"], meal_pack.PackedDay)
+
+
+def test_save_rebases_on_other_sessions_saves(app_path):
+    """別々のセッションが違う日を書き換えて保存しても、先に保存した分を消さない"""
+    store = app_store.AppStore()
+    a, b = store.open(app_path), store.open(app_path)
+    a["meal_data"]["2026-01-03"] = _meal("魚")
+    b["missions"]["2026-01-01"]["status"]["a"] = True
+    store.save(a, app_path)
+    store.save(b, app_path)
+    saved = storage.load_app(app_path)
+    assert saved["meal_data"]["2026-01-03"] == _meal("魚")
+    assert saved["missions"]["2026-01-01"]["status"]["a"] is True
+    # 保存のたびに新しい共有の内容ができ、a も次の touch() で乗り換える
+    store.touch(a)
+    assert a["missions"].get("2026-01-01")["status"]["a"] is True
+
+
+def test_concurrent_saves_are_serialized(app_path):
+    store = app_store.AppStore()
+    apps = [store.open(app_path) for _ in range(8)]
+    for i, app in enumerate(apps):
+        app["feedback"][f"2026-02-{i + 1:02d}"] = f"fb{i}"
+    threads = [threading.Thread(target=store.save, args=(app, app_path)) for app in apps]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(storage.load_app(app_path)["feedback"]) == [f"2026-02-{i + 1:02d}" for i in range(8)]
+
+
+def test_date_index_is_carried_across_saves(app_path):
+    store = app_store.AppStore()
+    app = store.open(app_path)
+    first = store.date_index(app, "meal_data", date_index.has_meals)
+    assert store.date_index(app, "meal_data", date_index.has_meals) is first
+    app["meal_data"]["2026-03-01"] = _meal("卵")
+    app["meal_data"]["2026-01-02"] = {"朝食": [], "昼食": [], "夕食": [], "間食": []}
+    overlay = store.date_index(app, "meal_data", date_index.has_meals)
+    assert "2026-03-01" in overlay and "2026-01-02" not in overlay
+    store.save(app, app_path)
+    carried = store.date_index(app, "meal_data", date_index.has_meals)
+    rebuilt = date_index.DateIndex.of(app["meal_data"], date_index.has_meals)
+    assert carried.months() == rebuilt.months()
+    assert all(carried.days_in(m) == rebuilt.days_in(m) for m in rebuilt.months())
+
+
+def _private_days(app_data):
+    return {name: len(sec._own) for name, sec in app_data.items() if hasattr(sec, "_own")}
+
+
+def test_read_only_render_keeps_no_private_copies(user_dir):
+    """履歴・食事・ミッションの画面を見るだけでは、共有の日を自分用にコピーしない"""
+    testing = pytest.importorskip("streamlit.testing.v1")
+    at = testing.AppTest.from_file(APP, default_timeout=60).run()
+    assert not at.exception
+    pages = ["mission_history", "feedback_history", "meal", "today_mission_display", "mission", "feedback"]
+    for page in pages:
+        at.session_state["model"].nav.go(page)
+        at.run()
+        assert not at.exception, [e.message for e in at.exception]
+        assert _private_days(at.session_state.app_data) == {"missions": 0, "meal_data": 0, "feedback": 0}, page
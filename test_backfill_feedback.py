@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""backfill_feedback.py（過去日のフィードバック一括生成）のテスト"""
+
+import asyncio, os
+
+import pytest
+
+import backfill_feedback
+import llm
+import ratelimit
+import storage
+
+
+def _meal(item):
+    return {"朝食": [{"item": item, "intake": "普通"}], "昼食": [], "夕食": [], "間食": []}
+
+
+EMPTY = {"朝食": [], "昼食": [], "夕食": [], "間食": []}
+
+
+@pytest.fixture
+def user_dir(tmp_path):
+    storage.save_user({"user_id": "u-test", "age": 30, "gender": "女性", "self_esteem_level": "普通"},
+                      str(tmp_path / storage.USER_FILE))
+    app = storage.empty_app()
+    app["meal_data"] = {"2026-01-01": _meal("ごはん"), "2026-01-02": _meal("パン"), "2026-01-03": EMPTY,
+                        "2026-01-04": _meal("魚"), "2026-01-05": _meal("卵")}
+    app["feedback"] = {"2026-01-02": "既にある"}
+    storage.save_app(app, str(tmp_path / storage.APP_FILE))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """上流を呼ばずに、呼ばれた順に "fb1", "fb2", ... を返す。fail_on の回で失敗する"""
+    calls = []
+    fail_on = set()
+
+    async def fake(aclient, messages, **kw):
+        calls.append(kw.get("user"))
+        if len(calls) in fail_on:
+            raise RuntimeError("upstream")
+        return f"fb{len(calls)}"
+
+    monkeypatch.setattr(llm, "async_chat_completion_text", fake)
+    return calls, fail_on
+
+
+def _run(user_dir, **kw):
+    return asyncio.run(backfill_feedback.run(None, [user_dir], 2, **kw))[0]
+
+
+def _app(user_dir):
+    return storage.load_app(os.path.join(user_dir, storage.APP_FILE))
+
+
+def test_missing_dates_skips_empty_and_existing(user_dir):
+    app = _app(user_dir)
+    assert backfill_feedback.missing_dates(app) == ["2026-01-01", "2026-01-04", "2026-01-05"]
+    assert backfill_feedback.missing_dates(app, since="2026-01-02", until="2026-01-04") == ["2026-01-04"]
+
+
+def test_merge_into_app_adds_only_missing_days(user_dir):
+    path = os.path.join(user_dir, storage.APP_FILE)
+    n = backfill_feedback.merge_into_app(path, {"2026-01-01": "新しい", "2026-01-02": "上書きしない"})
+    assert n == 1
+    fb = _app(user_dir)["feedback"]
+    assert fb["2026-01-01"] == "新しい" and fb["2026-01-02"] == "既にある"
+    assert backfill_feedback.merge_into_app(path, {}) == 0
+
+
+def test_checkpoint_ignores_torn_last_line(tmp_path):
+    path = str(tmp_path / backfill_feedback.CHECKPOINT_FILE)
+    backfill_feedback.append_checkpoint(path, "2026-01-01", {"text": "a"})
+    backfill_feedback.append_checkpoint(path, "2026-01-04", {"text": "b"})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"date": "2026-01-05", "feedb')
+    assert backfill_feedback.load_checkpoint(path) == {"2026-01-01": {"text": "a"}, "2026-01-04": {"text": "b"}}
+    assert backfill_feedback.load_checkpoint(str(tmp_path / "none.jsonl")) == {}
+
+
+def test_backfill_generates_missing_days(user_dir, fake_llm):
+    calls, _ = fake_llm
+    stats = _run(user_dir)
+    assert (stats["targets"], stats["generated"], stats["merged"], stats["failed"]) == (3, 3, 3, 0)
+    assert set(calls) == {"u-test"}
+    fb = _app(user_dir)["feedback"]
+    assert sorted(fb) == ["2026-01-01", "2026-01-02", "2026-01-04", "2026-01-05"]
+    assert fb["2026-01-01"]["meta"]["backfilled"] is True
+    assert not os.path.exists(os.path.join(user_dir, backfill_feedback.CHECKPOINT_FILE))
+
+
+def test_resume_merges_checkpoint_before_calling(user_dir, fake_llm):
+    """中断した回のチェックポイントは先に反映し、その日は呼び直さない"""
+    calls, _ = fake_llm
+    ckpt = os.path.join(user_dir, backfill_feedback.CHECKPOINT_FILE)
+    backfill_feedback.append_checkpoint(ckpt, "2026-01-01", {"text": "前回の分", "meta": {}})
+    assert _run(user_dir, dry_run=True)["missing"] == ["2026-01-04", "2026-01-05"]
+    stats = _run(user_dir)
+    assert stats["resumed"] == 1 and stats["generated"] == 2 and len(calls) == 2
+    assert _app(user_dir)["feedback"]["2026-01-01"]["text"] == "前回の分"
+
+
+def test_failed_days_are_left_for_next_run(user_dir, fake_llm):
+    calls, fail_on = fake_llm
+    fail_on.add(1)
+    stats = _run(user_dir)
+    assert stats["failed"] == 1 and stats["generated"] == 2
+    assert len(backfill_feedback.missing_dates(_app(user_dir))) == 1
+    assert _run(user_dir)["generated"] == 1
+    assert backfill_feedback.missing_dates(_app(user_dir)) == []
+
+
+def test_quota_defers_rest_without_failing(user_dir, monkeypatch):
+    monkeypatch.setattr(ratelimit, "LIMITER", ratelimit.RateLimiter(user_daily_requests=1))
+
+    async def fake(aclient, messages, user=None, **kw):
+        ratelimit.LIMITER.acquire(user=user)
+        return "ok"
+
+    monkeypatch.setattr(llm, "async_chat_completion_text", fake)
+    stats = _run(user_dir)
+    assert (stats["generated"], stats["deferred"], stats["failed"]) == (1, 2, 0)
+    assert "quota" in stats
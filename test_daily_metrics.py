@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""daily_metrics.py（列指向の日別指標）のテスト"""
+
+import datetime, os
+
+import pytest
+
+import daily_metrics
+import storage
+from nutrition import calc_nutrition
+
+
+def _meal(item, intake="普通"):
+    return {"朝食": [{"item": item, "intake": intake}], "昼食": [], "夕食": [], "間食": []}
+
+
+@pytest.fixture
+def app_path(tmp_path):
+    path = str(tmp_path / storage.APP_FILE)
+    app = storage.empty_app()
+    app["meal_data"] = {"2026-01-01": _meal("ごはん"), "2026-01-03": _meal("魚", "多め"),
+                        "2026-02-01": _meal("パン")}
+    app["missions"] = {"2026-01-01": {"selected": "a", "status": {"a": True}},
+                       "2026-01-02": {"selected": "b", "status": {"b": False}},
+                       "2026-01-03": {"selected": None, "status": {}}}
+    app["feedback"] = {"2026-01-03": "よくできました"}
+    storage.save_app(app, path)
+    return path
+
+
+def _cal(meals):
+    return calc_nutrition(meals)[0]["cal"]
+
+
+def test_range_queries(app_path):
+    dm = daily_metrics.DailyMetrics(app_path).fresh()
+    start, end = daily_metrics.month_range("2026-01")
+    assert (start, end) == (datetime.date(2026, 1, 1), datetime.date(2026, 1, 31))
+    assert dm.logged_days(start, end) == 2
+    assert dm.total("cal", start, end) == pytest.approx(_cal(_meal("ごはん")) + _cal(_meal("魚", "多め")))
+    assert dm.mean("cal", start, end) == pytest.approx(dm.total("cal", start, end) / 2)
+    assert dm.achievement(start, end) == (2, 1, 0.5)
+    assert dm.feedback_days(start, end) == 1
+    assert dm.series("items", "2026-01-01", "2026-01-04") == [1, 0, 1, 0]
+    assert dm.row("2026-01-02")["mission"] == 0
+    # 範囲外・記録の無い期間
+    assert dm.mean("cal", "2020-01-01", "2020-12-31") is None
+    assert dm.row("2000-01-01") is None
+
+
+def test_sync_rewrites_only_changed_days_and_grows(app_path):
+    dm = daily_metrics.for_app(app_path)
+    ino = os.stat(dm.path).st_ino
+    app = storage.load_app(app_path)
+    prev = daily_metrics.source_stamp(app_path)
+    app["meal_data"]["2026-01-02"] = _meal("肉")
+    storage.save_app(app, app_path)
+    daily_metrics.sync(app_path, app, ["2026-01-02"], prev)
+    assert os.stat(dm.path).st_ino == ino
+    assert dm.row("2026-01-02")["items"] == 1
+    assert dm._m.stamp == daily_metrics.source_stamp(app_path)
+
+    # 今の範囲より後の日は、広げたファイルに置き換えて書く
+    prev = daily_metrics.source_stamp(app_path)
+    later = "2029-06-01"
+    app["meal_data"][later] = _meal("卵")
+    storage.save_app(app, app_path)
+    daily_metrics.sync(app_path, app, [later], prev)
+    assert dm.row(later)["items"] == 1
+    assert dm.row("2026-01-01")["cal"] == pytest.approx(_cal(_meal("ごはん")))
+
+
+def test_outside_change_rebuilds(app_path):
+    dm = daily_metrics.DailyMetrics(app_path).fresh()
+    app = storage.load_app(app_path)
+    app["feedback"]["2026-01-01"] = "別の経路で追加"
+    storage.save_app(app, app_path)
+    os.utime(app_path, ns=(1, 1))
+    assert dm.fresh().feedback_days("2026-01-01", "2026-01-31") == 2
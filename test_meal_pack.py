@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""meal_pack.py（食事記録の詰めた形）のテスト"""
+
+import copy, random
+
+import app_bench
+import meal_pack
+import storage
+from meal_pack import PackedDay
+
+DAY = {
+    "朝食": [{"item": "ごはん", "intake": "普通"}, {"item": "卵", "intake": "多め"}],
+    "昼食": [{"item": "まだ番号の無い品目", "intake": "少なめ"}],
+    "夕食": [],
+    "間食": [{"item": None, "intake": "ひと口"}],
+}
+
+
+def test_pack_round_trip():
+    packed = PackedDay.pack(DAY)
+    assert packed is not None
+    assert packed == DAY and packed.to_dict() == DAY
+    assert packed["朝食"] == DAY["朝食"]
+    assert list(packed) == list(DAY)
+    assert packed.count() == 4
+
+
+def test_partial_slots_keep_their_order():
+    packed = PackedDay.pack({"朝食": DAY["朝食"], "昼食": []})
+    assert list(packed) == ["朝食", "昼食"]
+    assert "夕食" not in packed
+    assert packed.get("夕食") is None
+
+
+def test_unpackable_days_are_left_as_dicts():
+    odd = [
+        {"昼食": [], "朝食": []},
+        {"朝食": [{"item": "ごはん", "intake": "普通", "memo": "x"}]},
+        {"朝食": [{"item": 1, "intake": "普通"}]},
+        {"朝食": ({"item": "ごはん", "intake": "普通"},)},
+        {"朝食": [], "夜食": []},
+    ]
+    for meals in odd:
+        assert PackedDay.pack(meals) is None
+    packed = meal_pack.pack_meal_data({"2026-01-01": DAY, "2026-01-02": odd[1]})
+    assert isinstance(packed["2026-01-01"], PackedDay)
+    assert packed["2026-01-02"] is odd[1]
+
+
+def test_deepcopy_returns_a_plain_dict():
+    packed = PackedDay.pack(DAY)
+    copied = copy.deepcopy({"d": packed})["d"]
+    assert type(copied) is dict and copied == DAY
+    copied["朝食"].append({"item": "パン", "intake": "普通"})
+    assert packed.count() == 4
+    assert meal_pack.plain(packed) == DAY
+    assert meal_pack.plain(DAY) is DAY
+
+
+def test_compact_round_trip():
+    md = app_bench.synth_app(random.Random(1), years=0.2)["meal_data"]
+    md = storage.normalize_meal_data(md)
+    md["2020-01-01"] = {"朝食": [{"item": "ごはん", "intake": "普通", "memo": "x"}]}
+    compact = meal_pack.to_compact(meal_pack.pack_meal_data(md))
+    assert "2020-01-01" in compact["loose"]
+    restored = meal_pack.from_compact(compact)
+    assert {d: meal_pack.plain(v) for d, v in restored.items()} == md
+    assert list(restored) == sorted(md)
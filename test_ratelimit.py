@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""ratelimit.py（LLM 呼び出しのレート制限）のテスト"""
+
+import threading, time
+
+import pytest
+
+import ratelimit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills_with_time():
+    clock = FakeClock()
+    b = ratelimit.TokenBucket(60, clock)
+    b.take(60)
+    assert b.time_until(1) == pytest.approx(1.0)
+    clock.now = 0.5
+    assert b.time_until(1) == pytest.approx(0.5)
+    clock.now = 120
+    assert b.time_until(60) == 0.0
+
+
+def test_user_daily_requests_quota():
+    lim = ratelimit.RateLimiter(user_daily_requests=2)
+    lim.acquire(user="a")
+    lim.acquire(user="a")
+    with pytest.raises(ratelimit.QuotaExceeded):
+        lim.acquire(user="a")
+    # 他の利用者・利用者なしの呼び出しは数えない
+    lim.acquire(user="b")
+    lim.acquire()
+    assert lim.stats()["quota_rejects"] == 1
+
+
+def test_user_daily_tokens_quota_and_settle():
+    lim = ratelimit.RateLimiter(user_daily_tokens=100)
+    lim.acquire(tokens=80, user="a")
+    with pytest.raises(ratelimit.QuotaExceeded):
+        lim.acquire(tokens=30, user="a")
+    # 実際は 50 しか使わなかった分を精算すると、次の呼び出しが通る
+    lim.settle("a", 80, 50)
+    lim.acquire(tokens=30, user="a")
+    assert lim.user_usage("a")["tokens"] == 80
+
+
+def test_refund_returns_request_and_tokens():
+    lim = ratelimit.RateLimiter(tpm=1000, user_daily_requests=1)
+    lim.acquire(tokens=400, user="a")
+    before = lim.tokens.tokens
+    lim.refund("a", 400)
+    usage = lim.user_usage("a")
+    assert (usage["requests"], usage["tokens"]) == (0, 0)
+    assert lim.tokens.tokens == pytest.approx(min(1000, before + 400), abs=1)
+    lim.acquire(tokens=400, user="a")
+
+
+def test_penalize_without_bucket_returns_wait_to_caller():
+    assert ratelimit.RateLimiter().penalize(3.0) == 3.0
+
+
+def test_penalize_drains_request_bucket():
+    clock = FakeClock()
+    lim = ratelimit.RateLimiter(rpm=60, clock=clock)
+    assert lim.penalize(2.0) == 0.0
+    assert lim.requests.time_until(1) == pytest.approx(3.0)
+    with pytest.raises(ratelimit.RateLimitTimeout):
+        lim.acquire(deadline_s=0)
+
+
+def test_interactive_goes_before_background():
+    lim = ratelimit.RateLimiter(rpm=60)
+    lim.requests.tokens = 0.0
+    order = []
+
+    def call(name, priority):
+        lim.acquire(priority=priority, deadline_s=10)
+        order.append(name)
+
+    bg = threading.Thread(target=call, args=("background", ratelimit.BACKGROUND))
+    bg.start()
+    while lim.stats()["queued_background"] == 0:
+        time.sleep(0.01)
+    fg = threading.Thread(target=call, args=("interactive", ratelimit.INTERACTIVE))
+    fg.start()
+    fg.join()
+    bg.join()
+    assert order == ["interactive", "background"]
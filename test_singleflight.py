@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""singleflight.py（同一リクエストの合流）のテスト"""
+
+import threading, time
+
+import pytest
+
+import singleflight
+
+
+def test_request_key_is_stable():
+    a = singleflight.request_key("m", [{"role": "user", "content": "x"}], temperature=0.2, max_tokens=10)
+    b = singleflight.request_key("m", [{"role": "user", "content": "x"}], max_tokens=10, temperature=0.2)
+    assert a == b
+    assert a != singleflight.request_key("m", [{"role": "user", "content": "y"}], temperature=0.2, max_tokens=10)
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    group = singleflight.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(group.do_shared("k", fn)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(group.do_shared("k", fn))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    while group.stats()["coalesced"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for t in [leader] + followers:
+        t.join()
+    assert len(calls) == 1
+    assert sorted(results) == [("result", False)] + [("result", True)] * 3
+    assert group.stats()["in_flight"] == 0
+
+
+def test_linger_reuses_result_unless_reuse_false():
+    group = singleflight.SingleFlight(linger=60)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return len(calls)
+
+    assert group.do_shared("k", fn) == (1, False)
+    assert group.do_shared("k", fn) == (1, True)
+    # 明示的に作り直すときは完了済みの結果を使わない
+    assert group.do_shared("k", fn, reuse=False) == (2, False)
+    assert group.do("k", fn) == 2
+    assert group.stats()["reused"] == 2
+
+
+def test_no_linger_calls_again():
+    group = singleflight.SingleFlight(linger=0)
+    calls = []
+    group.do("k", lambda: calls.append(1))
+    group.do("k", lambda: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_errors_are_not_cached():
+    group = singleflight.SingleFlight(linger=60)
+
+    def boom():
+        raise ValueError("upstream")
+
+    with pytest.raises(ValueError):
+        group.do("k", boom)
+    assert group.do("k", lambda: "ok") == "ok"
+    assert group.stats()["errors"] == 1
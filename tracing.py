@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+再実行（rerun）ごとの区間計測
+- with span("storage.save_app"): ... で区間の所要時間を測る。入れ子にでき、1回の実行分を1つの記録（run）にまとめる
+- run は file.py の route()（全体の再実行）と st.fragment（部分の再実行）が start_run() で始める。
+  run の外で測った区間（on_click のコールバック内の保存など）は、次に始まる run の先頭に入れる
+- 画面ごとに直近 WINDOW 回の所要時間を持ち、stats() でヒストグラムと p50 / p95 を返す（プロセス共通の TRACER）
+- 記録は JSON Lines で書き出せる：デバッグ表示のダウンロード、または環境変数 TRACE_PATH を設定すると毎回追記
+- 集計コマンドで JSON Lines から画面別・区間別の p50 / p95 を出す
+
+使い方:
+    python tracing.py report trace.jsonl
+    python tracing.py report trace.jsonl --page meal --json
+"""
+
+import argparse, bisect, collections, contextlib, datetime, json, os, sys, threading, time
+
+from llm_ledger import percentile
+
+WINDOW = 500
+# 所要時間（ms）のヒストグラムの区切り
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _bucket_label(i):
+    if i == 0:
+        return f"<={BUCKETS_MS[0]}ms"
+    if i == len(BUCKETS_MS):
+        return f">{BUCKETS_MS[-1]}ms"
+    return f"{BUCKETS_MS[i - 1]}-{BUCKETS_MS[i]}ms"
+
+
+def trace_path():
+    """毎回の記録を追記するファイル（未設定なら書かない）"""
+    return os.getenv("TRACE_PATH", "")
+
+
+class _Run:
+    __slots__ = ("page", "t0", "ts", "spans", "depth")
+
+    def __init__(self, page, carried):
+        self.page = page
+        self.t0 = time.perf_counter()
+        self.ts = datetime.datetime.now().isoformat(timespec="seconds")
+        # run の外で測った区間（コールバックなど）は start_ms を負の値で先頭に置く
+        self.spans = [{"name": s["name"], "depth": 0, "start_ms": round((s["t0"] - self.t0) * 1000, 2), "ms": s["ms"]}
+                      for s in carried]
+        self.depth = 0
+
+
+class Tracer:
+    def __init__(self, window=WINDOW):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._window = window
+        self._by_page = {}
+        self._recent = collections.deque(maxlen=window)
+
+    # -------------------------
+    # 計測
+    # -------------------------
+    def _state(self):
+        loc = self._local
+        if not hasattr(loc, "run"):
+            loc.run = None
+            loc.last = None
+            loc.pending = collections.deque(maxlen=50)
+        return loc
+
+    @contextlib.contextmanager
+    def span(self, name):
+        loc = self._state()
+        run = loc.run
+        depth = run.depth if run is not None else 0
+        if run is not None:
+            run.depth += 1
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = round((time.perf_counter() - t0) * 1000, 2)
+            if run is not None:
+                run.depth -= 1
+                run.spans.append({"name": name, "depth": depth, "start_ms": round((t0 - run.t0) * 1000, 2), "ms": ms})
+            else:
+                loc.pending.append({"name": name, "t0": t0, "ms": ms})
+
+    def traced(self, name):
+        """関数を span で包むデコレーター（traced("storage.save_app")(save_app) のようにも使う）"""
+        def deco(fn):
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            wrapper.__name__ = getattr(fn, "__name__", name)
+            wrapper.__doc__ = fn.__doc__
+            return wrapper
+        return deco
+
+    def in_run(self):
+        """このスレッドで run の記録中か（fragment が全体の再実行の中で描かれているか）"""
+        return self._state().run is not None
+
+    @contextlib.contextmanager
+    def start_run(self, page):
+        """1回の実行の記録を始める。すでに run の中なら（fragment が全体の再実行の中で描かれたとき）ただの span になる"""
+        loc = self._state()
+        if loc.run is not None:
+            with self.span(page):
+                yield
+            return
+        run = loc.run = _Run(page, list(loc.pending))
+        loc.pending.clear()
+        try:
+            yield
+        finally:
+            loc.run = None
+            loc.last = self._finish(run)
+
+    def _finish(self, run):
+        ms = round((time.perf_counter() - run.t0) * 1000, 2)
+        rec = {"ts": run.ts, "page": run.page, "ms": ms,
+               "spans": sorted(run.spans, key=lambda s: s["start_ms"])}
+        with self._lock:
+            q = self._by_page.get(run.page)
+            if q is None:
+                q = self._by_page[run.page] = collections.deque(maxlen=self._window)
+            q.append(ms)
+            self._recent.append(rec)
+        path = trace_path()
+        if path:
+            try:
+                with self._lock, open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            except OSError:
+                # 計測の書き出しで画面を止めない
+                pass
+        return rec
+
+    # -------------------------
+    # 集計・書き出し
+    # -------------------------
+    def last_run(self):
+        """このスレッド（Streamlit ではこのセッションの実行）で最後に終わった run の記録"""
+        return self._state().last
+
+    def stats(self):
+        """画面ごとの直近 WINDOW 回の所要時間"""
+        with self._lock:
+            by_page = {k: list(q) for k, q in self._by_page.items()}
+        out = {}
+        for page, xs in sorted(by_page.items()):
+            hist = [0] * (len(BUCKETS_MS) + 1)
+            for ms in xs:
+                hist[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+            out[page] = {
+                "runs": len(xs),
+                "p50_ms": round(percentile(xs, 50), 2),
+                "p95_ms": round(percentile(xs, 95), 2),
+                "max_ms": max(xs),
+                "hist": {_bucket_label(i): n for i, n in enumerate(hist) if n},
+            }
+        return out
+
+    def export_jsonl(self):
+        """直近 WINDOW 回分の記録を JSON Lines の文字列で返す"""
+        with self._lock:
+            recs = list(self._recent)
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs)
+
+    def reset(self):
+        with self._lock:
+            self._by_page.clear()
+            self._recent.clear()
+
+
+# プロセス共有インスタンス
+TRACER = Tracer()
+span = TRACER.span
+traced = TRACER.traced
+start_run = TRACER.start_run
+in_run = TRACER.in_run
+
+
+# -------------------------
+# CLI：書き出した JSON Lines の集計
+# -------------------------
+def summarize(records, page=None):
+    pages = collections.defaultdict(list)
+    spans = collections.defaultdict(list)
+    for r in records:
+        if page and r.get("page") != page:
+            continue
+        pages[r.get("page", "-")].append(r.get("ms", 0.0))
+        for s in r.get("spans", []):
+            spans[s["name"]].append(s["ms"])
+
+    def row(xs):
+        return {"count": len(xs), "p50_ms": round(percentile(xs, 50), 2), "p95_ms": round(percentile(xs, 95), 2),
+                "total_ms": round(sum(xs), 2)}
+    return {
+        "pages": {k: row(v) for k, v in sorted(pages.items())},
+        "spans": {k: row(v) for k, v in sorted(spans.items(), key=lambda kv: -sum(kv[1]))},
+    }
+
+
+def _read_jsonl(path):
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                continue
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="区間計測（JSON Lines）の集計")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("report", help="画面別・区間別の p50 / p95")
+    rp.add_argument("path", nargs="?", default=trace_path() or "trace.jsonl")
+    rp.add_argument("--page", help="この画面の記録だけ集計する")
+    rp.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = ap.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"{args.path} がありません", file=sys.stderr)
+        return 2
+    result = summarize(_read_jsonl(args.path), page=args.page)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    print(f"{'画面':24} {'回数':>6} {'p50(ms)':>10} {'p95(ms)':>10}")
+    for page, r in result["pages"].items():
+        print(f"{page:24} {r['count']:>6} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f}")
+    print()
+    print(f"{'区間':24} {'回数':>6} {'p50(ms)':>10} {'p95(ms)':>10} {'合計(ms)':>10}")
+    for name, r in result["spans"].items():
+        print(f"{name:24} {r['count']:>6} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} {r['total_ms']:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())